@@ -12,7 +12,14 @@ APPS_DIR = PKG_DIR.parent / 'apps'
 
 CONFIG_FILE = APPS_DIR / 'apps.ini'
 
-APPS = config.Config.from_file(CONFIG_FILE)
+
+def __getattr__(name):
+    # APPS is loaded lazily on first access - from a snapshot unless apps.ini changed.
+    if name == 'APPS':
+        global APPS
+        APPS = config.Config.from_file(CONFIG_FILE, cache=True)
+        return APPS
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
 
 # TODO: consider https://pypi.python.org/pypi/pyvbox
 #       for scripting tests with virtualbox
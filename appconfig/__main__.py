@@ -4,8 +4,8 @@ import contextlib
 from clldutils.clilib import register_subcommands, get_parser_and_subparsers, ParserError
 from clldutils.loglib import Logging
 
+import appconfig
 import appconfig.commands
-from . import APPS
 
 
 def main(args=None, catch_all=False, parsed_args=None, log=None):
@@ -18,7 +18,8 @@ def main(args=None, catch_all=False, parsed_args=None, log=None):
         parser.print_help()
         return 1
 
-    args.apps = APPS
+    if args._command != 'validate':  # Loading APPS raises if the config is invalid.
+        args.apps = appconfig.APPS
 
     with contextlib.ExitStack() as stack:
         if not log:  # pragma: no cover
@@ -0,0 +1,133 @@
+# artifact.py - build a virtualenv once, ship it to all hosts of an app
+
+"""Prebuilt virtualenv artifacts.
+
+Apps are deployed to a test and a production host, and each would build the app's virtualenv -
+compiling C extensions and building static assets - itself. Since `venv_dir` is the same on all
+hosts, a virtualenv built on one host works on any other host with the same release of Ubuntu.
+
+The first host an app is deployed to builds the virtualenv as usual, then `pack` archives it as
+``<name>-<key>.tar.gz`` in `ARTIFACT_DIR` and copies it into the local cache (see
+`appconfig.cache`). The key is a fingerprint of everything the build depends on (see
+`appconfig.tasks.deployment.venv_fingerprint`). Other hosts `fetch` the artifact - from the local
+cache or from another host of the app - and `install` it: it is unpacked next to `venv_dir`,
+which is then switched to it atomically by replacing a symlink. The previous virtualenv is kept
+until the next install, because the running app still imports from it until it is restarted.
+"""
+import os
+import pathlib
+
+from fabric.api import sudo, run, get, put, settings, hide
+
+from . import cache
+
+__all__ = ['pack', 'fetch', 'install', 'ARTIFACT_DIR']
+
+ARTIFACT_DIR = pathlib.PurePosixPath('/var/cache/appconfig/venvs')
+
+#: Number of artifacts kept per app - on each host and locally.
+KEEP = 2
+
+
+def filename(app, key):
+    return '{0}-{1}.tar.gz'.format(app.name, key[:16])
+
+
+def remote_path(app, key):
+    return ARTIFACT_DIR / filename(app, key)
+
+
+def local_path(app, key):
+    return cache.cache_dir() / 'venvs' / filename(app, key)
+
+
+def prune_script(app):
+    return 'ls -t {0}/{1}-*.tar.gz | tail -n +{2} | xargs -r rm -f'.format(
+        ARTIFACT_DIR, app.name, KEEP + 1)
+
+
+def pack_script(app, key):
+    return '\n'.join([
+        'set -e',
+        'mkdir -p {0}'.format(ARTIFACT_DIR),
+        'tar -czf {0}.tmp -C {1}/ .'.format(remote_path(app, key), app.venv_dir),
+        'mv {0}.tmp {0}'.format(remote_path(app, key)),
+        prune_script(app),
+    ])
+
+
+def install_script(app, key, artifact=None):
+    venv = str(app.venv_dir).rstrip('/')
+    return '\n'.join([
+        'set -e',
+        'new={0}/.{1}-{2}'.format(app.venv_dir.parent, app.venv_dir.name, key[:16]),
+        'if [ "$(readlink {0})" = "$new" ]; then exit 0; fi'.format(venv),
+        'rm -rf $new && mkdir -p $new',
+        'tar -xzf {0} -C $new'.format(artifact or remote_path(app, key)),
+        'old=$(readlink {0} || true) moved=""'.format(venv),
+        # A virtualenv built in place is moved aside - only then is there no virtualenv at all:
+        'if [ -d {0} ] && [ ! -L {0} ]; then rm -rf {0}.old; mv {0} {0}.old; moved=1; fi'.format(
+            venv),
+        'ln -sfn $new {0}.tmp && mv -T {0}.tmp {0}'.format(venv),
+        # The running app keeps using the previous virtualenv until it is restarted (or switched,
+        # see `appconfig.tasks.deployment.switch`), so it is only removed by the next install:
+        'for d in {0}/.{1}-{2}; do'.format(app.venv_dir.parent, app.venv_dir.name, '?' * 16),
+        '  if [ "$d" != "$new" ] && [ "$d" != "$old" ]; then rm -rf "$d"; fi',
+        'done',
+        'if [ -z "$moved" ]; then rm -rf {0}.old; fi'.format(venv),
+    ])
+
+
+def _prune_local(app):
+    paths = sorted(
+        local_path(app, '').parent.glob('{0}-*.tar.gz'.format(app.name)),
+        key=lambda p: p.stat().st_mtime,
+        reverse=True)
+    for p in paths[KEEP:]:
+        p.unlink()
+
+
+def pack(app, key):
+    """Archive the virtualenv of `app` on the current host and copy it to the local cache."""
+    sudo(pack_script(app, key))
+    target = local_path(app, key)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    get(str(remote_path(app, key)), str(target) + '.tmp')
+    os.replace(str(target) + '.tmp', str(target))
+    _prune_local(app)
+
+
+def _exists(path):
+    with settings(hide('everything'), warn_only=True):
+        return run('test -f {0}'.format(path)).succeeded
+
+
+def fetch(app, key, hosts=()):
+    """Make the artifact available on the current host - if it has been built.
+
+    :param hosts: Other hosts of the app, to copy the artifact from if it's not in the local cache.
+    :return: Whether the artifact is available.
+    """
+    remote = str(remote_path(app, key))
+    if _exists(remote):
+        return True
+    local = local_path(app, key)
+    for host in hosts:
+        if local.exists():
+            break
+        with settings(host_string=host):
+            if _exists(remote):
+                local.parent.mkdir(parents=True, exist_ok=True)
+                get(remote, str(local) + '.tmp')
+                os.replace(str(local) + '.tmp', str(local))
+    if not local.exists():
+        return False
+    sudo('mkdir -p {0}'.format(ARTIFACT_DIR))
+    put(str(local), remote, use_sudo=True)
+    sudo(prune_script(app))
+    return True
+
+
+def install(app, key):
+    """Replace the virtualenv of `app` with the contents of the artifact."""
+    sudo(install_script(app, key))
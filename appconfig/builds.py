@@ -0,0 +1,155 @@
+# builds.py - compile native code once, install the binaries on all hosts
+
+"""Content-addressed cache of binaries built from source on the remote hosts.
+
+Some dependencies - bibutils, the collkey_icu Postgres extension - are compiled on each host
+which lacks them, which takes time and needs a compile toolchain on every host. `require`
+identifies a build by a key: a hash of its sources and of the parameters it depends on, e.g. the
+Ubuntu codename and the Postgres version. The build installs its files into a staging directory
+(like ``make install DESTDIR=...``), which is archived as ``<key>.tar.gz``
+
+- in `BUILD_DIR` on the host,
+- in the local cache (see `appconfig.cache`),
+- and in `BUILD_DIR` on the build host given as ``$APPCONFIG_BUILD_HOST``, if any,
+
+and then unpacked into ``/``. Hosts lacking the build get the archive uploaded from the local
+cache - or from the build host - and unpacked, without compiling and without installing the
+toolchain. The keys of the builds installed on a host are recorded in ``BUILD_DIR/installed``
+and reported by `appconfig.facts`, so a build is installed anew as soon as its sources change.
+"""
+import os
+import hashlib
+import pathlib
+
+from fabric.api import env, sudo, put, get, settings
+from fabtools.files import is_file
+
+from . import cache
+from . import facts
+from . import util
+
+__all__ = ['require', 'key', 'BUILD_DIR']
+
+BUILD_DIR = pathlib.PurePosixPath('/var/cache/appconfig/builds')
+
+#: Number of archives kept per build name on each host.
+KEEP = 2
+
+
+def key(name, sources=(), **params):
+    """Return the key of a build.
+
+    :param sources: Local files (`pathlib.Path`) the build compiles - or strings identifying
+        sources, e.g. the URL of a versioned tarball.
+    :param params: Parameters the binaries depend on.
+    """
+    h = hashlib.sha256()
+    for source in sources:
+        h.update(source.read_bytes() if isinstance(source, pathlib.Path) else source.encode())
+    for k in sorted(params):
+        h.update('{0}={1}'.format(k, params[k]).encode())
+    return '{0}-{1}'.format(name, h.hexdigest()[:16])
+
+
+def build_host():
+    return os.environ.get('APPCONFIG_BUILD_HOST') or None
+
+
+def filename(key):
+    return '{0}.tar.gz'.format(key)
+
+
+def remote_path(key):
+    return BUILD_DIR / filename(key)
+
+
+def local_path(key):
+    return cache.cache_dir() / 'builds' / filename(key)
+
+
+def stage_dir(key):
+    return pathlib.PurePosixPath('/tmp') / 'appconfig-build-{0}'.format(key)
+
+
+def prune_script(key):
+    return 'ls -t {0}/{1}-*.tar.gz | tail -n +{2} | xargs -r rm -f'.format(
+        BUILD_DIR, key.rpartition('-')[0], KEEP + 1)
+
+
+def pack_script(key):
+    # Only files and links are archived, so unpacking doesn't touch existing directories.
+    return '\n'.join([
+        'set -e',
+        'mkdir -p {0}'.format(BUILD_DIR),
+        '(cd {0} && find . -type f -o -type l | tar -czf {1}.tmp -T -)'.format(
+            stage_dir(key), remote_path(key)),
+        'mv {0}.tmp {0}'.format(remote_path(key)),
+        'rm -rf {0}'.format(stage_dir(key)),
+        prune_script(key),
+    ])
+
+
+def install_script(key, archive=None):
+    return '\n'.join([
+        'set -e',
+        'mkdir -p {0}/installed'.format(BUILD_DIR),
+        'tar -xzf {0} -C / --no-overwrite-dir'.format(archive or remote_path(key)),
+        'rm -f {0}/installed/{1}-*'.format(BUILD_DIR, key.rpartition('-')[0]),
+        'touch {0}/installed/{1}'.format(BUILD_DIR, key),
+    ])
+
+
+def fetch(key):
+    """Make sure the archive of build `key` is in the local cache - copying it from the build host.
+
+    :return: The local path of the archive or `None`.
+    """
+    local, host = local_path(key), build_host()
+    if not local.exists() and host:
+        with settings(host_string=host):
+            if is_file(str(remote_path(key))):
+                local.parent.mkdir(parents=True, exist_ok=True)
+                get(str(remote_path(key)), str(local) + '.tmp')
+                os.replace(str(local) + '.tmp', str(local))
+    return local if local.exists() else None
+
+
+def share(key):
+    """Copy the archive of build `key` from the current host to the local cache and build host."""
+    local, host = local_path(key), build_host()
+    local.parent.mkdir(parents=True, exist_ok=True)
+    get(str(remote_path(key)), str(local) + '.tmp')
+    os.replace(str(local) + '.tmp', str(local))
+    if host and host != env.host_string:
+        with settings(host_string=host):
+            sudo('mkdir -p {0}'.format(BUILD_DIR))
+            put(str(local), str(remote_path(key)), use_sudo=True)
+
+
+def require(name, build, sources=(), toolchain=(), **params):
+    """Install a build on the current host - from the cache or by running `build`.
+
+    :param build: Callable installing the build's files below the staging directory passed as
+        only argument. Only called if the build is neither installed nor cached.
+    :param toolchain: Deb packages needed to run `build` - only installed if it is called.
+    :return: The key of the build.
+    """
+    k = key(name, sources, **params)
+    host = facts.get()
+    if k in host.builds:
+        return k
+    archive = fetch(k)
+    if archive:
+        print('{0}: installing from the build cache'.format(k))
+        tmp = '/tmp/{0}'.format(filename(k))
+        put(str(archive), tmp)
+        sudo('\n'.join([install_script(k, archive=tmp), 'rm -f {0}'.format(tmp)]))
+    else:
+        print('{0}: not in the build cache, building'.format(k))
+        util.require_debs(toolchain)
+        sudo('rm -rf {0} && mkdir -p {0}'.format(stage_dir(k)))
+        build(stage_dir(k))
+        sudo('\n'.join([pack_script(k), install_script(k)]))
+        share(k)
+    host.builds.add(k)
+    return k
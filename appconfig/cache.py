@@ -0,0 +1,118 @@
+# cache.py - pickled snapshots of data derived from local files
+
+"""Persistent snapshots of data derived from local files.
+
+Snapshots live below ``$APPCONFIG_CACHE_DIR`` (default: ``~/.cache/appconfig``). A snapshot is
+stale as soon as the content of its source file or the salt (typically a hash of the code which
+produced it) changes. Setting ``APPCONFIG_NO_CACHE`` disables reading and writing snapshots.
+"""
+import os
+import pickle
+import hashlib
+import pathlib
+import tempfile
+
+__all__ = ['cache_dir', 'enabled', 'file_hash', 'Snapshot', 'Store']
+
+
+def cache_dir():
+    return pathlib.Path(
+        os.environ.get('APPCONFIG_CACHE_DIR') or pathlib.Path.home() / '.cache' / 'appconfig')
+
+
+def enabled():
+    return not os.environ.get('APPCONFIG_NO_CACHE')
+
+
+def file_hash(*paths):
+    """Return the SHA-256 hexdigest of the concatenated content of files.
+
+    >>> assert file_hash(__file__) != file_hash(__file__, __file__)
+    """
+    h = hashlib.sha256()
+    for p in paths:
+        with open(str(p), 'rb') as fp:
+            h.update(fp.read())
+    return h.hexdigest()
+
+
+def _dump(path, *objs):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            for obj in objs:
+                pickle.dump(obj, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, str(path))
+    except OSError:  # pragma: no cover
+        # A read-only or full cache dir must not break the caller.
+        return False
+    return True
+
+
+class Store(object):
+    """A pickled value which is not derived from a single file, e.g. memoized results.
+
+    The store is invalidated when `salt` changes.
+    """
+
+    def __init__(self, name, salt='', directory=None):
+        self.salt = salt
+        self.path = pathlib.Path(directory or cache_dir()) / '{0}.pickle'.format(name)
+
+    def load(self, default=None):
+        try:
+            with self.path.open('rb') as fp:
+                if pickle.load(fp) == self.salt:
+                    return pickle.load(fp)
+        except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+            pass
+        return default
+
+    def dump(self, value):
+        return _dump(self.path, self.salt, value)
+
+
+class Snapshot(object):
+    """A pickled value derived from `source`, keyed by the source's mtime and content hash.
+
+    The file holds two consecutive pickles: a small header which is checked first and the
+    payload, so stale snapshots are detected without unpickling the payload.
+    """
+
+    def __init__(self, source, name=None, salt='', directory=None):
+        self.source = pathlib.Path(source)
+        self.salt = salt
+        key = hashlib.sha1(str(self.source.resolve()).encode('utf8')).hexdigest()
+        self.path = pathlib.Path(directory or cache_dir()) / '{0}-{1}.pickle'.format(
+            name or self.source.stem, key[:12])
+
+    def _stat(self):
+        st = self.source.stat()
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        """Return the snapshotted value or None if there is no up-to-date snapshot."""
+        try:
+            with self.path.open('rb') as fp:
+                header = pickle.load(fp)
+                if header.get('salt') != self.salt:
+                    return None
+                if header.get('stat') == self._stat():
+                    return pickle.load(fp)
+                # mtime or size changed, e.g. after a `git checkout`: compare content.
+                if header.get('sha256') != file_hash(self.source):
+                    return None
+                value = pickle.load(fp)
+        except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+            return None
+        self.dump(value)
+        return value
+
+    def dump(self, value):
+        header = dict(salt=self.salt, stat=self._stat(), sha256=file_hash(self.source))
+        return _dump(self.path, header, value)
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
@@ -26,6 +26,13 @@ class NamedBitstream(object):
     def size_h(self):
         return format_size(self.size)
 
+    @property
+    def checksum(self):
+        """`(algorithm, hexdigest)` of the bitstream as recorded by CDSTAR - or `None`."""
+        props = self.bitstream._properties
+        if props.get('checksum'):
+            return props.get('checksum-algorithm', 'MD5').lower(), props['checksum'].lower()
+
     @property
     def url(self):
         return '{0}/bitstreams/{1}/{2}'.format(SERVICE_URL, self.oid, self.name)
@@ -0,0 +1,138 @@
+# coalesce.py - run many remote commands in one round trip
+
+"""Coalescing of independent remote commands.
+
+Each call of fabric's `sudo` or `run` opens a new SSH channel - and `sudo` a new sudo session.
+Within `commands()`, commands are queued and run as one generated shell script when the
+context is left (or `flush` is called)::
+
+    with coalesce.commands() as batch:
+        batch.sudo('systemctl start app-backup.timer')
+        status = batch.sudo('systemctl is-enabled app-backup.timer', warn_only=True)
+    print(status.return_code, status.stdout)
+
+Commands run in the order they were queued, but independently - a failing command does not
+stop the following ones. As with fabric, a failing command aborts after the script finished,
+unless it was queued with `warn_only=True` (or within `settings(warn_only=True)`). The
+current directory (`cd`) and `prefix` in effect when a command is queued apply to it.
+"""
+import shlex
+import uuid
+import contextlib
+
+from fabric.api import env, sudo, run, abort, settings
+from fabric.operations import _prefix_commands, _prefix_env_vars
+
+__all__ = ['Batch', 'commands']
+
+
+class Pending(object):
+    """The result of a queued command - available after the batch ran."""
+
+    def __init__(self, command, user=None, warn_only=False):
+        self.command = command
+        self.user = user
+        self.warn_only = warn_only
+        self.stdout = self.return_code = None
+
+    def __repr__(self):
+        return '<Pending {0!r}: {1}>'.format(self.command, self.return_code)
+
+    @property
+    def done(self):
+        return self.return_code is not None
+
+    @property
+    def failed(self):
+        if not self.done:
+            raise RuntimeError('command has not run yet: {0}'.format(self.command))
+        return self.return_code not in env.ok_ret_codes
+
+    @property
+    def succeeded(self):
+        return not self.failed
+
+
+class Batch(object):
+
+    def __init__(self):
+        self.queue = []
+        self.round_trips = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _add(self, command, user, warn_only, use_sudo):
+        if not use_sudo:
+            user = env.user
+        res = Pending(
+            _prefix_env_vars(_prefix_commands(command, 'remote')),
+            user=user,
+            warn_only=env.warn_only if warn_only is None else warn_only)
+        self.queue.append(res)
+        return res
+
+    def sudo(self, command, user=None, warn_only=None):
+        return self._add(command, user, warn_only, True)
+
+    def run(self, command, warn_only=None):
+        return self._add(command, None, warn_only, False)
+
+    def script(self, marker):
+        lines = []
+        for i, cmd in enumerate(self.queue):
+            if cmd.user:
+                c = 'sudo -u {0} -H sh -c {1}'.format(
+                    shlex.quote(cmd.user), shlex.quote(cmd.command))
+            else:
+                c = cmd.command
+            lines.append(
+                'out=$( ( {0} ) 2>&1 ); rc=$?; echo "{1} {2} $rc"; '
+                'if [ -n "$out" ]; then printf "%s\\n" "$out"; fi'.format(c, marker, i))
+        return '\n'.join(lines)
+
+    def parse(self, output, marker):
+        current = None
+        for line in output.splitlines():
+            if line.startswith(marker + ' '):
+                index, rc = line[len(marker) + 1:].split()
+                current = self.queue[int(index)]
+                current.stdout, current.return_code = [], int(rc)
+            elif current is not None:
+                current.stdout.append(line)
+        for cmd in self.queue:
+            if cmd.done:
+                cmd.stdout = '\n'.join(cmd.stdout)
+
+    def flush(self):
+        """Run all queued commands in one round trip."""
+        if not self.queue:
+            return
+        queue, marker = self.queue, 'appconfig-{0}'.format(uuid.uuid4().hex)
+        as_root = any(cmd.user != env.user for cmd in queue)
+        if not as_root:  # Only `run` commands - no need for sudo.
+            for cmd in queue:
+                cmd.user = None
+        # `cd`, `prefix` and `shell_env` have been applied when the commands were queued.
+        with settings(cwd='', command_prefixes=[], shell_env={}):
+            res = (sudo if as_root else run)(self.script(marker), warn_only=True, pty=False)
+        self.round_trips += 1
+        self.parse(res, marker)
+        self.queue = []
+        for cmd in queue:
+            if not cmd.done:
+                cmd.stdout, cmd.return_code = '', -1  # The script was aborted.
+        failed = [cmd for cmd in queue if cmd.failed and not cmd.warn_only]
+        if failed:
+            abort('\n'.join(
+                'command failed with return code {0}: {1}\n{2}'.format(
+                    cmd.return_code, cmd.command, cmd.stdout) for cmd in failed))
+        return queue
+
+
+@contextlib.contextmanager
+def commands():
+    """Queue commands run via the yielded `Batch`, running them when leaving the context."""
+    batch = Batch()
+    yield batch
+    batch.flush()
@@ -0,0 +1,117 @@
+"""
+Deploy many apps at once, running up to N deploys in parallel.
+
+Questions asked during deploy are answered non-interactively - with the defaults, unless
+specified via --answer. The secret keys of Django apps are kept, unless --answer
+"Recreate secret key=y" is given. HTTP basic auth passwords are read from environment variables
+APPCONFIG_PWD_<USER>.
+
+Deploy steps whose inputs did not change since the last deploy are skipped, unless --force is
+given. With --sync, virtualenvs are synced with the apps' requirements.txt instead of installing
+the app packages with all their dependencies. With --prebuilt, a virtualenv is built on the first
+host an app is deployed to and shipped to the others.
+"""
+from clldutils.clilib import Table, add_format, ParserError
+
+from appconfig import fleet
+from appconfig import trace
+
+
+def register(parser):
+    parser.add_argument('environment', choices=['production', 'test'])
+    parser.add_argument(
+        # Note: args.apps is the apps config.
+        '--apps', dest='apps_selected', nargs='*', default=[], metavar='APP', help='App IDs')
+    parser.add_argument('--stack', default=None, help='Select all apps of a stack')
+    parser.add_argument('--host', default=None, help='Select all apps on a host')
+    parser.add_argument('--parallel', type=int, default=4, help='Max. number of parallel deploys')
+    parser.add_argument(
+        '--per-host',
+        type=int,
+        default=1,
+        help='Max. parallel deploys per host (more than 1 may fail on the dpkg lock)')
+    parser.add_argument(
+        '--answer',
+        action='append',
+        default=[],
+        metavar='QUESTION=y|n',
+        help='Answer to a confirm question, matched by prefix, e.g. "Recreate database=n". '
+             'Unanswered questions get their default - except "Recreate secret key", which is '
+             'answered with n')
+    parser.add_argument(
+        '--force',
+        default=False,
+        action='store_true',
+        help='Run all deploy steps, even if their inputs did not change since the last deploy')
+    parser.add_argument(
+        '--sync',
+        default=False,
+        action='store_true',
+        help="Install the packages pinned in each app's requirements.txt, changing only what "
+             "differs in the app's virtualenv")
+    parser.add_argument(
+        '--prebuilt',
+        default=False,
+        action='store_true',
+        help='Install virtualenvs built when deploying an app to another host - or build them '
+             'once for all hosts')
+    parser.add_argument(
+        '--trace',
+        default=None,
+        metavar='TRACE_JSON',
+        help='Record remote commands, transfers and prompts as Chrome trace JSON (default: '
+             '${0})'.format(trace.ENV_VAR))
+    add_format(parser, default='simple')
+
+
+def select_apps(args):
+    apps = [args.apps[name] for name in args.apps_selected]
+    if args.stack:
+        apps.extend(args.apps.by_stack(args.stack))
+    if args.host:
+        apps.extend(args.apps.by_host(args.host, environment=args.environment))
+    res, seen = [], set()
+    for app in apps:
+        if app.name not in seen:
+            seen.add(app.name)
+            res.append(app)
+    return res
+
+
+def parse_answers(answers):
+    res = []
+    for spec in answers:
+        question, sep, answer = spec.rpartition('=')
+        if not sep or answer.lower() not in ('y', 'yes', 'n', 'no'):
+            raise ParserError('invalid answer: {0}'.format(spec))
+        res.append((question, answer.lower().startswith('y')))
+    return fleet.Answers(res)
+
+
+def run(args):
+    unknown = [name for name in args.apps_selected if name not in args.apps]
+    if unknown:
+        raise ParserError('unknown app(s): {0}'.format(', '.join(unknown)))
+    if args.parallel < 1 or args.per_host < 1:
+        raise ParserError('--parallel and --per-host must be positive')
+    apps = select_apps(args)
+    if not apps:
+        raise ParserError('no apps selected')
+
+    with trace.tracing(args.trace):
+        results = fleet.deploy(
+            apps,
+            args.environment,
+            parallel=args.parallel,
+            per_host=args.per_host,
+            answers=parse_answers(args.answer),
+            log=args.log,
+            force=args.force,
+            sync=args.sync,
+            prebuilt=args.prebuilt)
+
+    with Table(args, 'app', 'host', 'status', 'duration [s]', 'error') as t:
+        for r in sorted(results, key=lambda r: (r.ok, r.app)):
+            t.append([
+                r.app, r.host, 'ok' if r.ok else 'FAILED', '{0:.0f}'.format(r.duration), r.error])
+    return 0 if all(r.ok for r in results) else 1
@@ -0,0 +1,41 @@
+"""
+Compare the apps config between git revisions, listing the templates and deploy steps which
+are affected by the changes - i.e. the minimal redeploy set.
+"""
+from clldutils.clilib import Table, add_format
+
+from appconfig import diff
+
+
+def register(parser):
+    parser.add_argument('rev1', help='git revision, e.g. "HEAD~1"')
+    parser.add_argument(
+        'rev2',
+        nargs='?',
+        default=None,
+        help='git revision (default: the apps.ini in the working tree)')
+    parser.add_argument(
+        '-v', '--verbose', default=False, action='store_true', help='Show old and new values')
+    add_format(parser, default='simple')
+
+
+def run(args):
+    diffs = diff.diff(diff.load_revision(args.rev1), diff.load_revision(args.rev2))
+    if not diffs:
+        print('no changes')
+        return
+
+    with Table(args, 'app', 'status', 'host', 'fields', 'templates', 'steps') as t:
+        for d in diffs:
+            t.append([
+                d.name,
+                d.status,
+                ' '.join(d.hosts),
+                ' '.join(d.changes),
+                ' '.join(sorted(d.templates)),
+                ' '.join(sorted(d.steps))])
+
+    if args.verbose:
+        for d in diffs:
+            for field, (old, new) in d.changes.items():
+                print('{0}.{1}: {2!r} -> {3!r}'.format(d.name, field, old, new))
@@ -0,0 +1,53 @@
+"""
+Validate the apps config, reporting problems and timing per check.
+"""
+import pathlib
+
+from clldutils.clilib import Table, add_format, ParserError
+
+import appconfig
+from appconfig import validation
+from appconfig.config import Config
+
+
+def register(parser):
+    parser.add_argument(
+        '--config',
+        help='apps.ini file to validate (default: the config of this appconfig clone)',
+        type=pathlib.Path,
+        default=None)
+    parser.add_argument(
+        '--no-cache', default=False, action='store_true', help='Revalidate all sections')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker threads')
+    parser.add_argument(
+        'check',
+        nargs='*',
+        metavar='CHECK',
+        help='Checks to run (default: all): {0}'.format(', '.join(validation.CHECKS)))
+    add_format(parser, default='simple')
+
+
+def run(args):
+    unknown = [c for c in args.check if c not in validation.CHECKS]
+    if unknown:
+        raise ParserError('unknown check(s): {0}'.format(', '.join(unknown)))
+    # Load the config without validating it - reporting the problems is what we're here for.
+    apps = Config.from_file(args.config or appconfig.CONFIG_FILE, validate=False)
+    report = validation.validate(
+        apps, checks=args.check, use_cache=not args.no_cache, max_workers=args.workers)
+
+    with Table(args, 'check', 'run', 'cached', 'time [ms]', 'errors', 'warnings') as t:
+        for name, (seconds, run_, cached) in report.timings.items():
+            t.append([
+                name,
+                run_,
+                cached,
+                '{0:.2f}'.format(seconds * 1000),
+                len([r for r in report.errors if r.check == name]),
+                len([r for r in report.warnings if r.check == name]),
+            ])
+    print('\ntotal: {0:.2f}ms'.format(report.elapsed * 1000))
+
+    for r in report.results:
+        print('{0}: [{1}] {2}: {3}'.format(r.level.upper(), r.section or '-', r.check, r.message))
+    return 1 if report.errors else 0
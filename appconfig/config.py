@@ -9,19 +9,88 @@
     - ssh config
     - environment variables
 """
+import ast
 import copy
-import argparse
+import functools
+import collections
 import warnings
 import configparser
 import pathlib
 
-from . import helpers
+from . import cache as _cache
 
 __all__ = ['Config']
 
+#: The green app server instance of an app in blue/green mode listens on `port` plus this offset.
+BLUE_GREEN_PORT_OFFSET = 1000
+
+
+class Index(object):
+    """Secondary indexes over a collection of apps, built in one pass."""
+
+    def __init__(self, apps):
+        self.hosts = collections.defaultdict(list)
+        self.stacks = collections.defaultdict(list)
+        self.ports, self.domains = {}, {}
+        for app in apps:
+            for environment in ('production', 'test'):
+                host = getattr(app, environment)
+                if host:
+                    self.hosts[environment, host].append(app)
+            self.stacks[app.stack].append(app)
+            self.ports[app.port] = app
+            self.domains[app.domain] = app
+        self.hosts = {k: tuple(v) for k, v in self.hosts.items()}
+        self.stacks = {k: tuple(v) for k, v in self.stacks.items()}
+        self.production_hosts = frozenset(h for e, h in self.hosts if e == 'production')
+
 
 class Config(dict):
+    """Mapping of app names to `App` instances.
+
+    Lookups by host, port, domain and stack are answered from an `Index`, which is built on
+    first use and dropped whenever the mapping is changed.
+    """
     cfg = None
+    _index = None
+
+    def __setitem__(self, key, value):
+        self._index = None
+        super(Config, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._index = None
+        super(Config, self).__delitem__(key)
+
+    def clear(self):
+        self._index = None
+        super(Config, self).clear()
+
+    def pop(self, *args):
+        self._index = None
+        return super(Config, self).pop(*args)
+
+    def popitem(self):
+        self._index = None
+        return super(Config, self).popitem()
+
+    def setdefault(self, key, default=None):
+        self._index = None
+        return super(Config, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self._index = None
+        super(Config, self).update(*args, **kwargs)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = Index(self.values())
+        return self._index
 
     @property
     def defaults(self):
@@ -30,15 +99,53 @@ class Config(dict):
 
     @property
     def production_hosts(self):
-        return set(app.production for app in self.values())
+        return self.index.production_hosts
+
+    def by_host(self, host, environment='production'):
+        """Return the apps deployed to `host` in `environment` (in config order)."""
+        return self.index.hosts.get((environment, host), ())
+
+    def by_stack(self, stack):
+        return self.index.stacks.get(stack, ())
+
+    def by_port(self, port):
+        return self.index.ports.get(int(port))
+
+    def by_domain(self, domain):
+        return self.index.domains.get(domain)
 
     @classmethod
-    def from_file(cls, filepath, value_cls=None, validate=True):
+    def from_file(cls, filepath, value_cls=None, validate=True, cache=False):
+        """Load the apps config from `filepath`.
+
+        :param cache: If True, reuse a snapshot of the resolved (and validated) config as long as
+            the content of `filepath` and of this module does not change.
+        """
         if value_cls is None:
             value_cls = App
+        if cache and _cache.enabled():
+            salt = '{0}.{1}:{2}:{3}:{4}'.format(
+                value_cls.__module__, value_cls.__qualname__, cls.__qualname__, validate,
+                _cache.file_hash(__file__, pathlib.Path(__file__).parent / 'validation.py'))
+            snapshot = _cache.Snapshot(filepath, name='config', salt=salt)
+            inst = snapshot.load()
+            if inst is None:
+                inst = cls.from_file(filepath, value_cls=value_cls, validate=validate)
+                snapshot.dump(inst)
+            elif validate:
+                # Checks of anything but the config (e.g. the filesystem) can't be snapshotted.
+                inst.validate(uncached_only=True)
+            return inst
         parser = ConfigParser.from_file(filepath)
-        items = {s: value_cls(**parser[s]) for s in parser.sections()
-                if not s.startswith('_')}
+        items, errors = {}, []
+        for s in parser.sections():
+            if not s.startswith('_'):
+                try:
+                    items[s] = value_cls(**parser[s])
+                except ValueError as e:
+                    errors.append('[%s] %s' % (s, e))
+        if errors:
+            raise ValueError('invalid section(s) in %s:\n%s' % (filepath, '\n'.join(errors)))
         inst = cls(items)
         inst.hostnames = [h for _, h in parser.raw_items('_hosts')]
         if validate:
@@ -46,16 +153,26 @@ class Config(dict):
         inst.cfg = parser
         return inst
 
-    def validate(self):
-        mismatch = [(name, app.name) for name, app in self.items() if name != app.name]
-        if mismatch:
-            raise ValueError('section/name mismatch: %r' % mismatch)
-        duplicates = helpers.duplicates([app.port for app in self.values()])
-        if duplicates:
-            raise ValueError('duplicate port(s): %r' % duplicates)
-        for app in self.values():
-            if not app.fabfile_dir.exists():
-                warnings.warn('missing fabfile dir: %s' % app.name)
+    def validate(self, uncached_only=False, **kwargs):
+        """Run the checks registered in `appconfig.validation`.
+
+        :param uncached_only: Only run the checks whose results depend on more than the config.
+        :raises ValueError: if any check reports an error; warnings are issued as `UserWarning`.
+        """
+        from . import validation
+
+        if uncached_only:
+            kwargs['checks'] = [c.name for c in validation.CHECKS.values() if not c.cached]
+            if not kwargs['checks']:
+                return validation.Report()
+        report = validation.validate(self, **kwargs)
+        if report.errors:
+            raise ValueError('\n'.join(
+                '[%s] %s' % (r.section, r.message) if r.section else r.message
+                for r in report.errors))
+        for r in report.warnings:
+            warnings.warn(r.message)
+        return report
 
 
 class ConfigParser(configparser.ConfigParser):
@@ -91,10 +208,48 @@ def getboolean(s):
 
 
 def getwords(s):
-    return s.strip().split()
+    return tuple(s.strip().split())
+
 
+@functools.lru_cache(maxsize=None)
+def _literal(s):
+    def convert(node):
+        if isinstance(node, ast.Dict):
+            return {convert(k): convert(v) for k, v in zip(node.keys, node.values)}
+        if isinstance(node, ast.List):
+            return [convert(e) for e in node.elts]
+        if isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float)):
+            return node.value  # Note: bool is a subclass of int.
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = convert(node.operand)
+            if isinstance(operand, (int, float)) and not isinstance(operand, bool):
+                return -operand if isinstance(node.op, ast.USub) else operand
+        raise ValueError('unsupported literal: %s' % type(node).__name__)
 
-class App(argparse.Namespace):
+    try:
+        return convert(ast.parse(s.strip(), mode='eval').body)
+    except SyntaxError as e:
+        raise ValueError('invalid literal: %s' % e)
+
+
+def getliteral(s):
+    """Parse a Python literal made of dicts, lists, strings, numbers and booleans.
+
+    >>> getliteral("{'a': [1, -2.5, True]}")
+    {'a': [1, -2.5, True]}
+    >>> getliteral('')
+    {}
+    """
+    # Parse results are cached by raw string; copy, so apps do not share mutable values.
+    return copy.deepcopy(_literal(s or '{}'))
+
+
+class App(object):
+    """Immutable record of the (converted) config values of an app.
+
+    Values are converted from their string representation once, upon initialization. Since
+    instances can't be changed, `replace` shares all unchanged values with the new instance.
+    """
 
     _fields = dict.fromkeys([
         'name', 'test', 'production',
@@ -120,6 +275,9 @@ class App(argparse.Namespace):
         'require_pip': getwords,
         'pg_collkey': getboolean,
         'pg_unaccent': getboolean,
+        'pg_collkey_indexes': getwords,
+        'pg_trgm_indexes': getwords,
+        'blue_green': getboolean,
     })
 
     _fields.update(dict.fromkeys([
@@ -136,35 +294,80 @@ class App(argparse.Namespace):
     ], pathlib.PurePosixPath))
 
     _fields.update({
-        'extra': lambda s: eval(s or '{}'),
+        'extra': getliteral,
     })
 
+    __slots__ = tuple(_fields)
+
     def __init__(self, **kwargs):
-        kw = self._fields.copy()
-        for k, f in list(kw.items()):
+        for k, f in self._fields.items():
             try:
                 value = kwargs.pop(k)
             except KeyError:
                 raise ValueError('missing attribute %r' % k)
-            kw[k] = f(value) if f is not None else value
+            object.__setattr__(self, k, self._convert(k, f, value))
         if kwargs:
             raise ValueError('unknown attribute(s) %r' % kwargs)
-        super(App, self).__init__(**kw)
+
+    @staticmethod
+    def _convert(name, converter, value):
+        if converter is None:
+            return value
+        try:
+            return converter(value)
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError('invalid value for %r: %r (%s)' % (name, value, e))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable, use replace()' % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            object.__setattr__(self, k, v)
+
+    def __eq__(self, other):
+        if not isinstance(other, App):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (
+            self.__class__.__name__,
+            ', '.join('%s=%r' % (k, getattr(self, k)) for k in self.__slots__))
+
+    def _asdict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
 
     def replace(self, **kwargs):
-        old, new = self.__dict__, self._fields.copy()
-        for k, f in list(new.items()):
+        unknown = set(kwargs) - set(self._fields)
+        if unknown:
+            raise ValueError('unknown attribute(s) %r' % {k: kwargs[k] for k in unknown})
+        inst = object.__new__(self.__class__)
+        for k, f in self._fields.items():
             if k in kwargs:
-                value = f(kwargs.pop(k)) if f is not None else kwargs.pop(k)
+                value = self._convert(k, f, kwargs[k])
             else:
-                value = copy.copy(old[k])
-            new[k] = value
-        if kwargs:
-            raise ValueError('unknown attribute(s) %r' % kwargs)
-        inst = object.__new__(self.__class__)
-        inst.__dict__ = new
+                value = getattr(self, k)
+            object.__setattr__(inst, k, value)
         return inst
 
+    @property
+    def blue_green_ports(self):
+        """The ports of the blue and the green app server instance in blue/green mode.
+
+        Ports are allocated consecutively in apps.ini, so the green instance listens on a port
+        offset by `BLUE_GREEN_PORT_OFFSET` rather than on the adjacent port.
+        """
+        return self.port, self.port + BLUE_GREEN_PORT_OFFSET
+
     @property
     def fabfile_dir(self):
         from . import APPS_DIR
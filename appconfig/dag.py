@@ -0,0 +1,234 @@
+# dag.py - run steps with declared inputs and outputs concurrently
+
+"""A minimal scheduler for steps forming a directed acyclic graph.
+
+Each `Step` declares the names of its inputs and outputs; a step becomes ready when all steps
+producing its inputs are done. Steps sharing a resource (e.g. the apt/dpkg lock on the remote
+host) never run at the same time.
+
+Fabric keeps state such as the current directory (`cd`) or `settings` in the global `env`,
+so steps run concurrently in forked child processes, each with its own SSH connection. Steps
+which must interact with the user run in the scheduler process (`local=True`).
+"""
+import os
+import sys
+import time
+import traceback
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+from . import trace
+
+__all__ = ['Step', 'Graph', 'StepFailed']
+
+
+class StepFailed(RuntimeError):
+    pass
+
+
+class Step(object):
+
+    def __init__(self, name, func, inputs=(), outputs=(), resources=(), local=False):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs) or (name,)
+        self.resources = frozenset(resources)
+        self.local = local
+        self.start = self.end = None
+
+    def __repr__(self):
+        return '<Step {0}>'.format(self.name)
+
+    @property
+    def duration(self):
+        return (self.end - self.start) if self.end is not None else None
+
+
+def fork_available():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def _reset_connections():  # pragma: no cover
+    # Called in the child: forget - but do not close! - the parent's SSH connections.
+    if 'fabric.state' in sys.modules:
+        sys.modules['fabric.state'].connections.clear()
+
+
+def _disconnect():  # pragma: no cover
+    if 'fabric.network' in sys.modules:
+        sys.modules['fabric.network'].disconnect_all()
+
+
+def _child(step, conn):  # pragma: no cover
+    code = 0
+    try:
+        _reset_connections()
+        start = time.time()
+        try:
+            with trace.step(step.name):
+                ok, value = True, step.func()
+        except BaseException as e:
+            ok, value = False, '{0}: {1}\n{2}'.format(
+                e.__class__.__name__, e, traceback.format_exc())
+        # We report the time span, because the parent may be busy running a local step when we
+        # are done.
+        try:
+            conn.send((ok, value, start, time.time()))
+        except Exception:  # The return value could not be pickled.
+            conn.send((ok, None, start, time.time()))
+        _disconnect()
+    except BaseException:
+        code = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(code)
+
+
+class Graph(object):
+
+    def __init__(self, steps):
+        self.steps = collections.OrderedDict()
+        producers = {}
+        for step in steps:
+            assert step.name not in self.steps, 'duplicate step {0}'.format(step.name)
+            self.steps[step.name] = step
+            for output in step.outputs:
+                assert output not in producers, 'duplicate output {0}'.format(output)
+                producers[output] = step
+        self.deps = collections.OrderedDict()
+        for step in self.steps.values():
+            missing = [i for i in step.inputs if i not in producers]
+            if missing:
+                raise ValueError('step {0}: no producer for {1}'.format(step.name, missing))
+            self.deps[step.name] = [producers[i] for i in step.inputs]
+        self.order = self._toposort()
+        self.results = {}
+
+    def _toposort(self):
+        res, state = [], {}
+
+        def visit(step):
+            if state.get(step.name) == 1:
+                raise ValueError('cycle involving step {0}'.format(step.name))
+            if state.get(step.name) != 2:
+                state[step.name] = 1
+                for dep in self.deps[step.name]:
+                    visit(dep)
+                state[step.name] = 2
+                res.append(step)
+
+        for step in self.steps.values():
+            visit(step)
+        return res
+
+    def run(self, concurrent=True):
+        """Run all steps, returning a dict mapping step names to return values.
+
+        :raises StepFailed: after all running steps are done, if any step failed.
+        """
+        concurrent = concurrent and fork_available()
+        done, failed, running = set(), [], {}
+        busy = set()  # resources held by running steps
+        self.start = time.time()
+
+        def is_ready(step):
+            return step.start is None and all(d.name in done for d in self.deps[step.name])
+
+        def finish(step, ok, value, exc=None, span=None):
+            if span:
+                step.start, step.end = span
+            else:
+                step.end = time.time()
+            if ok:
+                done.add(step.name)
+                self.results[step.name] = value
+            else:
+                failed.append((step, value, exc))
+
+        def run_local(step):
+            step.start = time.time()
+            try:
+                with trace.step(step.name):
+                    value = step.func()
+            except (Exception, SystemExit) as e:  # fabric's abort raises SystemExit.
+                finish(step, False, '{0}: {1}'.format(e.__class__.__name__, e), e)
+                if not concurrent:
+                    raise
+            else:
+                finish(step, True, value)
+
+        if not concurrent:
+            for step in self.order:
+                run_local(step)
+            self.end = time.time()
+            return self.results
+
+        ctx = multiprocessing.get_context('fork')
+        while True:
+            if not failed:
+                ready = [s for s in self.order if is_ready(s) and not (s.resources & busy)]
+                for step in [s for s in ready if not s.local]:
+                    if step.resources & busy:
+                        continue
+                    busy |= step.resources
+                    recv, send = ctx.Pipe(duplex=False)
+                    sys.stdout.flush()
+                    proc = ctx.Process(target=_child, args=(step, send))
+                    step.start = time.time()
+                    proc.start()
+                    send.close()
+                    running[recv] = (step, proc)
+                local = [s for s in ready if s.local and not (s.resources & busy)]
+                if local:
+                    run_local(local[0])
+                    continue
+            if not running:
+                break
+            for recv in multiprocessing.connection.wait(list(running)):
+                step, proc = running.pop(recv)
+                try:
+                    ok, value, start, end = recv.recv()
+                    span = (start, end)
+                except EOFError:
+                    proc.join()
+                    ok, value, span = False, 'exited with code {0}'.format(proc.exitcode), None
+                proc.join()
+                busy -= step.resources
+                finish(step, ok, value, span=span)
+
+        self.end = time.time()
+        for _, _, exc in failed:
+            if exc is not None:  # Re-raise exceptions from steps run in this process.
+                raise exc
+        if failed:
+            raise StepFailed('\n'.join(
+                'step {0} failed: {1}'.format(s.name, err) for s, err, _ in failed))
+        not_run = [s.name for s in self.order if s.start is None]
+        assert not not_run, not_run
+        return self.results
+
+    def critical_path(self):
+        """Return the chain of steps which determined the total run time.
+
+        Starting with the step that finished last, we follow the dependency which finished last.
+        """
+        finished = [s for s in self.steps.values() if s.end is not None]
+        if not finished:
+            return []
+        step = max(finished, key=lambda s: s.end)
+        path = [step]
+        while self.deps[step.name]:
+            step = max(self.deps[step.name], key=lambda s: s.end or 0)
+            path.append(step)
+        return list(reversed(path))
+
+    def report(self, file=None):
+        path = self.critical_path()
+        print('critical path ({0:.1f}s of {1:.1f}s total, {2:.1f}s in all steps):'.format(
+            sum(s.duration for s in path),
+            self.end - self.start,
+            sum(s.duration or 0 for s in self.steps.values())), file=file)
+        for step in path:
+            print('  {0:<20}{1:8.1f}s'.format(step.name, step.duration), file=file)
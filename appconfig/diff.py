@@ -0,0 +1,156 @@
+# diff.py - compute which apps, templates and deploy steps are affected by config changes
+
+"""Compare two versions of the apps config.
+
+Changed fields of an app are mapped to
+
+- the templates which render them - found by scanning the templates for `app.<field>` and by
+  `TEMPLATE_FIELDS`, which lists context variables `appconfig.tasks.deployment` derives from
+  app fields, and
+- the deploy steps which must be re-run - the step uploading each affected template plus the
+  steps listed in `FIELD_STEPS`.
+
+Changes to fields which are not mapped to anything are conservatively reported as requiring a
+full `deploy`.
+"""
+import re
+import pathlib
+import tempfile
+import subprocess
+import collections
+
+from . import PKG_DIR, CONFIG_FILE
+from .config import Config, ConfigParser
+
+__all__ = ['diff', 'load_revision', 'AppDiff']
+
+TEMPLATE_DIR = PKG_DIR / 'templates'
+
+TEMPLATE_STEPS = collections.OrderedDict([
+    ('nginx-app.conf', 'require_nginx'),
+    ('supervisor.conf', 'require_supervisor'),
+    ('nginx-upstream.conf', 'require_nginx'),
+    ('config.ini', 'require_config'),
+    ('logrotate.conf', 'require_logging'),
+    ('varnish_site.vcl', 'cache'),
+])
+
+TEMPLATE_FIELDS = {
+    # destination paths and values passed as extra context in deployment.py/varnish.py:
+    'nginx-app.conf': {
+        'nginx_site', 'nginx_location', 'nginx_htpasswd', 'venv_dir', 'public', 'with_admin'},
+    'supervisor.conf': {'supervisor', 'port', 'timeout'},
+    'nginx-upstream.conf': {'port'},
+    'config.ini': {'config', 'workers', 'www_dir', 'with_blog'},
+    'logrotate.conf': {'logrotate', 'access_log', 'error_log'},
+    'varnish_site.vcl': {'varnish_site', 'name', 'port', 'domain'},
+}
+
+FIELD_STEPS = {
+    'require_deb': ['util.require_debs'],
+    'require_deb_xenial': ['util.require_debs'],
+    'require_deb_bionic': ['util.require_debs'],
+    'require_deb_focal': ['util.require_debs'],
+    'app_pkg': ['require_venv', 'pip_freeze'],
+    'require_pip': ['require_venv', 'pip_freeze'],
+    'venv_dir': ['require_venv'],
+    'venv_bin': ['require_venv'],
+    'src_dir': ['require_venv'],
+    'github_org': ['require_venv'],
+    'github_repos': ['require_venv'],
+    'static_dir': ['require_bower', 'require_grunt'],
+    'log_dir': ['require_logging'],
+    'www_dir': ['require.directory'],
+    'domain': ['letsencrypt.require_cert'],
+    'with_www_subdomain': ['letsencrypt.require_cert'],
+    'pg_collkey': ['require_postgres'],
+    'pg_unaccent': ['require_postgres'],
+    'pg_collkey_indexes': ['pgindex.require'],
+    'pg_trgm_indexes': ['pgindex.require'],
+    'sqlalchemy_url': ['require_postgres'],
+    'dbdump': [],  # Only used when the database is recreated.
+    'extra': [],  # Only used by app-specific fabfiles.
+    'deploy_duration': [],
+    'timeout': [],
+    'alembic': [],
+    'gunicorn_pid': [],
+    'download_dir': [],
+}
+
+
+def template_fields(template_dir=TEMPLATE_DIR):
+    """Return a dict mapping field names to the templates referencing them."""
+    res = collections.defaultdict(set)
+    for template in TEMPLATE_STEPS:
+        text = template_dir.joinpath(template).read_text(encoding='utf8')
+        for field in set(re.findall(r'\bapp\.([a-z_]+)', text)) | TEMPLATE_FIELDS[template]:
+            res[field].add(template)
+    return res
+
+
+class AppDiff(object):
+
+    def __init__(self, name, old, new, field_templates):
+        self.name, self.old, self.new = name, old, new
+        self.changes = collections.OrderedDict()
+        if old and new:
+            for field in new._fields:
+                ov, nv = getattr(old, field), getattr(new, field)
+                if ov != nv:
+                    self.changes[field] = (ov, nv)
+        self.templates, self.steps = set(), set()
+        if self.status != 'changed':
+            self.steps.add('uninstall' if self.status == 'removed' else 'deploy')
+        for field in self.changes:
+            templates = field_templates.get(field, set())
+            self.templates |= templates
+            self.steps |= set(TEMPLATE_STEPS[t] for t in templates)
+            if field in FIELD_STEPS:
+                self.steps |= set(FIELD_STEPS[field])
+            elif not templates:
+                self.steps.add('deploy')
+        if 'deploy' in self.steps:
+            self.steps = {'deploy'}
+
+    @property
+    def status(self):
+        return 'added' if self.old is None else ('removed' if self.new is None else 'changed')
+
+    @property
+    def hosts(self):
+        return sorted(set(a.production for a in [self.old, self.new] if a))
+
+
+def diff(old, new, template_dir=TEMPLATE_DIR):
+    """Compare two `Config` instances, returning a list of `AppDiff` for affected apps."""
+    field_templates = template_fields(template_dir)
+    res = []
+    for name in list(old) + [n for n in new if n not in old]:
+        d = AppDiff(name, old.get(name), new.get(name), field_templates)
+        if d.status != 'changed' or d.changes:
+            res.append(d)
+    return res
+
+
+def load_revision(rev=None, config_file=CONFIG_FILE):
+    """Load the apps config as of git revision `rev` (or from the working tree)."""
+    config_file = pathlib.Path(config_file)
+    if not rev:
+        return Config.from_file(config_file, validate=False)
+    cwd = str(config_file.parent)
+    top = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'], cwd=cwd)
+    path = config_file.resolve().relative_to(pathlib.Path(top.decode('utf8').strip()).resolve())
+    content = subprocess.check_output(
+        ['git', 'show', '{0}:{1}'.format(rev, path.as_posix())], cwd=cwd)
+    with tempfile.TemporaryDirectory() as tmp:
+        p = pathlib.Path(tmp) / config_file.name
+        p.write_bytes(content)
+        # Fields added since `rev` get the current defaults:
+        parser, defaults = ConfigParser.from_file(p), ConfigParser.from_file(config_file).defaults()
+        missing = [k for k in defaults if k not in parser.defaults()]
+        if missing:
+            for k in missing:
+                parser['DEFAULT'][k] = defaults[k]
+            with p.open('w', encoding='utf8') as fp:
+                parser.write(fp)
+        return Config.from_file(p, validate=False)
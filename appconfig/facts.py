@@ -0,0 +1,129 @@
+# facts.py - facts about remote hosts, gathered in one round trip
+
+"""Facts about the remote host.
+
+Deploy tasks need to know e.g. the Ubuntu release, the installed PHP and Postgres versions, the
+installed deb packages and builds (see `appconfig.builds`) or whether certain files exist.
+Instead of asking for each in a round trip of its own, `get` gathers all of them with one script
+and caches them per host for the rest of the session (i.e. the process).
+
+Facts describe the host as it was when they were gathered. Code changing the host - e.g.
+installing packages - updates the facts with `Facts.add_debs` or `Facts.add_path`, or calls
+`refresh` to gather them again.
+"""
+import shlex
+
+from fabric.api import env, run, settings, hide
+
+__all__ = ['get', 'refresh', 'exists', 'Facts']
+
+_cache = {}
+
+# Each line of output is a tab-separated (fact, value[, value]) tuple.
+SCRIPT = r"""# appconfig facts
+printf 'distrib_id\t%s\n' "$(lsb_release --id --short 2> /dev/null)"
+printf 'codename\t%s\n' "$(lsb_release --codename --short 2> /dev/null)"
+printf 'release\t%s\n' "$(lsb_release --release --short 2> /dev/null)"
+printf 'php\t%s\n' "$(ls /etc/php 2> /dev/null | tail -n 1)"
+for d in /usr/lib/postgresql/*/; do
+  if [ -d "$d" ]; then
+    printf 'postgres\t%s\n' "$(basename $d)"
+    if [ -e "${d}lib/collkey_icu.so" ]; then e=1; else e=0; fi
+    printf 'path\t%s\t%s\n' "${d}lib/collkey_icu.so" $e
+  fi
+done
+for f in /var/cache/appconfig/builds/installed/*; do
+  if [ -e "$f" ]; then printf 'build\t%s\n' "$(basename $f)"; fi
+done
+dpkg-query -W -f='${db:Status-Abbrev}\t${Package}\n' 2> /dev/null | sed -n 's/^ii *\t/deb\t/p'
+"""
+
+PATH = "if [ -e {0} ]; then printf 'path\\t%s\\t1\\n' {0}; else printf 'path\\t%s\\t0\\n' {0}; fi"
+
+CLLD_DIR = "printf 'clld_dir\\t%s\\t%s\\n' {0} " \
+           "\"$({0}/bin/python -c 'import clld, os; print(os.path.dirname(clld.__file__))' " \
+           "2> /dev/null)\""
+
+
+class Facts(object):
+
+    def __init__(self):
+        self.distrib_id = self.codename = self.release = self.php = None
+        self.postgres = []
+        self.debs = set()
+        self.builds = set()  # Keys of the builds installed from `appconfig.builds`.
+        self.paths = {}
+        self.clld_dirs = {}
+
+    def __repr__(self):
+        return '<Facts {0} {1}>'.format(self.distrib_id, self.codename)
+
+    def parse(self, output):
+        for line in output.splitlines():
+            fact, _, value = line.strip('\r').partition('\t')
+            if fact in ('distrib_id', 'codename', 'release', 'php'):
+                setattr(self, fact, value or None)
+            elif fact == 'postgres':
+                self.postgres.append(value)
+            elif fact == 'deb':
+                self.debs.add(value)
+            elif fact == 'build':
+                self.builds.add(value)
+            elif fact == 'path':
+                path, _, flag = value.rpartition('\t')
+                self.paths[path] = flag == '1'
+            elif fact == 'clld_dir':
+                venv, _, clld_dir = value.partition('\t')
+                self.clld_dirs[venv] = clld_dir or None
+        return self
+
+    def add_debs(self, packages):
+        self.debs.update(packages)
+
+    def add_path(self, path, exists=True):
+        self.paths[str(path)] = exists
+
+
+def script(paths=(), venvs=(), host=True):
+    lines = [SCRIPT] if host else []
+    lines.extend(PATH.format(shlex.quote(str(p))) for p in paths)
+    lines.extend(CLLD_DIR.format(shlex.quote(str(v))) for v in venvs)
+    return '\n'.join(lines)
+
+
+def _gather(facts, paths=(), venvs=(), host=True):
+    with settings(hide('everything'), warn_only=True):
+        return facts.parse(run(script(paths, venvs, host=host), pty=False))
+
+
+def get(paths=(), venvs=()):
+    """Return the `Facts` about the current host.
+
+    :param paths: Paths to check for existence - in the same round trip, if facts are gathered.
+    :param venvs: Virtualenvs to look up the clld package in.
+    """
+    paths = [str(p) for p in paths]
+    venvs = [str(v) for v in venvs]
+    facts = _cache.get(env.host_string)
+    if facts is None:
+        facts = _cache[env.host_string] = _gather(Facts(), paths, venvs)
+    else:
+        paths = [p for p in paths if p not in facts.paths]
+        venvs = [v for v in venvs if v not in facts.clld_dirs]
+        if paths or venvs:
+            _gather(facts, paths, venvs, host=False)
+    return facts
+
+
+def refresh(all_hosts=False):
+    """Forget the facts about the current host - or about all hosts - gathering them again."""
+    if all_hosts:
+        _cache.clear()
+        return None
+    old = _cache.pop(env.host_string, None)
+    return get(
+        paths=old.paths if old else (), venvs=old.clld_dirs if old else ())
+
+
+def exists(path):
+    return get(paths=[path]).paths[str(path)]
@@ -0,0 +1,187 @@
+# fleet.py - run deploy tasks for many apps at once
+
+"""Orchestration of tasks across the fleet of apps.
+
+Fabric keeps connection state in the global `fabric.api.env`, so each app is deployed in a
+separate worker process. The orchestrator
+
+- limits the number of concurrent deploys per host (pip, npm and Postgres are heavy),
+- serializes deploys of the same app with a lock directory on the remote host,
+- answers `confirm()` and `prompt()` non-interactively from an `Answers` instance.
+"""
+import os
+import time
+import contextlib
+import collections
+import concurrent.futures
+
+__all__ = ['Answers', 'Result', 'deploy']
+
+LOCK_DIR = '/var/lock'
+
+Result = collections.namedtuple('Result', 'app host ok duration error')
+
+
+class Answers(object):
+    """Non-interactive answers to the questions asked by the deploy tasks.
+
+    Questions are matched by prefix, e.g. `Answers({'Recreate database': False})`. Unanswered
+    questions get the answer in `DEFAULTS` or the default passed to `confirm` or `prompt`. HTTP
+    basic auth passwords are read from environment variables `APPCONFIG_PWD_<USER>`.
+    """
+
+    #: Answers differing from the interactive defaults - for questions a fleet deploy must not
+    #: answer with yes unless told so.
+    DEFAULTS = collections.OrderedDict([
+        ('Recreate secret key', False),  # Would invalidate all sessions of Django apps.
+    ])
+
+    def __init__(self, answers=None):
+        self.answers = collections.OrderedDict(answers or {})
+        for question, answer in self.DEFAULTS.items():
+            self.answers.setdefault(question, answer)
+
+    def _lookup(self, question, default):
+        for q, answer in self.answers.items():
+            if question.startswith(q):
+                return answer
+        return default
+
+    def confirm(self, question, default=True):
+        return self._lookup(question, default)
+
+    def prompt(self, text, key=None, default='', validate=None):
+        return self._lookup(text, default)
+
+    def getpwd(self, user, accept_empty=False):
+        # An empty password must be given explicitly - otherwise non-public apps would be
+        # deployed without HTTP authentication.
+        var = 'APPCONFIG_PWD_{0}'.format(user.upper())
+        if var not in os.environ:
+            raise RuntimeError('non-interactive deploy requires ${0}'.format(var))
+        pwd = os.environ[var]
+        if not pwd and not accept_empty:
+            raise RuntimeError('${0} must not be empty'.format(var))
+        return pwd or None
+
+
+@contextlib.contextmanager
+def noninteractive(answers):
+    """Make the deploy tasks use `answers` instead of asking on the terminal."""
+    from . import helpers
+    from .tasks import deployment
+
+    patched = [
+        (deployment, 'confirm', answers.confirm),
+        (deployment, 'prompt', answers.prompt),
+        (helpers, 'getpwd', answers.getpwd),
+    ]
+    originals = [(mod, name, getattr(mod, name)) for mod, name, _ in patched]
+    for mod, name, value in patched:
+        setattr(mod, name, value)
+    try:
+        yield answers
+    finally:
+        for mod, name, value in originals:
+            setattr(mod, name, value)
+
+
+@contextlib.contextmanager
+def remote_lock(app):
+    """Serialize tasks for `app` using an atomic `mkdir` on the remote host."""
+    from fabric.api import sudo, settings, hide
+
+    lock = '{0}/appconfig-{1}.lock'.format(LOCK_DIR, app.name)
+    with settings(hide('warnings'), warn_only=True):
+        if sudo('mkdir {0}'.format(lock)).failed:
+            raise RuntimeError(
+                '{0} is locked by another deploy; remove {1} if it is stale'.format(
+                    app.name, lock))
+    try:
+        yield lock
+    finally:
+        sudo('rmdir {0}'.format(lock))
+
+
+def _locked(task, app, *args, **kwargs):
+    with remote_lock(app):
+        return task(app, *args, **kwargs)
+
+
+def run_task(task_name, app, environment, answers, host=None, **kwargs):
+    """Run a task for a single app - in a worker process."""
+    import fabric.api
+    import fabric.network
+    from . import tasks
+    from . import trace
+
+    start = time.time()
+    host = host or getattr(app, environment)
+    task = getattr(tasks, task_name).execute_inner
+    trace.install()
+    trace.set_app(app.name)
+    try:
+        # Tasks like deploy look up per-app resources, e.g. systemd units, in the app's dir.
+        os.chdir(str(app.fabfile_dir))
+        fabric.api.env.environment = environment
+        with noninteractive(answers):
+            fabric.api.execute(_locked, task, app, hosts=[host], **kwargs)
+        ok, error = True, ''
+    except BaseException as e:  # fabric's abort raises SystemExit.
+        ok, error = False, '{0}: {1}'.format(e.__class__.__name__, e)
+    finally:
+        fabric.network.disconnect_all()
+    return Result(app.name, host, ok, time.time() - start, error)
+
+
+def deploy(apps,
+           environment,
+           parallel=4,
+           per_host=1,
+           answers=None,
+           task='deploy',
+           executor_cls=concurrent.futures.ProcessPoolExecutor,
+           worker=run_task,
+           log=None,
+           **kwargs):
+    """Run `task` for `apps`, with at most `parallel` tasks in total and `per_host` per host.
+
+    Deploys to the same host share apt/dpkg and build directories, so running more than one per
+    host may fail on the dpkg lock.
+
+    :return: list of `Result` instances, in order of completion.
+    """
+    answers = answers or Answers()
+    pending = collections.deque(a for a in apps if getattr(a, environment))
+    results = [
+        Result(a.name, '', False, 0.0, 'no {0} host'.format(environment))
+        for a in apps if not getattr(a, environment)]
+    running, load = {}, collections.Counter()
+
+    with executor_cls(max_workers=parallel) as pool:
+        while pending or running:
+            for app in list(pending):
+                if len(running) >= parallel:
+                    break
+                host = getattr(app, environment)
+                if load[host] < per_host:
+                    pending.remove(app)
+                    load[host] += 1
+                    if log:
+                        log.info('{0}: starting {1} on {2}'.format(app.name, task, host))
+                    future = pool.submit(worker, task, app, environment, answers, **kwargs)
+                    running[future] = (app, host)
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                app, host = running.pop(future)
+                load[host] -= 1
+                try:
+                    res = future.result()
+                except Exception as e:  # e.g. a crashed worker process.
+                    res = Result(app.name, host, False, 0.0, repr(e))
+                if log:
+                    log.info('{0}: {1} after {2:.0f}s'.format(
+                        app.name, 'done' if res.ok else 'FAILED', res.duration))
+                results.append(res)
+    return results
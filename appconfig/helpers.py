@@ -7,7 +7,7 @@ import getpass
 
 import pytz
 
-__all__ = ['caller_dirname', 'duplicates', 'strfnow']
+__all__ = ['asbool', 'caller_dirname', 'duplicates', 'strfnow']
 
 
 def getpwd(user, accept_empty=False):
@@ -19,6 +19,17 @@ def getpwd(user, accept_empty=False):
     return pwd
 
 
+def asbool(value):
+    """Interpret task arguments, which are passed as strings by fab, as booleans.
+
+    >>> asbool('False'), asbool('yes'), asbool(True), asbool(None)
+    (False, True, True, False)
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y', 'on')
+    return bool(value)
+
+
 def caller_dirname(steps=1):
     """
 
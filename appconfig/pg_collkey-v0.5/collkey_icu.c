@@ -32,6 +32,9 @@
 
 
 #include <postgres.h>
+#if PG_VERSION_NUM >= 160000
+#include <varatt.h>  // VARDATA & co. moved out of postgres.h in PostgreSQL 16
+#endif
 #include <utils/elog.h>
 #include <utils/builtins.h>
 #include <fmgr.h>
@@ -56,26 +59,119 @@ static void pgsqlext_collkey_icu_error(UErrorCode uerror) {
     default:
     sqlerrcode = ERRCODE_INTERNAL_ERROR;
   }
-  ereport(ERROR, (sqlerrcode,
+  ereport(ERROR, (errcode(sqlerrcode),
     errmsg("libicu error: %s", u_errorName(uerror))
   ));
 }
 
 static void pgsqlext_collkey_nomem() {
-  ereport(ERROR, (ERRCODE_OUT_OF_MEMORY,
+  ereport(ERROR, (errcode(ERRCODE_OUT_OF_MEMORY),
     errmsg("%s", "Memory allocation for collation key generation failed.")
   ));
 }
 
 static void pgsqlext_collkey_overflow() {
-  ereport(ERROR, (ERRCODE_PROGRAM_LIMIT_EXCEEDED,
+  ereport(ERROR, (errcode(ERRCODE_PROGRAM_LIMIT_EXCEEDED),
     errmsg("%s", "Text is too long for collation key generation.")
   ));
 }
 
 
+/*
+ *  Collators are cached per backend - keyed by locale and attributes - so queries mixing
+ *  locales or options, e.g. sorting by collkey(a, 'de') and collkey(b, 'root'), neither reopen
+ *  a collator nor reset its attributes for each row. When the cache is full, the least recently
+ *  used collator is closed.
+ */
+#define PGSQLEXT_COLLKEY_CACHE_SIZE 8
+
+typedef struct {
+  char *locale;  /* malloc'ed, as the collator outlives memory contexts */
+  bool shifted;
+  int32_t strength;
+  bool numeric;
+  uint64 used;
+  UCollator *coll;  /* NULL for an empty slot */
+} pgsqlext_collkey_collator;
+
+static pgsqlext_collkey_collator pgsqlext_collkey_cache[PGSQLEXT_COLLKEY_CACHE_SIZE];
+static uint64 pgsqlext_collkey_clock = 0;
+
+static UColAttributeValue pgsqlext_collkey_strength(int32_t strength) {
+  switch (strength) {
+    case 0: return UCOL_DEFAULT;
+    case 1: return UCOL_PRIMARY;
+    case 2: return UCOL_SECONDARY;
+    case 3: return UCOL_TERTIARY;
+    case 4: return UCOL_QUATERNARY;
+    case 5: return UCOL_IDENTICAL;
+    default:
+    ereport(ERROR, (errcode(ERRCODE_INVALID_PARAMETER_VALUE),
+      errmsg("%s", "Illegal collation strength argument.")
+    ));
+  }
+  return UCOL_DEFAULT;  // not reached
+}
+
+static UCollator *pgsqlext_collkey_get_collator(
+  const char *locale, bool shifted, int32_t strength, bool numeric
+) {
+  pgsqlext_collkey_collator *entry, *victim = NULL;
+  UColAttributeValue ustrength;
+  UErrorCode uerror = U_ZERO_ERROR;
+  UCollator *coll;
+  char *saved_locale;
+  int i;
+
+  for (i = 0; i < PGSQLEXT_COLLKEY_CACHE_SIZE; i++) {
+    entry = &pgsqlext_collkey_cache[i];
+    if (entry->coll && entry->shifted == shifted && entry->strength == strength &&
+        entry->numeric == numeric && !strcmp(entry->locale, locale)) {
+      entry->used = ++pgsqlext_collkey_clock;
+      return entry->coll;
+    }
+    // Prefer empty slots, then the least recently used collator:
+    if (!victim || (victim->coll && (!entry->coll || entry->used < victim->used)))
+      victim = entry;
+  }
+
+  // Everything which may raise an error is done before the cache is changed.
+  ustrength = pgsqlext_collkey_strength(strength);
+  saved_locale = strdup(locale);
+  if (!saved_locale) pgsqlext_collkey_nomem();
+  coll = ucol_open(saved_locale, &uerror);
+  if (!coll || U_FAILURE(uerror)) {
+    free(saved_locale);
+    pgsqlext_collkey_icu_error(uerror);
+  }
+  ucol_setAttribute(coll, UCOL_NORMALIZATION_MODE, UCOL_ON, &uerror);
+  ucol_setAttribute(coll, UCOL_ALTERNATE_HANDLING,
+    shifted ? UCOL_SHIFTED : UCOL_NON_IGNORABLE, &uerror);
+  ucol_setAttribute(coll, UCOL_STRENGTH, ustrength, &uerror);
+  ucol_setAttribute(coll, UCOL_NUMERIC_COLLATION,
+    numeric ? UCOL_ON : UCOL_OFF, &uerror);
+  if (U_FAILURE(uerror)) {
+    ucol_close(coll);
+    free(saved_locale);
+    pgsqlext_collkey_icu_error(uerror);
+  }
+
+  if (victim->coll) {
+    ucol_close(victim->coll);
+    free(victim->locale);
+  }
+  victim->locale = saved_locale;
+  victim->shifted = shifted;
+  victim->strength = strength;
+  victim->numeric = numeric;
+  victim->used = ++pgsqlext_collkey_clock;
+  victim->coll = coll;
+  return coll;
+}
+
+
 PG_FUNCTION_INFO_V1(pgsqlext_collkey);
-// this function is NOT thread safe
+// this function is NOT thread safe - but PostgreSQL backends and parallel workers are processes
 
 Datum pgsqlext_collkey(PG_FUNCTION_ARGS) {
   UChar *ustr;
@@ -86,6 +182,7 @@ Datum pgsqlext_collkey(PG_FUNCTION_ARGS) {
   {
     static UConverter *cnv = NULL;
     text *input_string;
+    int32_t input_length;
 
     if (!cnv) {
       cnv = ucnv_open("UTF-8", &uerror);
@@ -93,16 +190,13 @@ Datum pgsqlext_collkey(PG_FUNCTION_ARGS) {
     }
 
     input_string = PG_GETARG_TEXT_P(0);
+    input_length = VARSIZE(input_string)-VARHDRSZ;
 
-    ustr_length = ucnv_toUChars(cnv, NULL, 0,
-      VARDATA(input_string), VARSIZE(input_string)-VARHDRSZ, &uerror);
-    if (uerror != U_BUFFER_OVERFLOW_ERROR && U_FAILURE(uerror))
-      pgsqlext_collkey_icu_error(uerror);
-    uerror = U_ZERO_ERROR;
-    if (ustr_length > SIZE_MAX/sizeof(UChar)) pgsqlext_collkey_overflow();
-    ustr = palloc(ustr_length * sizeof(UChar));
-    ustr_length = ucnv_toUChars(cnv, ustr, ustr_length,
-      VARDATA(input_string), VARSIZE(input_string)-VARHDRSZ, &uerror);
+    // UTF-8 never takes fewer code units than UTF-16, so one pass of conversion suffices:
+    if (input_length >= SIZE_MAX/sizeof(UChar)) pgsqlext_collkey_overflow();
+    ustr = palloc((input_length + 1) * sizeof(UChar));
+    ustr_length = ucnv_toUChars(cnv, ustr, input_length + 1,
+      VARDATA(input_string), input_length, &uerror);
     if (U_FAILURE(uerror)) pgsqlext_collkey_icu_error(uerror);
 
     PG_FREE_IF_COPY(input_string, 0);
@@ -111,80 +205,34 @@ Datum pgsqlext_collkey(PG_FUNCTION_ARGS) {
   // ustr is allocated here
 
   {
-    static UCollator *coll = NULL;
-    int32_t output_length;
+    UCollator *coll;
+    int32_t capacity, output_length;
 
     {
-      static char *saved_locale = NULL;
       char *locale;
       locale = DatumGetCString(
         DirectFunctionCall1(textout, PG_GETARG_DATUM(1))
       );
-      if (coll && strcmp(locale, saved_locale)) {
-        ucol_close(coll);
-        coll = NULL;
-      }
-      if (!coll) {
-        free(saved_locale);
-        saved_locale = strdup(locale);
-        if (!saved_locale) pgsqlext_collkey_nomem();
-        coll = ucol_open(saved_locale, &uerror);
-        if (!coll) pgsqlext_collkey_icu_error(uerror);
-        ucol_setAttribute(coll, UCOL_NORMALIZATION_MODE, UCOL_ON, &uerror);
-        // error check below
-      }
+      coll = pgsqlext_collkey_get_collator(locale,
+        PG_GETARG_BOOL(2), PG_GETARG_INT32(3), PG_GETARG_BOOL(4));
       pfree(locale);
     }
 
-    {
-      bool shifted;
-      shifted = PG_GETARG_BOOL(2);
-      ucol_setAttribute(coll, UCOL_ALTERNATE_HANDLING,
-        shifted ? UCOL_SHIFTED : UCOL_NON_IGNORABLE, &uerror);
-      // error check below
-    }
-
-    {
-      int32_t strength;
-      strength = PG_GETARG_INT32(3);
-      switch (strength) {
-        case 0: ucol_setAttribute(coll, UCOL_STRENGTH, UCOL_DEFAULT,
-          &uerror); break;
-        case 1: ucol_setAttribute(coll, UCOL_STRENGTH, UCOL_PRIMARY,
-          &uerror); break;
-        case 2: ucol_setAttribute(coll, UCOL_STRENGTH, UCOL_SECONDARY,
-          &uerror); break;
-        case 3: ucol_setAttribute(coll, UCOL_STRENGTH, UCOL_TERTIARY,
-          &uerror); break;
-        case 4: ucol_setAttribute(coll, UCOL_STRENGTH, UCOL_QUATERNARY,
-          &uerror); break;
-        case 5: ucol_setAttribute(coll, UCOL_STRENGTH, UCOL_IDENTICAL,
-          &uerror); break;
-        default:
-        ereport(ERROR, (ERRCODE_INVALID_PARAMETER_VALUE,
-          errmsg("%s", "Illegal collation strength argument.")
-        ));
-      }
-      // error check below
+    // Sort keys rarely take more than 4 bytes per UTF-16 code unit, so we compute the key
+    // right away, and only a second time if the buffer was too small. (Very long texts are
+    // measured first, as before.)
+    capacity = ustr_length < 1024*1024 ? ustr_length * 4 + 16 : 0;
+    output = palloc(capacity + VARHDRSZ);
+    output_length = ucol_getSortKey(coll, ustr, ustr_length,
+      (uint8_t *) VARDATA(output), capacity);
+    // we need a larger buffer than the key, due to a bug in the ICU library
+    if (output_length - 1 + 4 > capacity) {
+      if (output_length > SIZE_MAX-VARHDRSZ-4+1) pgsqlext_collkey_overflow();
+      capacity = output_length - 1 + 4;
+      pfree(output);
+      output = palloc(capacity + VARHDRSZ);
+      ucol_getSortKey(coll, ustr, ustr_length, (uint8_t *) VARDATA(output), capacity);
     }
-
-    {
-      bool numeric;
-      numeric = PG_GETARG_BOOL(4);
-      ucol_setAttribute(coll, UCOL_NUMERIC_COLLATION,
-        numeric ? UCOL_ON : UCOL_OFF, &uerror);
-      // error check below
-    }
-
-    // error check:
-    if (U_FAILURE(uerror)) pgsqlext_collkey_icu_error(uerror);
-
-    output_length = ucol_getSortKey(coll, ustr, ustr_length, NULL, 0);
-    // we create a larger buffer than needed, due to a bug in the ICU library
-    if (output_length > SIZE_MAX-VARHDRSZ-4+1) pgsqlext_collkey_overflow();
-    output = palloc(output_length + VARHDRSZ - 1 + 4);
-    ucol_getSortKey(coll, ustr, ustr_length,
-      VARDATA(output), output_length - 1 + 4);
     SET_VARSIZE(output, output_length + VARHDRSZ - 1);
 
   }
@@ -192,5 +240,3 @@ Datum pgsqlext_collkey(PG_FUNCTION_ARGS) {
   pfree(ustr);
   PG_RETURN_BYTEA_P(output);
 }
-
-
@@ -1,15 +1,29 @@
+
+-- Computing a sort key is much more expensive than a typical builtin function (COST 1), which
+-- the planner should know when choosing between sorting and an index on collkey().
 CREATE OR REPLACE FUNCTION collkey (text, text, bool, int4, bool) RETURNS bytea
-  LANGUAGE 'c' IMMUTABLE STRICT AS
+  LANGUAGE 'c' IMMUTABLE STRICT COST 100 AS
   '$libdir/collkey_icu.so',
   'pgsqlext_collkey';
 
 CREATE OR REPLACE FUNCTION collkey (text, text) RETURNS bytea
-  LANGUAGE SQL IMMUTABLE STRICT AS $$
+  LANGUAGE SQL IMMUTABLE STRICT COST 100 AS $$
   SELECT collkey ($1, $2, false, 0, true);
   $$;
 
 CREATE OR REPLACE FUNCTION collkey (text) RETURNS bytea
-  LANGUAGE SQL IMMUTABLE STRICT AS $$
+  LANGUAGE SQL IMMUTABLE STRICT COST 100 AS $$
   SELECT collkey ($1, 'root', false, 0, true);
   $$;
 
+-- Each backend - and each parallel worker - has its own collators, so the functions can run in
+-- parallel sequential scans and parallel index builds. PARALLEL SAFE needs PostgreSQL 9.6.
+DO $$
+BEGIN
+  IF current_setting('server_version_num')::int >= 90600 THEN
+    EXECUTE 'ALTER FUNCTION collkey (text, text, bool, int4, bool) PARALLEL SAFE';
+    EXECUTE 'ALTER FUNCTION collkey (text, text) PARALLEL SAFE';
+    EXECUTE 'ALTER FUNCTION collkey (text) PARALLEL SAFE';
+  END IF;
+END
+$$;
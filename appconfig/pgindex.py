@@ -0,0 +1,192 @@
+# pgindex.py - expression indexes for the columns apps sort and search by
+
+"""Expression indexes on ``collkey()`` and ``f_unaccent()``.
+
+Sorting by ``collkey(column, locale)`` computes an ICU sort key for each row of the table -
+unless there is an index on the expression. ``pg_collkey_indexes`` in apps.ini lists the
+columns an app sorts by as ``table.column[:locale]`` (the locale defaults to ``root``).
+
+``unaccent()`` is only STABLE - it depends on the dictionary - so it cannot be used in an index,
+and searching with ``unaccent(name) ILIKE ...`` scans the whole table. Apps with ``pg_unaccent``
+get the IMMUTABLE wrapper ``f_unaccent(text)`` and the ``pg_trgm`` extension (see `UNACCENT_SQL`),
+and ``pg_trgm_indexes`` lists the columns an app searches as ``table.column``, to be indexed with
+GIN on ``f_unaccent(column) gin_trgm_ops``. Queries must use the wrapper to hit the index, i.e.
+``WHERE f_unaccent(name) ILIKE f_unaccent('%query%')``.
+
+`require` creates a missing index for each target with ``CREATE INDEX CONCURRENTLY``, so the app
+can keep using the table meanwhile. Indexes left invalid by an interrupted build are dropped and
+built again. Then a sample query is run through ``EXPLAIN`` - with sequential scans disabled, so
+that small tables don't mislead the planner - to confirm the index is usable.
+
+All targets are handled by one script, i.e. in one round trip. For each, it reports whether the
+index existed or was created - or whether the table is missing, e.g. before the database has
+been loaded - along with the build time, the size of the index and whether the sample query used
+it, which `report` prints.
+"""
+import re
+import shlex
+import hashlib
+import collections
+
+from fabric.api import sudo, settings, hide
+
+__all__ = ['require', 'targets', 'Target', 'TrgmTarget', 'Result', 'UNACCENT_SQL']
+
+Target = collections.namedtuple('Target', 'table column locale')
+
+TrgmTarget = collections.namedtuple('TrgmTarget', 'table column')
+
+Result = collections.namedtuple('Result', 'target index status seconds size used')
+
+TARGET = re.compile(
+    r'(?P<table>[a-z_][a-z0-9_]*)\.(?P<column>[a-z_][a-z0-9_]*)(:(?P<locale>[A-Za-z0-9_@=;-]+))?$')
+
+TRGM_TARGET = re.compile(r'(?P<table>[a-z_][a-z0-9_]*)\.(?P<column>[a-z_][a-z0-9_]*)$')
+
+# The dictionary is passed explicitly, so the result doesn't depend on the search_path - which
+# is what makes declaring the wrapper IMMUTABLE safe.
+UNACCENT_SQL = r"""
+CREATE EXTENSION IF NOT EXISTS unaccent WITH SCHEMA public;
+CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public;
+CREATE OR REPLACE FUNCTION public.f_unaccent(text) RETURNS text
+  LANGUAGE sql IMMUTABLE STRICT AS
+  $$SELECT public.unaccent('public.unaccent'::regdictionary, $1)$$;
+"""
+
+# Define a bash function `pg_index DB NAME TABLE DEFINITION QUERY` printing
+# "INDEX NAME STATUS MILLISECONDS BYTES USED".
+FUNCTION = r"""pg_index() {
+  local db=$1 name=$2 table=$3 definition=$4 query=$5 state status ms=0 start sql size used=-
+  state=$(psql -X -q -A -t -d $db -c "SELECT CASE
+    WHEN to_regclass('$table') IS NULL THEN 'missing'
+    WHEN i.indisvalid THEN 'valid' WHEN NOT i.indisvalid THEN 'invalid' ELSE 'none' END
+    FROM (SELECT 1) AS x LEFT JOIN pg_class AS c ON c.relname = '$name' AND c.relkind = 'i'
+    LEFT JOIN pg_index AS i ON i.indexrelid = c.oid")
+  case $state in
+    missing) status=MISSING ;;
+    valid) status=EXISTS ;;
+    *)
+      if [ "$state" = invalid ]; then
+        psql -X -q -d $db -c "DROP INDEX CONCURRENTLY IF EXISTS $name"
+      fi
+      start=$(date +%s%N)
+      sql="CREATE INDEX CONCURRENTLY IF NOT EXISTS $name ON $table $definition"
+      if psql -X -q -d $db -c "$sql"; then status=CREATED; else status=FAILED; fi
+      ms=$(( ($(date +%s%N) - start) / 1000000 )) ;;
+  esac
+  size=$(psql -X -q -A -t -d $db -c "SELECT COALESCE(pg_relation_size(to_regclass('$name')), 0)")
+  if [ $status = EXISTS ] || [ $status = CREATED ]; then
+    if psql -X -q -A -t -d $db -c "SET enable_seqscan = off; EXPLAIN $query" | grep -qw $name
+    then used=yes; else used=no; fi
+  fi
+  echo "INDEX $name $status $ms ${size:-0} $used"
+}
+"""
+
+
+def targets(app):
+    """Return the `Target` and `TrgmTarget` list of an app's indexes.
+
+    >>> app = type('App', (), {
+    ...     'pg_collkey_indexes': ('language.name', 'value.name:de'),
+    ...     'pg_trgm_indexes': ('language.name',)})
+    >>> [type(t).__name__ for t in targets(app)]
+    ['Target', 'Target', 'TrgmTarget']
+    """
+    res = []
+    for spec in app.pg_collkey_indexes:
+        m = TARGET.match(spec)
+        if not m:
+            raise ValueError('invalid collkey index target: %r' % spec)
+        res.append(Target(m.group('table'), m.group('column'), m.group('locale') or 'root'))
+    for spec in app.pg_trgm_indexes:
+        m = TRGM_TARGET.match(spec)
+        if not m:
+            raise ValueError('invalid trigram index target: %r' % spec)
+        res.append(TrgmTarget(m.group('table'), m.group('column')))
+    return res
+
+
+def index_name(target):
+    """Return a valid PostgreSQL identifier - at most 63 characters - naming the index."""
+    if isinstance(target, TrgmTarget):
+        name = 'trgm_{0}_{1}'.format(target.table, target.column)
+    else:
+        name = 'collkey_{0}_{1}_{2}'.format(
+            target.table, target.column, re.sub('[^a-z0-9_]', '_', target.locale.lower()))
+    if len(name) > 63:
+        name = '{0}_{1}'.format(name[:54], hashlib.sha1(name.encode('utf8')).hexdigest()[:8])
+    return name
+
+
+def definition(target):
+    """Return the part of ``CREATE INDEX`` following the table name.
+
+    >>> definition(TrgmTarget('language', 'name'))
+    'USING gin (f_unaccent(name) gin_trgm_ops)'
+    """
+    if isinstance(target, TrgmTarget):
+        return 'USING gin (f_unaccent({0.column}) gin_trgm_ops)'.format(target)
+    return "(collkey({0.column}, '{0.locale}'))".format(target)
+
+
+def sample_query(target):
+    """Return a query which should use the index of `target`."""
+    if isinstance(target, TrgmTarget):
+        return "SELECT 1 FROM {0.table} WHERE f_unaccent({0.column}) ILIKE f_unaccent('%abc%')"\
+            .format(target)
+    return "SELECT 1 FROM {0.table} ORDER BY collkey({0.column}, '{0.locale}') LIMIT 1".format(
+        target)
+
+
+def label(target):
+    if isinstance(target, TrgmTarget):
+        return '{0.table}.{0.column} (trgm)'.format(target)
+    return '{0.table}.{0.column}:{0.locale}'.format(target)
+
+
+def script(db, targets):
+    return '\n'.join([FUNCTION] + [
+        'pg_index ' + ' '.join(shlex.quote(arg) for arg in (
+            db, index_name(t), t.table, definition(t), sample_query(t)))
+        for t in targets])
+
+
+def parse(output, targets):
+    by_name = {index_name(t): t for t in targets}
+    res = collections.OrderedDict()
+    for line in output.splitlines():
+        parts = line.strip().split()
+        if len(parts) == 6 and parts[0] == 'INDEX' and parts[1] in by_name:
+            _, name, status, ms, size, used = parts
+            res[name] = Result(
+                by_name[name], name, status, int(ms) / 1000, int(size),
+                {'yes': True, 'no': False}.get(used))
+    return [
+        res.get(index_name(t), Result(t, index_name(t), 'FAILED', 0, 0, None)) for t in targets]
+
+
+def report(results):
+    print('{0:<40}{1:>10}{2:>11}{3:>12}{4:>8}'.format('index', 'status', 'time', 'size', 'used'))
+    for r in results:
+        print('{0:<40}{1:>10}{2:>10.1f}s{3:>12}{4:>8}'.format(
+            label(r.target),
+            r.status,
+            r.seconds,
+            '{0:.1f} MB'.format(r.size / 1024 ** 2),
+            {True: 'yes', False: 'NO'}.get(r.used, '-')))
+
+
+def require(app):
+    """Create the missing indexes of `app`, check they are used and print a report.
+
+    :return: list of `Result`.
+    """
+    tt = targets(app)
+    if not tt:
+        return []
+    with settings(hide('output'), warn_only=True):
+        output = sudo(script(app.name, tt), user='postgres', pty=False)
+    results = parse(output, tt)
+    report(results)
+    return results
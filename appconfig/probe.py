@@ -0,0 +1,104 @@
+# probe.py - wait for app servers to become ready
+
+"""Readiness probes for restarted apps.
+
+Instead of waiting a fixed time and requesting ``/_ping`` once, `probe` polls any number of
+URLs concurrently on the remote host - in one round trip. Each URL is requested until it
+responds with status 200 and ``{"status": "ok"}``, waiting `DELAY` seconds after the first failed
+attempt and doubling the wait after each further one (up to `MAX_DELAY`), until the deadline.
+
+For each URL, the time until it was ready and the latency of the first successful request are
+reported - and recorded as ``ready:<name>`` events if tracing is enabled (see `appconfig.trace`).
+"""
+import time
+import shlex
+import collections
+
+from fabric.api import run, settings
+
+from . import trace
+
+__all__ = ['probe', 'Result']
+
+DELAY, MAX_DELAY = 0.1, 2.0
+
+Result = collections.namedtuple('Result', 'name url ready seconds latency tries status')
+
+# probe NAME URL DELAY_MS DEADLINE_MS TIMEOUT_S MAX_DELAY_MS
+FUNCTION = r"""probe() {
+  local t0 d n out last now
+  t0=$(date +%s%N); d=$3; n=0
+  while :; do
+    n=$((n + 1))
+    out=$(curl -s -m $5 -w '\n%{http_code} %{time_total}' "$2")
+    last=${out##*$'\n'}
+    if [ "${last%% *}" = 200 ] && printf '%s' "${out%$'\n'*}" | grep -q '"status": *"ok"'; then
+      echo "READY $1 $(( ($(date +%s%N) - t0) / 1000000 )) ${last#* } $n 200"
+      return 0
+    fi
+    now=$(( ($(date +%s%N) - t0) / 1000000 ))
+    if [ $((now + d)) -gt $4 ]; then
+      echo "FAILED $1 $now 0 $n ${last%% *}"
+      return 1
+    fi
+    sleep $((d / 1000)).$(printf '%03d' $((d % 1000)))
+    d=$((d * 2)); [ $d -gt $6 ] && d=$6
+  done
+}"""
+
+
+def script(targets, deadline, timeout, delay=DELAY, max_delay=MAX_DELAY):
+    lines = [FUNCTION]
+    for name, url in targets.items():
+        lines.append('probe {0} {1} {2} {3} {4} {5} &'.format(
+            shlex.quote(name),
+            shlex.quote(url),
+            int(delay * 1000),
+            int(deadline * 1000),
+            int(timeout),
+            int(max_delay * 1000)))
+    lines.append('wait')
+    return '\n'.join(lines)
+
+
+def parse(output, targets):
+    res = collections.OrderedDict(
+        (name, Result(name, url, False, None, None, 0, None)) for name, url in targets.items())
+    for line in output.splitlines():
+        words = line.split()
+        if len(words) == 6 and words[0] in ('READY', 'FAILED') and words[1] in res:
+            status, name, ms, latency, tries, code = words
+            res[name] = Result(
+                name,
+                targets[name],
+                status == 'READY',
+                int(ms) / 1000,
+                float(latency.replace(',', '.')) if status == 'READY' else None,
+                int(tries),
+                code)
+    return res
+
+
+def probe(targets, deadline, timeout=10, delay=DELAY, max_delay=MAX_DELAY):
+    """Poll `targets` - a dict mapping names to URLs - concurrently until ready or `deadline`.
+
+    :param deadline: Seconds after which to give up.
+    :param timeout: Seconds to wait for a single response.
+    :return: `OrderedDict` mapping names to `Result`.
+    """
+    start = time.time()
+    with settings(cwd='', command_prefixes=[], shell_env={}):
+        output = run(
+            script(targets, deadline, timeout, delay, max_delay), warn_only=True, quiet=True)
+    results = parse(output, targets)
+    if trace.enabled():
+        for r in results.values():
+            trace.record(
+                'ready:{0}'.format(r.name),
+                start,
+                start + (r.seconds or 0),
+                url=r.url,
+                ready=r.ready,
+                latency=r.latency,
+                tries=r.tries)
+    return results
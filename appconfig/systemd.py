@@ -1,20 +1,12 @@
 import os
 
-from fabric.api import sudo
-from fabtools import files
+from . import upload
+from . import coalesce
+from . import templating
 
 
 def upload_template(p, dest, ctx, mode='644'):
-    files.upload_template(
-        p.name,
-        dest,
-        ctx,
-        use_jinja=True,
-        template_dir=str(p.parent),
-        use_sudo=True,
-        mode=mode,
-        backup=False,
-        chown=True)
+    upload.put_file(dest, templating.render_path(p, ctx), mode=mode)
 
 
 def enable(app, d):
@@ -36,40 +28,48 @@ def enable(app, d):
     - `script_path`: The path of the associated script on the target system.
     """
     if d.exists() and d.name == 'systemd':
-        for unit in d.iterdir():
-            ctx = dict(app=app, osenv=os.environ)
-            script = unit / 'script'
-            if script.exists():
-                ctx['script_path'] = script_path = '/usr/bin/{0}-{1}'.format(app.name, unit.name)
-                upload_template(script, script_path, ctx, mode='755')
+        units = []
+        with upload.batch():  # Upload the files of all units at once.
+            for unit in d.iterdir():
+                ctx = dict(app=app, osenv=os.environ)
+                script = unit / 'script'
+                if script.exists():
+                    ctx['script_path'] = script_path = '/usr/bin/{0}-{1}'.format(
+                        app.name, unit.name)
+                    upload_template(script, script_path, ctx, mode='755')
 
-            enable = 'service'
-            for name in ['service', 'timer']:
-                p = unit / name
+                enable = 'service'
+                for name in ['service', 'timer']:
+                    p = unit / name
 
-                if p.exists() and name == 'timer':
-                    enable = name
-                if p.exists():
-                    upload_template(
-                        p, '/etc/systemd/system/{0}-{1}.{2}'.format(app.name, unit.name, name), ctx)
-            sudo('systemctl start {0}-{1}.{2}'.format(app.name, unit.name, enable))
-            sudo('systemctl enable {0}-{1}.{2}'.format(app.name, unit.name, enable))
-        sudo('systemctl daemon-reload')
+                    if p.exists() and name == 'timer':
+                        enable = name
+                    if p.exists():
+                        upload_template(
+                            p,
+                            '/etc/systemd/system/{0}-{1}.{2}'.format(app.name, unit.name, name),
+                            ctx)
+                units.append('{0}-{1}.{2}'.format(app.name, unit.name, enable))
+        with coalesce.commands() as batch:
+            for unit in units:
+                batch.sudo('systemctl start {0}'.format(unit))
+                batch.sudo('systemctl enable {0}'.format(unit))
+            batch.sudo('systemctl daemon-reload')
 
 
 def uninstall(app, d):
     if d.exists() and d.name == 'systemd':
-        for unit in d.iterdir():
-            delete = ['/usr/bin/{0}-{1}'.format(app.name, unit.name)]
-            enable = 'service'
-            for name in ['service', 'timer']:
-                if name == 'timer':
-                    enable = name
-                delete.append('/etc/systemd/system/{0}-{1}.{2}'.format(app.name, unit.name, name))
-            sudo('systemctl stop {0}-{1}.{2}'.format(app.name, unit.name, enable))
-            sudo('systemctl disable {0}-{1}.{2}'.format(app.name, unit.name, enable))
-            for p in delete:
-                if files.exists(p):
-                    sudo('rm {0}'.format(p))
-        sudo('systemctl daemon-reload')
-        sudo('systemctl reset-failed')
+        with coalesce.commands() as batch:
+            for unit in d.iterdir():
+                delete = ['/usr/bin/{0}-{1}'.format(app.name, unit.name)]
+                enable = 'service'
+                for name in ['service', 'timer']:
+                    if name == 'timer':
+                        enable = name
+                    delete.append(
+                        '/etc/systemd/system/{0}-{1}.{2}'.format(app.name, unit.name, name))
+                batch.sudo('systemctl stop {0}-{1}.{2}'.format(app.name, unit.name, enable))
+                batch.sudo('systemctl disable {0}-{1}.{2}'.format(app.name, unit.name, enable))
+                batch.sudo('rm -f {0}'.format(' '.join(delete)))
+            batch.sudo('systemctl daemon-reload')
+            batch.sudo('systemctl reset-failed')
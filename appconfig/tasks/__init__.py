@@ -16,6 +16,7 @@ import functools
 import fabric.api
 
 from .. import helpers
+from .. import trace
 
 __all__ = ['init', 'task_app_from_environment']
 
@@ -49,7 +50,9 @@ def task_app_from_environment(func_or_environment):
                 # allow overriding the hosts by using fab's -H option
                 fabric.api.env.hosts = [getattr(APP, environment)]
             fabric.api.env.environment = environment
-            return fabric.api.execute(func, APP, *args, **kwargs)
+            trace.set_app(getattr(APP, 'name', None))
+            with trace.tracing():  # if $APPCONFIG_TRACE is set
+                return fabric.api.execute(func, APP, *args, **kwargs)
         wrapper.execute_inner = func
         return fabric.api.task(wrapper)
     else:
@@ -1,28 +1,41 @@
 # deployment.py
 
 import os
-import json
-import time
 import platform
 import tempfile
 import functools
 import random
 import pathlib
 import re
+import shlex
+import collections
 
-from fabric.api import env, settings, shell_env, prompt, sudo, run, cd, local
+from fabric.api import env, settings, shell_env, prompt, sudo, run, cd, local, hide, abort
 from fabric.contrib.files import exists, comment, sed
 from fabric.contrib.console import confirm
 from fabtools import (
-    require, files, python, postgres, nginx, system, service, supervisor, user, deb)
+    require, files, python, postgres, nginx, service, supervisor, user)
 from clldutils import misc
 
 from .. import APPS, APPS_DIR
 from .. import PKG_DIR
 from .. import helpers
+from .. import util
+from .. import facts
+from .. import builds
+from .. import pgindex
 from .. import cdstar
 from .. import systemd
+from .. import dag
+from .. import upload
+from .. import templating
+from .. import coalesce
+from .. import probe
+from .. import wheelhouse
+from .. import venvsync
+from .. import artifact
 from . import letsencrypt
+from . import state
 
 from . import task_app_from_environment
 
@@ -30,7 +43,19 @@ __all__ = ['deploy', 'start', 'stop', 'uninstall', 'sudo_upload_template', 'upgr
 
 PLATFORM = platform.system().lower()
 PG_COLLKEY_DIR = PKG_DIR / 'pg_collkey-v0.5'
-TEMPLATE_DIR = PKG_DIR / 'templates'
+TEMPLATE_DIR = templating.TEMPLATE_DIR
+
+#: The sources of builds (see `builds`) - changing them changes the build keys.
+PG_COLLKEY_SOURCES = [PG_COLLKEY_DIR / 'collkey_icu.c', TEMPLATE_DIR / 'pg_collkey.Makefile']
+BIBUTILS_URL = 'https://sourceforge.net/projects/bibutils/files/bibutils_6.2_src.tgz/download'
+
+#: The app server instances of an app in blue/green mode; blue is the one of apps not using it.
+COLORS = ('blue', 'green')
+
+Instance = collections.namedtuple('Instance', 'color program supervisor pid port')
+
+#: Restarted apps must be ready within this multiple of their request timeout.
+READY_TIMEOUT_FACTOR = 3
 
 
 def template_context(app, workers=3, with_blog=False):
@@ -61,7 +86,10 @@ def sudo_upload_template(template,
                          user_own=None,
                          **kwargs):
     """
-    A wrapper around upload_template in fabtools. Used to upload template files.
+    Render a template and upload it to `dest`. Used to upload template files.
+
+    Templates in `templates/<app name>/` override the ones in `templates/` for an app passed as
+    `app` in the context.
 
     :param user_own: Set to user name that's supposed to own the file.
         If it is None, the uploading user's rights are used.
@@ -72,20 +100,21 @@ def sudo_upload_template(template,
     if kwargs:
         context = (context or {}).copy()
         context.update(kwargs)
-    tdir = TEMPLATE_DIR
-    if context and ('app' in context) and TEMPLATE_DIR.joinpath(context['app'].name, template).exists():
-        tdir = TEMPLATE_DIR / context['app'].name
-    files.upload_template(
-        template,
-        dest,
-        context,
-        use_jinja=True,
-        template_dir=str(tdir),
-        use_sudo=True,
-        backup=False,
-        mode=mode,
-        chown=True,
-        user=user_own)
+    app = (context or {}).get('app')
+    content = templating.render(template, context, app_name=app.name if app else None)
+    remote_state, batch = state.ACTIVE, upload.pending()
+    key, fp = 'template:{0}'.format(dest), None
+    if remote_state:
+        fp = state.fingerprint(content, dest, mode, user_own)
+        if remote_state.unchanged(key, fp):
+            return
+    if batch is not None:
+        # The fingerprint is recorded by the step uploading the batch.
+        batch.add(dest, content, mode=mode, user=user_own, fingerprint=(key, fp) if fp else None)
+        return
+    upload.put_file(dest, content, mode=mode, user=user_own)
+    if remote_state:
+        remote_state.record(key, fp)
 
 
 def pip_freeze(app, packages=None):
@@ -105,17 +134,30 @@ def pip_freeze(app, packages=None):
         fp.writelines(iterlines(stdout.splitlines()))
 
 
-def check(app):
-    time.sleep(5)
-    res = run('curl http://localhost:%s/_ping' % app.port)
-    assert json.loads(res)['status'] == 'ok'
+def check(app, port=None, public=True):
+    """Wait for the app server on `port` - by default the live one - and the site to be ready.
 
-    if env.environment == 'production':
-        if app.public:
-            # Production apps are served over HTTPS. If they are public, we can check the complete
-            # stack:
-            res_https = run('curl https://%s/_ping' % (app.domain))
-            assert json.loads(res_https)['status'] == 'ok'
+    Both are probed concurrently, with backoff, for up to `READY_TIMEOUT_FACTOR` times the app's
+    timeout (see `appconfig.probe`).
+    """
+    if port is None:
+        port = instance(app, live_color(app)).port if app.blue_green else app.port
+    targets = collections.OrderedDict([('local', 'http://localhost:%s/_ping' % port)])
+    if public and env.environment == 'production' and app.public:
+        # Production apps are served over HTTPS. If they are public, we can check the complete
+        # stack:
+        targets['public'] = 'https://%s/_ping' % app.domain
+
+    results = probe.probe(
+        targets, deadline=READY_TIMEOUT_FACTOR * app.timeout, timeout=app.timeout)
+    for r in results.values():
+        if r.ready:
+            print('{0}: {1} ready after {2:.1f}s ({3} requests), first response in {4:.3f}s'
+                  .format(app.name, r.url, r.seconds, r.tries, r.latency))
+    failed = [r for r in results.values() if not r.ready]
+    assert not failed, '\n'.join(
+        '{0} not ready after {1}s ({2} requests, last status {3})'.format(
+            r.url, r.seconds, r.tries, r.status) for r in failed)
 
 
 @task_app_from_environment
@@ -123,18 +165,22 @@ def upgrade(app, **packages):
     """
     usage: fab upgrade:production,waitress=1.4.3
     """
-    with python.virtualenv(str(app.venv_dir)):
-        require.python.packages(
-            ['{0}=={1}'.format(*pkg) for pkg in packages.items()], use_sudo=True)
+    wheelhouse.install(app.venv_dir, ['{0}=={1}'.format(*pkg) for pkg in packages.items()])
     pip_freeze(app, packages)
-    stop.execute_inner(app)
-    start.execute_inner(app)
+    if app.blue_green:
+        switch(app)
+    else:
+        stop.execute_inner(app)
+        start.execute_inner(app)
     check(app)
 
 
 @task_app_from_environment
 def start(app):
     """start app by changing the supervisord config"""
+    if app.blue_green:
+        switch(app)
+        return
     require_supervisor(app.supervisor, app)
     supervisor.update_config()
     service.reload('nginx')
@@ -153,14 +199,81 @@ def stop(app, maintenance_hours=1):
         sudo_upload_template('503.html', dest=str(app.www_dir / '503.html'),
                              app_name=app.name, timestamp=timestamp)
 
-    require_supervisor(app.supervisor, app, pause=True)
+    for inst in instances(app):
+        require_supervisor(inst.supervisor, app, pause=True, instance=inst)
     supervisor.update_config()
     service.reload('nginx')
 
 
-def require_supervisor(filepath, app, pause=False):
+def require_supervisor(filepath, app, pause=False, instance=None):
     # TODO: consider require.supervisor.process
-    sudo_upload_template('supervisor.conf', dest=str(filepath), mode='644', PAUSE=pause, app=app)
+    kw = {}
+    if instance and app.blue_green:
+        kw = dict(program=instance.program, pid=instance.pid, bind='127.0.0.1:%s' % instance.port)
+    sudo_upload_template(
+        'supervisor.conf', dest=str(filepath), mode='644', PAUSE=pause, app=app, **kw)
+
+
+def instance(app, color):
+    """Return the `Instance` of the app server of `app` of the given color.
+
+    The blue instance is the one apps not in blue/green mode run, too.
+    """
+    port = app.blue_green_ports[COLORS.index(color)]
+    if color == 'blue':
+        return Instance(color, app.name, app.supervisor, app.gunicorn_pid, port)
+    program = '{0}-{1}'.format(app.name, color)
+    return Instance(
+        color,
+        program,
+        app.supervisor.with_name(program + app.supervisor.suffix),
+        app.gunicorn_pid.with_name('gunicorn-{0}.pid'.format(color)),
+        port)
+
+
+def instances(app):
+    return [instance(app, c) for c in (COLORS if app.blue_green else COLORS[:1])]
+
+
+def upstream_conf(app):
+    return pathlib.PurePosixPath('/etc/nginx/conf.d') / '{0}-upstream.conf'.format(app.name)
+
+
+def live_color(app):
+    """Return the color of the instance nginx passes requests to."""
+    res = run('cat %s' % upstream_conf(app), quiet=True)
+    if res.succeeded and ':%s;' % instance(app, 'green').port in res:
+        return 'green'
+    return 'blue'
+
+
+def require_upstream(app, inst):
+    sudo_upload_template(
+        'nginx-upstream.conf',
+        dest=str(upstream_conf(app)), mode='644', app=app, color=inst.color, port=inst.port)
+
+
+def switch(app):
+    """Restart an app in blue/green mode without downtime.
+
+    The idle instance is (re)started with the current code and config and checked, before nginx
+    is switched to it with a graceful reload. Only then the previously live instance is stopped;
+    gunicorn finishes the requests in progress before exiting.
+    """
+    old = instance(app, live_color(app))
+    new = instance(app, COLORS[1 - COLORS.index(old.color)])
+    require_supervisor(new.supervisor, app, instance=new)
+    supervisor.update_config()
+    # Restart in any case, because an unchanged config would leave a running instance as is.
+    supervisor.restart_process(new.program)
+    check(app, port=new.port, public=False)
+
+    require_upstream(app, new)
+    service.reload('nginx')
+
+    require_supervisor(old.supervisor, app, pause=True, instance=old)
+    supervisor.update_config()
+    print('{0}: switched from {1} to {2} instance'.format(app.name, old.color, new.color))
 
 
 @task_app_from_environment
@@ -177,7 +290,7 @@ def uninstall(app):  # pragma: no cover
         if app.stack != 'soundcomparisons':
             sudo('dropdb --if-exists %s' % app.name, user='postgres')
         else:
-            php_version = run('ls /etc/php')
+            php_version = facts.get().php
             path = '/etc/php/{0}/fpm/pool.d/www'.format(php_version) + app.name + '.conf'
 
             if exists(path):
@@ -186,8 +299,9 @@ def uninstall(app):  # pragma: no cover
             sudo('echo "drop database {0};" | mysql'.format(app.name))
         sudo('userdel -rf %s' % app.name)
 
-    if exists(str(app.supervisor)):
-        files.remove(str(app.supervisor), recursive=True, use_sudo=True)
+    for path in [inst.supervisor for inst in instances(app)] + [upstream_conf(app)]:
+        if exists(str(path)):
+            files.remove(str(path), recursive=True, use_sudo=True)
 
     supervisor.update_config()
     service.reload('nginx')
@@ -195,10 +309,28 @@ def uninstall(app):  # pragma: no cover
 
 
 @task_app_from_environment
-def deploy(app, with_blog=None, with_alembic=False):
-    """deploy the app"""
-    assert system.distrib_id() == 'Ubuntu'
-    lsb_codename = system.distrib_codename()
+def deploy(app,
+           with_blog=None,
+           with_alembic=False,
+           parallel=True,
+           force=False,
+           batch=True,
+           sync=False,
+           prebuilt=False):
+    """deploy the app
+
+    :param parallel: Run independent deploy steps concurrently (see `deploy_steps`).
+    :param force: Run all deploy steps, even if their fingerprint is unchanged (see `state`).
+    :param batch: Upload the config files rendered by deploy steps as one archive.
+    :param sync: Install the packages pinned in the app's requirements.txt, changing only what
+        differs in the virtualenv (see `venvsync`).
+    :param prebuilt: Install the virtualenv built when deploying to another host, if there is one,
+        or build it and keep it for the other hosts (see `artifact`).
+    """
+    # Gather the facts about the host the deploy steps need - in one round trip:
+    host = facts.get(venvs=[app.venv_dir] if app.stack == 'clld' else [])
+    assert host.distrib_id == 'Ubuntu'
+    lsb_codename = host.codename
     if lsb_codename not in ['xenial', 'bionic', 'focal']:
         raise ValueError('unsupported platform: %s' % lsb_codename)
 
@@ -211,29 +343,39 @@ def deploy(app, with_blog=None, with_alembic=False):
                    'with remote master, continue?', default=False):
             print("Continuing deployment.")
         else:
-            print("Deployment aborted.")
-            return
-
-    require.deb.packages(getattr(app, 'require_deb_%s' % lsb_codename) + app.require_deb)
-    require.users.user(app.name, create_home=True, shell='/bin/bash')
-    require.directory(str(app.www_dir), use_sudo=True)
-    require.directory(str(app.www_dir / 'files'), use_sudo=True)
-    require_logging(app.log_dir,
-                    logrotate=app.logrotate,
-                    access_log=app.access_log, error_log=app.error_log)
+            abort('Deployment aborted.')  # Failing the deploy, so the fleet reports it.
 
     workers = 3 if app.workers > 3 and env.environment == 'test' else app.workers
     with_blog = with_blog if with_blog is not None else app.with_blog
 
-    if env.environment != 'staging':
-        # Test and production instances are publicly accessible over HTTPS.
-        letsencrypt.require_certbot()
-        letsencrypt.require_cert(env.host)
-        if env.environment == 'production':
-            letsencrypt.require_cert(app)
-
+    # Note: Creating the template context may prompt for input, so we do it before running steps.
     ctx = template_context(app, workers=workers, with_blog=with_blog)
 
+    lockfile = None
+    if helpers.asbool(sync):
+        lockfile = APPS_DIR / app.name / 'requirements.txt'
+        if not lockfile.exists():
+            print('{0} does not exist - installing {1}'.format(lockfile, app.app_pkg))
+            lockfile = None
+
+    state.ACTIVE = remote_state = state.RemoteState(app, force=helpers.asbool(force)).load()
+    upload.ACTIVE = templates = upload.Batch() if helpers.asbool(batch) else None
+    steps = dag.Graph(deploy_steps(
+        app,
+        ctx,
+        lsb_codename,
+        remote_state=remote_state,
+        templates=templates,
+        lockfile=lockfile,
+        prebuilt=helpers.asbool(prebuilt)))
+    try:
+        steps.run(concurrent=helpers.asbool(parallel))
+    finally:
+        # Record the fingerprints of all successful steps - even if others failed.
+        state.ACTIVE = upload.ACTIVE = None
+        remote_state.update(steps.results.values())
+        remote_state.save()
+
     if app.stack == 'soundcomparisons':  # pragma: no cover
         require.git.working_copy(
             'https://github.com/{0}/{1}.git'.format(app.github_org, app.github_repos),
@@ -258,35 +400,6 @@ def deploy(app, with_blog=None, with_alembic=False):
         service.reload('nginx')
         return
 
-    #
-    # Create a virtualenv for the app and install the app package in development mode, i.e. with
-    # repository working copy in /usr/venvs/<APP>/src
-    #
-    require_venv(
-        app.venv_dir,
-        require_packages=[app.app_pkg] + app.require_pip,
-        assets_name=app.name if app.stack == 'clld' else None)
-
-    #
-    # If some of the static assets are managed via bower, update them.
-    #
-    require_bower(app)
-    require_grunt(app)
-
-    require_nginx(ctx)
-
-    if app.stack == 'clld':
-        require_bibutils()
-
-    require_postgres(app)
-
-    require_config(app.config, app, ctx)
-
-    # if gunicorn runs, make it gracefully reload the app by sending HUP
-    # TODO: consider 'supervisorctl signal HUP $name' instead (xenial+)
-    sudo('( [ -f {0} ] && kill -0 $(cat {0}) 2> /dev/null '
-         '&& kill -HUP $(cat {0}) ) || echo no reload '.format(app.gunicorn_pid))
-
     if not with_alembic and confirm('Recreate database?', default=False):
         stop.execute_inner(app)
         upload_sqldump(app)
@@ -302,12 +415,162 @@ def deploy(app, with_blog=None, with_alembic=False):
     check(app)
     if env.environment == 'production':
         systemd.enable(app, pathlib.Path(os.getcwd()) / 'systemd')
+    steps.report()
 
 
-def require_php(app):  # pragma: no cover
-    require.deb.packages(['php-fpm'])
+def deploy_steps(app,
+                 ctx,
+                 lsb_codename,
+                 remote_state=None,
+                 templates=None,
+                 lockfile=None,
+                 prebuilt=False):
+    """Return the steps of `deploy` up to reloading the app server as list of `dag.Step`.
+
+    Steps installing deb packages share the "apt" resource, because dpkg allows only one
+    installation at a time. Steps which may prompt for input run in the local process.
+
+    If `remote_state` is given, steps with a fingerprint are skipped if it is unchanged. If
+    `templates` is an `upload.Batch`, templates rendered by local steps are collected and uploaded
+    by the "templates" step. If `lockfile` is given, the virtualenv is synced with it. If
+    `prebuilt`, the virtualenv is installed from an artifact built for another host.
+    """
+    p = functools.partial
+    apt = ['apt']
+    packages = list(getattr(app, 'require_deb_%s' % lsb_codename) + app.require_deb)
+    pip_packages = [app.app_pkg] + list(app.require_pip)
+    fingerprints = {
+        'packages': p(state.fingerprint, lsb_codename, sorted(packages)),
+        'user': p(state.fingerprint, app.name, str(app.home_dir)),
+        'dirs': p(state.fingerprint, str(app.www_dir)),
+        'venv': p(venv_fingerprint, app, lsb_codename, pip_packages, lockfile=lockfile),
+        'bower': p(static_fingerprint, app, 'bower.json'),
+        'grunt': p(static_fingerprint, app, 'Gruntfile.js'),
+        'postgres': p(postgres_fingerprint, app),
+    }
 
-    php_version = run('ls /etc/php')
+    def step(name, func, **kw):
+        if remote_state:
+            func = remote_state.step(name, func, fingerprints.get(name))
+        return dag.Step(name, func, **kw)
+
+    steps = [
+        step('packages', p(util.require_debs, packages), resources=apt),
+        step('user', p(require.users.user, app.name, create_home=True, shell='/bin/bash')),
+        step('dirs', p(require_www_dir, app), inputs=['user']),
+        step(
+            'logging',
+            p(require_logging, app.log_dir,
+              logrotate=app.logrotate, access_log=app.access_log, error_log=app.error_log),
+            local=templates is not None),  # Run locally, to add logrotate.conf to the batch.
+    ]
+    if env.environment != 'staging':
+        # Test and production instances are publicly accessible over HTTPS.
+        steps.append(step('certs', p(require_certs, app), inputs=['packages'], resources=apt))
+
+    if app.stack == 'soundcomparisons':  # pragma: no cover
+        return steps
+
+    #
+    # Create a virtualenv for the app and install the app package in development mode, i.e. with
+    # repository working copy in /usr/venvs/<APP>/src
+    #
+    venv = p(require_venv,
+             app.venv_dir,
+             require_packages=pip_packages if lockfile is None else None,
+             assets_name=app.name if app.stack == 'clld' else None,
+             lockfile=lockfile)
+    if prebuilt:
+        venv = p(require_venv_prebuilt, app, venv, fingerprints['venv'])
+    steps.append(step('venv', venv, inputs=['packages']))
+    #
+    # If some of the static assets are managed via bower, update them.
+    #
+    steps.append(step('bower', p(require_bower, app), inputs=['venv'], resources=apt))
+    steps.append(step('grunt', p(require_grunt, app), inputs=['bower'], resources=apt))
+    steps.append(step(
+        'nginx',
+        p(require_nginx, ctx),
+        inputs=['venv', 'certs'] if env.environment != 'staging' else ['venv', 'packages'],
+        local=True))  # http_auth may prompt for passwords.
+    if app.stack == 'clld':
+        steps.append(step('bibutils', require_bibutils, inputs=['packages']))
+    steps.append(step('postgres', p(require_postgres, app), inputs=['packages'], resources=apt))
+    steps.append(step(
+        'config',
+        p(require_config, app.config, app, ctx),
+        inputs=['dirs'],
+        local=True))  # Django apps prompt for recreating the secret key.
+    if templates is not None:
+        steps.append(dag.Step(
+            'templates',
+            templates.upload,
+            inputs=[o for step in steps for o in step.outputs],
+            local=True))
+    if not app.blue_green:  # Otherwise, the idle instance is started by `switch`.
+        steps.append(step(
+            'reload',
+            p(reload_gunicorn, app),
+            inputs=[o for step in steps for o in step.outputs]))
+    return steps
+
+
+def venv_fingerprint(app, lsb_codename, packages, lockfile=None):
+    if lockfile:
+        return state.fingerprint(
+            lsb_codename, str(app.venv_dir), lockfile.read_text(encoding='utf8'),
+            app.stack == 'clld')
+    heads = [state.git_head(pkg) for pkg in packages]
+    if None in heads:  # We can't tell whether the app code changed.
+        return None
+    return state.fingerprint(
+        lsb_codename, str(app.venv_dir), packages, heads, app.stack == 'clld')
+
+
+def static_fingerprint(app, filename):
+    # One round trip: The checksum of e.g. bower.json - or nothing if it doesn't exist.
+    with settings(warn_only=True):
+        res = sudo('sha1sum {0} 2>/dev/null || true'.format(app.static_dir / filename))
+    return state.fingerprint(str(app.static_dir), filename, str(res))
+
+
+def postgres_fingerprint(app):
+    sources = [PG_COLLKEY_DIR / n for n in ['collkey_icu.c', 'collkey_icu.sql']]
+    return state.fingerprint(
+        app.name,
+        app.pg_unaccent,
+        pgindex.UNACCENT_SQL if app.pg_unaccent else None,
+        app.pg_collkey,
+        [p.read_text(encoding='utf8') for p in sources] if app.pg_collkey else None,
+        # The step also creates the indexes, see `require_postgres`:
+        app.pg_collkey_indexes,
+        app.pg_trgm_indexes,
+        pgindex.FUNCTION if app.pg_collkey_indexes or app.pg_trgm_indexes else None)
+
+
+def require_www_dir(app):
+    require.directory(str(app.www_dir), use_sudo=True)
+    require.directory(str(app.www_dir / 'files'), use_sudo=True)
+
+
+def require_certs(app):
+    letsencrypt.require_certbot()
+    letsencrypt.require_cert(env.host)
+    if env.environment == 'production':
+        letsencrypt.require_cert(app)
+
+
+def reload_gunicorn(app):
+    # if gunicorn runs, make it gracefully reload the app by sending HUP
+    # TODO: consider 'supervisorctl signal HUP $name' instead (xenial+)
+    sudo('( [ -f {0} ] && kill -0 $(cat {0}) 2> /dev/null '
+         '&& kill -HUP $(cat {0}) ) || echo no reload '.format(app.gunicorn_pid))
+
+
+def require_php(app):  # pragma: no cover
+    if util.require_debs(['php-fpm']):
+        facts.refresh()
+    php_version = facts.get().php
     sudo_upload_template(
         'php-fpm-www.conf',
         '/etc/php/{1}/fpm/pool.d/www{0}.conf'.format(app.name, php_version),
@@ -318,8 +581,8 @@ def require_php(app):  # pragma: no cover
     return php_version
 
 def require_mysql(app):  # pragma: no cover
-    if not deb.is_installed('mariadb-server'):
-        require.deb.packages(['mariadb-server', 'mariadb-client', 'php-mysql'])
+    if 'mariadb-server' not in facts.get().debs:
+        util.require_debs(['mariadb-server', 'mariadb-client', 'php-mysql'])
 
     require.mysql.user(app.name, app.name)
     require.mysql.database(app.name, owner=app.name)
@@ -331,7 +594,7 @@ def require_mysql(app):  # pragma: no cover
 def require_bower(app, d=None):
     d = d or app.static_dir
     if exists(str(d / 'bower.json')):
-        require.deb.packages(['npm', 'nodejs'])
+        util.require_debs(['npm', 'nodejs'])
         sudo('npm install -g bower@1.8.8')
         with cd(str(d)):
             sudo('bower --allow-root install')
@@ -340,26 +603,28 @@ def require_bower(app, d=None):
 def require_grunt(app, d=None):
     d = d or app.static_dir
     if exists(str(d / 'Gruntfile.js')):
-        require.deb.packages(['npm', 'nodejs'])
+        util.require_debs(['npm', 'nodejs'])
         sudo('npm install -g grunt-cli@1.3.2')
         with cd(str(d)):
             sudo('npm install')
             sudo('grunt')
 
 
-def require_bibutils(executable='/usr/local/bin/bib2xml',
-                     url='https://sourceforge.net/projects/bibutils/files/'
-                         'bibutils_6.2_src.tgz/download'):
-    if not exists(executable):
+def require_bibutils(url=BIBUTILS_URL):
+    def build(stage):
         tgz = url.partition('/download')[0].rpartition('/')[2]
         tdir = tgz.partition('_src.tgz')[0]
         with cd('/tmp'):
             require.file(tgz, url=url, mode='')
             run('tar xzf %s' % tgz)
             with cd(tdir):
-                run('./configure')
+                run('./configure --install-dir {0}/usr/local/bin --install-lib {0}/usr/local/lib'
+                    .format(stage))
                 run('make')
-                sudo('make install')
+                sudo('mkdir -p {0}/usr/local/bin {0}/usr/local/lib && make install'.format(stage))
+
+    # The tarball is versioned, so its URL identifies the sources:
+    builds.require('bibutils', build, sources=[url], codename=facts.get().codename)
 
 
 def require_postgres(app, drop=False):
@@ -373,23 +638,44 @@ def require_postgres(app, drop=False):
                 encrypted_password=True)
         require.postgres.database(app.name, owner=app.name)
 
+    with coalesce.commands() as batch:
+        require_extensions(app, batch)
+
+    if not drop:  # A dropped database is loaded - and indexed - right after.
+        pgindex.require(app)
+
+
+def require_extensions(app, batch):
     if app.pg_unaccent:
-        sql = 'CREATE EXTENSION IF NOT EXISTS unaccent WITH SCHEMA public;'
-        sudo('psql -c "%s" -d %s' % (sql, app.name), user='postgres')
+        batch.sudo(
+            'psql -c %s -d %s' % (shlex.quote(pgindex.UNACCENT_SQL), app.name), user='postgres')
 
     if app.pg_collkey:
-        pg_dir, = run('find /usr/lib/postgresql/ -mindepth 1 -maxdepth 1 -type d').splitlines()
-        pg_version = pathlib.PurePosixPath(pg_dir).name
-        if not exists('/usr/lib/postgresql/%s/lib/collkey_icu.so' % pg_version):
-            require.deb.packages(['postgresql-server-dev-%s' % pg_version, 'libicu-dev'])
+        # The server may have been installed by require_postgres only:
+        pg_version, = facts.get().postgres or facts.refresh().postgres
+
+        def build(stage):
             with cd('/tmp'):
-                sudo_upload_template('pg_collkey.Makefile', dest='Makefile', pg_version=pg_version)
+                # A temporary build input: Upload it now - not batched, and never skipped because
+                # remote state says the rendered template didn't change.
+                makefile = upload.Batch()
+                makefile.add('/tmp/Makefile', templating.render(
+                    'pg_collkey.Makefile', {'pg_version': pg_version}))
+                makefile.upload()
                 require.file('collkey_icu.c', source=str(PG_COLLKEY_DIR / 'collkey_icu.c'))
                 run('make')
-                sudo('make install')
+                sudo('make install DESTDIR=%s' % stage)
+
+        builds.require(
+            'collkey_icu',
+            build,
+            sources=PG_COLLKEY_SOURCES,
+            toolchain=['postgresql-server-dev-%s' % pg_version, 'libicu-dev'],
+            codename=facts.get().codename,
+            pg_version=pg_version)
         with cd('/tmp'):
             require.file('collkey_icu.sql', source=str(PG_COLLKEY_DIR / 'collkey_icu.sql'))
-            sudo('psql -f collkey_icu.sql -d %s' % app.name, user='postgres')
+            batch.sudo('psql -f collkey_icu.sql -d %s' % app.name, user='postgres')
 
 
 def require_config(filepath, app, ctx):
@@ -406,21 +692,40 @@ def require_config(filepath, app, ctx):
             str(filepath.parent / 'secret_key'), contents=secret_key, use_sudo=True, mode='644')
 
 
-def require_venv(directory, require_packages=None, assets_name=None, requirements=None):
+def require_venv(directory,
+                 require_packages=None,
+                 assets_name=None,
+                 requirements=None,
+                 lockfile=None):
     require.directory(str(directory), use_sudo=True)
 
     with settings(sudo_prefix=env.sudo_prefix + ' -H'):  # set HOME for pip log/cache
         require.python.virtualenv(str(directory), venv_python='python3', use_sudo=True)
 
+        if require_packages:
+            wheelhouse.install(directory, require_packages)
+        if lockfile:
+            venvsync.sync(directory, lockfile)
         with python.virtualenv(str(directory)):
-            if require_packages:
-                require.python.packages(require_packages, use_sudo=True)
             if requirements:
                 require.python.requirements(requirements, use_sudo=True)
             if assets_name:
                 sudo('webassets -m %s.assets build' % assets_name)
 
 
+def require_venv_prebuilt(app, build, key):
+    """Install the virtualenv from the artifact with fingerprint `key()` - or `build` and pack it.
+    """
+    key = key()
+    hosts = [h for h in (app.production, app.test) if h and h != env.host]
+    if key and artifact.fetch(app, key, hosts=hosts):
+        artifact.install(app, key)
+        return
+    build()
+    if key:  # Without fingerprint, we can't tell whether another host could use the artifact.
+        artifact.pack(app, key)
+
+
 def require_logging(log_dir, logrotate, access_log, error_log):
     require.directory(str(log_dir), use_sudo=True)
 
@@ -447,6 +752,9 @@ def require_nginx(ctx):
         admin_auth=admin_auth)
 
     sudo_upload_template('nginx-default.conf', dest=str(app.nginx_default_site), env=env)
+    if app.blue_green:
+        # The app's site config passes requests to the upstream defined here:
+        require_upstream(app, instance(app, live_color(app)))
     if env.environment != 'test':
         upload_app(dest=str(app.nginx_site))
         nginx.enable(app.nginx_site.name)
@@ -457,6 +765,10 @@ def require_nginx(ctx):
 
 def get_clld_dir(venv_dir):
     # /usr/venvs/<app_name>/local/lib/python<version>/site-packages/clld/__init__.pyc
+    clld_dir = facts.get(venvs=[venv_dir]).clld_dirs[str(venv_dir)]
+    if clld_dir:
+        return pathlib.PurePosixPath(clld_dir)
+    # Not installed when the facts were gathered:
     with python.virtualenv(str(venv_dir)):
         stdout = sudo('python -c "import clld; print(clld.__file__)"')
     clld_path = pathlib.PurePosixPath(stdout.split()[-1])
@@ -476,9 +788,10 @@ def http_auth(app):
 
     require.directory(str(app.nginx_htpasswd.parent), use_sudo=True)
     pairs = [(u, p) for u, p in pwds.items() if p]
-    for opts, pairs in [('-bdc', pairs[:1]), ('-bd', pairs[1:])]:
-        for u, p in pairs:
-            sudo('htpasswd %s %s %s %s' % (opts, app.nginx_htpasswd, u, p))
+    with coalesce.commands() as batch:
+        for opts, pairs in [('-bdc', pairs[:1]), ('-bd', pairs[1:])]:
+            for u, p in pairs:
+                batch.sudo('htpasswd %s %s %s %s' % (opts, app.nginx_htpasswd, u, p))
 
     auth = ('proxy_set_header Authorization $http_authorization;\n'
             'proxy_pass_header Authorization;\n'
@@ -492,18 +805,49 @@ def upload_dump(app):
     upload_sqldump(app, load=False)
 
 
+# Download, decompress and load a dump in one pipeline, i.e. without a copy in /tmp, while
+# computing the checksum and size of the download. Prints "STREAM RC BYTES MILLISECONDS CHECKSUM".
+STREAM_SQLDUMP = r"""# appconfig stream_sqldump
+set -o pipefail
+tmp=$(mktemp -d) && mkfifo $tmp/sum $tmp/size || exit 1
+{algorithm}sum < $tmp/sum > $tmp/sum.out &
+wc -c < $tmp/size > $tmp/size.out &
+start=$(date +%s%N)
+curl -sSf {auth}{url} | tee $tmp/sum $tmp/size | gunzip -c | psql -q -d {db} > /dev/null
+rc=$?
+wait
+ms=$(( ($(date +%s%N) - start) / 1000000 ))
+echo "STREAM $rc $(cat $tmp/size.out) $ms $(cut -d' ' -f1 $tmp/sum.out)"
+rm -rf $tmp
+"""
+
+CHECKSUM_ALGORITHMS = ['md5', 'sha1', 'sha256']
+
+
 def upload_sqldump(app, load=True):
     if app.dbdump:
+        checksum = None
         if re.match('http(s)?://', app.dbdump):
             fname = 'dump.sql.gz'
             url = app.dbdump
             auth = ''
         else:
             latest = cdstar.get_latest_bitstream(app.dbdump)
-            fname, url = latest.name, latest.url
+            fname, url, checksum = latest.name, latest.url, latest.checksum
             auth = '-u"{0}:{1}" '.format(os.environ['CDSTAR_USER_BACKUP'], os.environ['CDSTAR_PWD_BACKUP'])
+        if checksum and checksum[0] not in CHECKSUM_ALGORITHMS:
+            print('unsupported checksum algorithm {0}: not verifying the dump'.format(checksum[0]))
+            checksum = None
+        if load and app.stack != 'soundcomparisons' and stream_sqldump(app, url, auth, checksum):
+            return
         target = pathlib.PurePosixPath('/tmp') / fname
         run('curl -s -o {0} {1} {2}'.format(target, auth, url))
+        if checksum:
+            digest = run('{0}sum {1}'.format(checksum[0], target)).split(' ')[0]
+            if digest.lower() != checksum[1]:
+                files.remove(str(target))
+                abort('{0} checksum mismatch of {1} ({2} != {3})'.format(
+                    checksum[0], url, digest, checksum[1]))
     else:
         db_name = prompt('Replace with dump of local database:', default=app.name)
         sqldump = pathlib.Path(tempfile.mktemp(suffix='.sql.gz', prefix='%s-' % db_name))
@@ -526,12 +870,51 @@ def upload_sqldump(app, load=True):
                 require_postgres(app, drop=True)
 
             sudo('gunzip -c %s | psql -d %s' % (target, app.name), user=app.name)
-            sudo('vacuumdb -zf %s' % app.name, user='postgres')
+            analyze_sqldump(app)
         files.remove(str(target))
     else:
         print(str(target))
 
 
+def stream_sqldump(app, url, auth='', checksum=None):
+    """Load the dump at `url` into a fresh database without downloading it to a file first.
+
+    :param checksum: `(algorithm, hexdigest)` to verify the download against.
+    :return: Whether the database was loaded. If not, the transfer failed and the caller falls
+        back to downloading the dump. A dump not matching `checksum` aborts the deploy.
+    """
+    if postgres.database_exists(app.name):
+        require_postgres(app, drop=True)
+
+    script = STREAM_SQLDUMP.format(
+        algorithm=checksum[0] if checksum else 'md5', auth=auth, url=url, db=app.name)
+    with settings(hide('output'), warn_only=True):
+        res = sudo(script, user=app.name, pty=False)
+    m = re.search(r'^STREAM (\d+) (\d+) (\d+) ?(\S*)\s*$', res, flags=re.MULTILINE)
+    if not (m and m.group(1) == '0'):
+        print('streaming the dump failed: falling back to downloading it')
+        return False
+    size, seconds, digest = int(m.group(2)), max(int(m.group(3)), 1) / 1000, m.group(4)
+    if checksum and digest.lower() != checksum[1]:
+        # Downloading the dump again won't fix it - and the loaded data must not be used.
+        require_postgres(app, drop=True)
+        abort('{0} checksum mismatch of {1} ({2} != {3})'.format(
+            checksum[0], url, digest, checksum[1]))
+
+    print('streamed {0} in {1:.1f}s [{2}/s]{3}'.format(
+        misc.format_size(size),
+        seconds,
+        misc.format_size(int(size / seconds)),
+        ', {0} verified'.format(checksum[0]) if checksum else ''))
+    analyze_sqldump(app)
+    return True
+
+
+def analyze_sqldump(app):
+    sudo('vacuumdb -zf %s' % app.name, user='postgres')
+    pgindex.require(app)
+
+
 def alembic_upgrade_head(app, ctx):
     with python.virtualenv(str(app.venv_dir)), cd(str(app.src_dir)):
         sudo('%s -n production upgrade head' % (app.alembic), user=app.name)
@@ -1,17 +1,16 @@
 from fabric.api import sudo
-from fabtools import require
 
 from appconfig import APPS
 from appconfig.config import App
 
 from appconfig import util
-from fabtools.system import distrib_codename
+from appconfig import facts
 
 
 def require_certbot():
-    require.deb.package('software-properties-common')
-    util.ppa('ppa:certbot/certbot', lsb_codename=distrib_codename())
-    require.deb.package('python-certbot-nginx')
+    util.require_debs(['software-properties-common'])
+    util.ppa('ppa:certbot/certbot', lsb_codename=facts.get().codename)
+    util.require_debs(['python-certbot-nginx'])
 
 
 def require_cert(domain):
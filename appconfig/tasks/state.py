@@ -0,0 +1,106 @@
+# state.py - fingerprints of deployed state, stored on the remote host
+
+"""
+Skipping unchanged deploy steps
+-------------------------------
+
+Each fingerprinted deploy step computes a hash of its inputs (e.g. the requirements and the
+commit of the app repository for the virtualenv, the rendered content for templates). The
+fingerprints of the last successful run are stored in a JSON file in the app's home directory;
+a step is skipped when its fingerprint did not change. Pass `force=True` to `deploy` to run all
+steps regardless.
+"""
+import re
+import json
+import hashlib
+
+from fabric.api import sudo, settings, hide, local
+from fabtools import require
+
+__all__ = ['RemoteState', 'fingerprint', 'git_head']
+
+STATE_FILE = '.appconfig-state.json'
+
+#: The state of the running deploy, consulted by `deployment.sudo_upload_template`.
+ACTIVE = None
+
+
+def fingerprint(*items):
+    """
+    >>> assert fingerprint('a', ['b']) != fingerprint('a', ['c'])
+    """
+    return hashlib.sha1(
+        json.dumps(items, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+
+def git_head(requirement):
+    """Return the commit a VCS requirement resolves to, '' for non-VCS requirements.
+
+    Returns None if the commit cannot be determined.
+    """
+    m = re.search(r'git\+(?P<url>[^@#\s]+)(@(?P<rev>[^#\s]+))?', requirement)
+    if not m:
+        return ''
+    rev = m.group('rev')
+    if rev and re.fullmatch('[0-9a-f]{40}', rev):
+        return rev
+    with settings(hide('everything'), warn_only=True):
+        res = local('git ls-remote {0} {1}'.format(m.group('url'), rev or 'HEAD'), capture=True)
+    if res.failed or not res.strip():
+        return None
+    return res.split()[0]
+
+
+class RemoteState(object):
+
+    def __init__(self, app, force=False):
+        self.path = app.home_dir / STATE_FILE
+        self.force = force
+        self.fingerprints = {}
+        self.recorded = {}
+
+    def load(self):
+        with settings(hide('everything'), warn_only=True):
+            res = sudo('cat {0}'.format(self.path))
+        try:
+            self.fingerprints = json.loads(res) if res.succeeded else {}
+        except (ValueError, TypeError):
+            self.fingerprints = {}
+        if not isinstance(self.fingerprints, dict):
+            self.fingerprints = {}
+        return self
+
+    def save(self):
+        require.file(
+            str(self.path),
+            contents=json.dumps(self.fingerprints, sort_keys=True, indent=2),
+            use_sudo=True,
+            mode='600')
+
+    def unchanged(self, key, fp):
+        return (not self.force) and fp is not None and self.fingerprints.get(key) == fp
+
+    def record(self, key, fp):
+        if fp is not None:
+            self.recorded[key] = fp
+
+    def step(self, name, func, fingerprint=None):
+        """Wrap a deploy step function, to skip it if its fingerprint is unchanged.
+
+        The wrapper returns the fingerprints recorded while running the step (including those
+        of templates uploaded by the step), because steps may run in a child process.
+        """
+        def wrapper():
+            self.recorded = {}
+            fp = fingerprint() if fingerprint else None
+            if self.unchanged(name, fp):
+                print('{0}: unchanged, skipping'.format(name))
+                return {}
+            func()
+            self.record(name, fp)
+            return dict(self.recorded)
+        return wrapper
+
+    def update(self, results):
+        for res in results:
+            self.fingerprints.update(res or {})
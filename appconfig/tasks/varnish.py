@@ -1,6 +1,6 @@
 # varnish.py - install, configure, and run varnish cache
 
-from fabric.api import settings, run
+from fabric.api import settings, run, abort
 from fabtools import require, files, service
 
 from . import task_app_from_environment
@@ -26,6 +26,7 @@ def cache(app):
     - adapt nginx site config
     - /etc/init.d/nginx reload
     """
+    _require_single_instance(app)
     require.deb.package('varnish')
 
     deployment.sudo_upload_template('varnish', dest='/etc/default/varnish')
@@ -43,6 +44,7 @@ def cache(app):
 
 @task_app_from_environment('production')
 def uncache(app):
+    _require_single_instance(app)
     with settings(warn_only=True):
         files.remove(str(app.varnish_site), use_sudo=True)
 
@@ -51,6 +53,13 @@ def uncache(app):
     _update_nginx(app, with_varnish=False)
 
 
+def _require_single_instance(app):
+    # The varnish backend and the nginx upstream would point to one fixed port, bypassing - or
+    # stopping to serve - the blue/green instance which is live.
+    if app.blue_green:
+        abort('{0}: varnish is not supported for blue/green apps'.format(app.name))
+
+
 def _update_varnish_sites(directory):
     sites = run('find %s -mindepth 1 -maxdepth 1 -type f ' % directory,
                 combine_stderr=False).splitlines()
@@ -0,0 +1,54 @@
+# templating.py - a process-wide Jinja engine for the config file templates
+
+"""Render templates with compiled templates cached per process.
+
+`fabtools.files.upload_template` creates a new Jinja environment - and thus compiles the
+template again - for each upload. Here, there is one environment per template directory,
+caching compiled templates; Jinja's `auto_reload` recompiles a template when the mtime of its
+file changes. Which directory a template is loaded from - the app-specific override
+`templates/<app>/<template>` or `templates/<template>` - is memoized, too.
+"""
+import pathlib
+import functools
+
+import jinja2
+
+from . import PKG_DIR
+
+__all__ = ['TEMPLATE_DIR', 'environment', 'template_dir', 'render', 'render_path']
+
+TEMPLATE_DIR = PKG_DIR / 'templates'
+
+
+@functools.lru_cache(maxsize=None)
+def environment(directory):
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(str(directory)), auto_reload=True, cache_size=-1)
+
+
+@functools.lru_cache(maxsize=None)
+def template_dir(template, app_name=None, directory=TEMPLATE_DIR):
+    """Return the directory to load `template` from - considering per-app overrides.
+
+    >>> template_dir('config.ini').name
+    'templates'
+    """
+    if app_name and directory.joinpath(app_name, template).exists():
+        return directory / app_name
+    return directory
+
+
+def render(template, context=None, app_name=None, directory=TEMPLATE_DIR):
+    tdir = template_dir(template, app_name, pathlib.Path(directory))
+    return environment(tdir).get_template(template).render(**(context or {}))
+
+
+def render_path(path, context=None):
+    """Render the template file `path`, e.g. a systemd unit in an app's directory."""
+    path = pathlib.Path(path).resolve()
+    return environment(path.parent).get_template(path.name).render(**(context or {}))
+
+
+def cache_clear():
+    environment.cache_clear()
+    template_dir.cache_clear()
@@ -0,0 +1,231 @@
+# trace.py - record calls of fabric primitives as a timeline
+
+"""Tracing of remote commands, transfers and prompts.
+
+If ``$APPCONFIG_TRACE`` is set to a file path, `install` wraps fabric's `run`, `sudo`,
+`local`, `get`, `put`, `prompt` and `confirm` - in all modules of appconfig, fabric and fabtools
+which use them. Each call is recorded with its wall time, the bytes transferred, the host and the
+deploy step (see `step`) it was called from.
+
+Events are appended to ``<path>.events`` as JSON lines, so processes forked by `dag.Graph` or
+started by `fleet.deploy` can add to the same trace. `finish` converts the events to Chrome's
+trace event format - to be viewed in chrome://tracing or https://ui.perfetto.dev - and prints a
+summary per step.
+"""
+import io
+import os
+import sys
+import json
+import time
+import contextlib
+import collections
+
+__all__ = ['enabled', 'install', 'step', 'tracing', 'finish', 'summary']
+
+ENV_VAR = 'APPCONFIG_TRACE'
+
+#: Names of the instrumented functions, mapped to the modules defining them.
+PRIMITIVES = collections.OrderedDict([
+    ('run', 'fabric.operations'),
+    ('sudo', 'fabric.operations'),
+    ('local', 'fabric.operations'),
+    ('get', 'fabric.operations'),
+    ('put', 'fabric.operations'),
+    ('prompt', 'fabric.operations'),
+    ('confirm', 'fabric.contrib.console'),
+])
+
+WAITS = {'prompt', 'confirm'}
+
+_context = {'app': None, 'step': None}
+_originals = {}
+
+
+def path():
+    return os.environ.get(ENV_VAR)
+
+
+def enabled():
+    return bool(path())
+
+
+def events_path(trace_path=None):
+    return '{0}.events'.format(trace_path or path())
+
+
+def _nbytes(obj):
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    if isinstance(obj, io.BytesIO):
+        return obj.getbuffer().nbytes
+    if isinstance(obj, io.StringIO):
+        return len(obj.getvalue().encode('utf8'))
+    return 0
+
+
+def _transferred(name, args, kwargs, result):
+    if name == 'put':
+        local_path = kwargs.get('local_path', args[0] if args else None)
+        if isinstance(local_path, str) and os.path.isfile(local_path):
+            return os.path.getsize(local_path)
+        return _nbytes(local_path)
+    if name == 'get':
+        return sum(os.path.getsize(p) for p in (result or []) if os.path.isfile(p))
+    if name in WAITS:
+        return 0
+    return _nbytes(result)
+
+
+def record(name, start, end, **args):
+    from fabric.api import env
+
+    args.setdefault('host', env.get('host_string'))
+    args.update((k, v) for k, v in _context.items() if v)
+    event = dict(
+        name=name,
+        cat=_context['step'] or '-',
+        ph='X',
+        ts=int(start * 1e6),
+        dur=int((end - start) * 1e6),
+        pid=os.getpid(),
+        tid=0,
+        args=args)
+    with open(events_path(), 'a', encoding='utf8') as fp:
+        fp.write(json.dumps(event, default=str) + '\n')
+
+
+def _wrap(name, func):
+    def wrapper(*args, **kwargs):
+        start, result = time.time(), None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            if enabled():
+                record(
+                    name,
+                    start,
+                    time.time(),
+                    command=str(args[0] if args else next(iter(kwargs.values()), ''))[:200],
+                    bytes=_transferred(name, args, kwargs, result))
+    wrapper.__wrapped__ = func
+    wrapper.__name__ = getattr(func, '__name__', name)
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def install():
+    """Instrument the fabric primitives, if tracing is enabled."""
+    if not enabled() or _originals:
+        return
+    import fabric.api  # noqa: F401
+    import fabric.contrib.console  # noqa: F401
+
+    for name, modname in PRIMITIVES.items():
+        _originals[name] = getattr(sys.modules[modname], name)
+    wrappers = {id(func): _wrap(name, func) for name, func in _originals.items()}
+    for modname, mod in list(sys.modules.items()):
+        if mod is None or not modname.startswith(('appconfig', 'fabric', 'fabtools')):
+            continue
+        for name in PRIMITIVES:
+            obj = mod.__dict__.get(name)
+            if obj is not None and id(obj) in wrappers:
+                _originals.setdefault((modname, name), obj)
+                setattr(mod, name, wrappers[id(obj)])
+
+
+def uninstall():
+    for key, func in list(_originals.items()):
+        if isinstance(key, tuple) and key[0] in sys.modules:
+            setattr(sys.modules[key[0]], key[1], func)
+    _originals.clear()
+
+
+def set_app(name):
+    _context['app'] = name
+
+
+@contextlib.contextmanager
+def step(name):
+    """Attribute the calls within the context to step `name` - recording the step, too."""
+    previous, _context['step'] = _context['step'], name
+    start = time.time()
+    try:
+        yield
+    finally:
+        if enabled():
+            record('step:{0}'.format(name), start, time.time())
+        _context['step'] = previous
+
+
+def load(trace_path=None):
+    p = events_path(trace_path)
+    if not os.path.exists(p):
+        return []
+    with open(p, encoding='utf8') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def summary(events):
+    """Return rows `(step, round trips, seconds, waiting seconds, bytes)`, slowest first."""
+    rows = collections.OrderedDict()
+    for e in events:
+        key = ':'.join(n for n in [e['args'].get('app'), e['cat']] if n and n != '-') or '-'
+        row = rows.setdefault(key, [key, 0, 0.0, 0.0, 0])
+        if e['name'].startswith('step:'):
+            row[2] += e['dur'] / 1e6
+        elif e['name'] not in PRIMITIVES:  # Recorded by e.g. `probe`, not a call of a primitive.
+            continue
+        elif e['name'] in WAITS:
+            row[3] += e['dur'] / 1e6
+        else:
+            row[1] += 1
+            row[4] += e['args'].get('bytes', 0)
+            if e['cat'] == '-':  # Calls outside of steps.
+                row[2] += e['dur'] / 1e6
+    return sorted(rows.values(), key=lambda r: -r[2])
+
+
+def finish(trace_path=None, file=None):
+    """Write the Chrome trace JSON and print a summary per step."""
+    trace_path = trace_path or path()
+    events = load(trace_path)
+    with open(trace_path, 'w', encoding='utf8') as fp:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), fp)
+    if os.path.exists(events_path(trace_path)):
+        os.remove(events_path(trace_path))
+    print('{0:<30}{1:>12}{2:>10}{3:>10}{4:>12}'.format(
+        'step', 'round trips', 'time [s]', 'wait [s]', 'bytes'), file=file)
+    for row in summary(events):
+        print('{0:<30}{1:>12}{2:>10.1f}{3:>10.1f}{4:>12}'.format(*row), file=file)
+    for e in events:
+        if e['name'].startswith('ready:'):
+            print('{0} {1}: ready {2} after {3:.1f}s, first response in {4}s'.format(
+                e['args'].get('app') or '-', e['args']['url'], e['args']['ready'],
+                e['dur'] / 1e6, e['args']['latency']), file=file)
+    print('trace written to {0}'.format(trace_path), file=file)
+    return events
+
+
+@contextlib.contextmanager
+def tracing(trace_path=None):
+    """Trace the calls within the context - if tracing is enabled or `trace_path` is given."""
+    old = os.environ.get(ENV_VAR)
+    if trace_path:
+        os.environ[ENV_VAR] = str(trace_path)
+    if not enabled():
+        yield
+        return
+    if os.path.exists(events_path()):
+        os.remove(events_path())
+    install()
+    try:
+        yield
+    finally:
+        uninstall()
+        finish()
+        if trace_path:
+            if old is None:
+                del os.environ[ENV_VAR]
+            else:  # pragma: no cover
+                os.environ[ENV_VAR] = old
@@ -0,0 +1,140 @@
+# upload.py - upload many rendered files in one archive
+
+"""Batched upload of rendered files.
+
+`fabtools.files.upload_template` costs one SFTP transfer and three to four further round trips
+(test -d, sudo mv, chown and chmod) per file. A `Batch` collects rendered files and ships them
+as one tar archive, which is unpacked with a single sudo command: All files are staged next to
+their destination first, then moved into place with `mv -f` - an atomic rename - so a failed
+upload leaves the previous files in place.
+
+Single files are uploaded the same way, see `put_file`.
+"""
+import io
+import os
+import time
+import shlex
+import posixpath
+import tarfile
+import contextlib
+import collections
+
+from fabric.api import env, put, sudo
+
+__all__ = ['Batch', 'batch', 'pending', 'put_file']
+
+#: Round trips of `fabtools.files.upload_template(..., use_sudo=True, chown=True)`:
+#: test -d, put, sudo mv and chown - plus chmod if a mode is given.
+ROUND_TRIPS_PER_FILE = 4
+
+#: Round trips of a batch: put and the sudo unpacking the archive.
+ROUND_TRIPS_PER_BATCH = 2
+
+STAGING_SUFFIX = '.appconfig-new'
+
+#: The batch collecting uploads in this process, see `batch`.
+ACTIVE = None
+
+File = collections.namedtuple('File', 'dest content mode user')
+
+
+class Batch(object):
+
+    def __init__(self):
+        self.files = collections.OrderedDict()
+        self.fingerprints = {}
+        self.pid = os.getpid()
+        self.round_trips = [0, 0]  # [batched, unbatched]
+
+    def __len__(self):
+        return len(self.files)
+
+    def add(self, dest, content, mode=None, user=None, fingerprint=None):
+        """Queue `content` for upload to `dest`.
+
+        :param dest: Remote path - relative paths are resolved like fabric's `put` does, i.e.
+            relative to the directory set with `cd`.
+        :param fingerprint: `(key, fp)` pair, recorded in `fingerprints` once uploaded.
+        """
+        dest = str(dest)
+        if not posixpath.isabs(dest):
+            if not env.get('cwd'):
+                raise ValueError('relative path without remote cd: {0}'.format(dest))
+            dest = posixpath.join(env.cwd, dest)
+        self.files[dest] = File(dest, content, mode, user)
+        if fingerprint:
+            self.fingerprints[fingerprint[0]] = fingerprint[1]
+
+    def archive(self):
+        buf = io.BytesIO()
+        mtime = time.time()
+        with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+            for f in self.files.values():
+                data = f.content.encode('utf8')
+                info = tarfile.TarInfo(f.dest.lstrip('/') + STAGING_SUFFIX)
+                info.size, info.mtime, info.mode = len(data), mtime, int(f.mode or '644', 8)
+                tar.addfile(info, io.BytesIO(data))
+        return buf.getvalue()
+
+    def script(self, archive_path, default_user):
+        """Return the shell commands to unpack the archive and move the files into place."""
+        q = shlex.quote
+        cmds = ['set -e', 'tar -xzf {0} -C / --no-same-owner'.format(q(archive_path))]
+        for f in self.files.values():
+            cmds.append('chown {0}: {1}'.format(
+                q(f.user or default_user), q(f.dest + STAGING_SUFFIX)))
+        cmds.extend(
+            'mv -f {0} {1}'.format(q(f.dest + STAGING_SUFFIX), q(f.dest))
+            for f in self.files.values())
+        cmds.append('rm -f {0}'.format(q(archive_path)))
+        return '; '.join(cmds)
+
+    def upload(self):
+        """Upload all queued files, returning the fingerprints of the uploaded files."""
+        if not self.files:
+            return {}
+        archive_path = '/tmp/appconfig-{0}-{1}.tar.gz'.format(os.getpid(), id(self))
+        put(io.BytesIO(self.archive()), archive_path)
+        sudo(self.script(archive_path, env.user))
+        unbatched = sum(ROUND_TRIPS_PER_FILE + bool(f.mode) for f in self.files.values())
+        self.round_trips[0] += ROUND_TRIPS_PER_BATCH
+        self.round_trips[1] += unbatched
+        if len(self.files) > 1:
+            print('uploaded {0} files in {1} round trips instead of {2}'.format(
+                len(self.files), ROUND_TRIPS_PER_BATCH, unbatched))
+        res, self.files, self.fingerprints = self.fingerprints, collections.OrderedDict(), {}
+        return res
+
+
+def pending():
+    """Return the batch collecting uploads in this process - or None.
+
+    Batches are not inherited by forked processes (e.g. steps run by `dag.Graph`), which upload
+    directly.
+    """
+    if ACTIVE is not None and ACTIVE.pid == os.getpid():
+        return ACTIVE
+
+
+@contextlib.contextmanager
+def batch():
+    """Collect uploads within the context, uploading remaining files on exit."""
+    global ACTIVE
+    previous = ACTIVE
+    ACTIVE = b = Batch()
+    try:
+        yield b
+        b.upload()
+    finally:
+        ACTIVE = previous
+
+
+def put_file(dest, content, mode=None, user=None):
+    """Upload `content` to `dest` now - or with the pending batch."""
+    b = pending()
+    if b is None:
+        b = Batch()
+        b.add(dest, content, mode=mode, user=user)
+        b.upload()
+    else:
+        b.add(dest, content, mode=mode, user=user)
@@ -1,12 +1,28 @@
-from fabtools import system
 from fabtools.deb import (
     update_index,
+    install,
 )
 from fabtools.files import is_file
-from fabtools.require.deb import package
-from fabtools.system import distrib_codename, distrib_release
 from fabtools.utils import run_as_root
 
+from appconfig import facts
+
+
+def require_debs(packages, update=False):
+    """
+    Require deb packages to be installed - like `fabtools.require.deb.packages`, but looking up
+    the installed packages in the host facts (see `appconfig.facts`) rather than asking dpkg
+    about each package.
+
+    :return: list of the packages which were installed.
+    """
+    host = facts.get()
+    missing = [p for p in packages if p not in host.debs]
+    if missing:
+        install(missing, update=update)
+        host.add_debs(missing)
+    return missing
+
 
 def ppa(name, auto_accept=True, keyserver=None, lsb_codename=None):
     """
@@ -25,7 +41,8 @@ def ppa(name, auto_accept=True, keyserver=None, lsb_codename=None):
 
     user, repo = name[4:].split("/", 2)
 
-    release = float(distrib_release())
+    host = facts.get()
+    release = float(host.release)
     if release >= 12.04:
         repo = repo.replace(".", "_")
         auto_accept = "--yes" if auto_accept else ""
@@ -39,14 +56,14 @@ def ppa(name, auto_accept=True, keyserver=None, lsb_codename=None):
     else:
         keyserver = ""
 
-    distrib = distrib_codename()
+    distrib = host.codename
     source = "/etc/apt/sources.list.d/%(user)s-%(repo)s-%(distrib)s.list" % locals()
 
     if not is_file(source):
-        if system.distrib_codename() in ["bionic", "focal"]:
-            package("software-properties-common")
+        if distrib in ["bionic", "focal"]:
+            require_debs(["software-properties-common"])
         else:
-            package("python-software-properties")
+            require_debs(["python-software-properties"])
 
         run_as_root(
             "add-apt-repository %(auto_accept)s %(keyserver)s %(name)s" % locals(), pty=False
@@ -0,0 +1,251 @@
+# validation.py - pluggable checks for the apps config
+
+"""Validation of the apps config.
+
+Checks are registered with the `check` decorator. App checks are called once per app and their
+results are cached by a hash of the app's resolved config section, so after editing `apps.ini`
+only changed sections are revalidated. Config checks (e.g. for uniqueness of values across apps)
+are called once with the whole config. All checks run in a thread pool.
+"""
+import re
+import time
+import hashlib
+import pathlib
+import collections
+import concurrent.futures
+
+from . import helpers
+from . import cache
+
+__all__ = ['check', 'validate', 'CHECKS', 'ERROR', 'WARNING']
+
+ERROR, WARNING = 'error', 'warning'
+
+CHECKS = collections.OrderedDict()
+
+MAX_MEMO = 10000
+
+Check = collections.namedtuple('Check', 'name func scope level cached')
+
+Result = collections.namedtuple('Result', 'check section level message')
+
+
+def check(name=None, scope='app', level=ERROR, cached=True):
+    """Register a check function.
+
+    App checks are called as `func(app)`, config checks as `func(config)`. Both return an
+    iterable of messages; config checks yield `(section, message)` pairs. Checks which inspect
+    anything other than the config (e.g. the local filesystem) must pass `cached=False`.
+    """
+    assert scope in ('app', 'config') and level in (ERROR, WARNING)
+
+    def decorator(func):
+        key = name or func.__name__
+        CHECKS[key] = Check(key, func, scope, level, cached and scope == 'app')
+        return func
+    return decorator
+
+
+def section_hash(app):
+    values = app._asdict() if hasattr(app, '_asdict') else vars(app)
+    return hashlib.sha1(repr(sorted(values.items())).encode('utf8')).hexdigest()
+
+
+class Report(object):
+
+    def __init__(self):
+        self.results = []
+        self.timings = collections.OrderedDict()
+        self.elapsed = 0.0
+
+    @property
+    def errors(self):
+        return [r for r in self.results if r.level == ERROR]
+
+    @property
+    def warnings(self):
+        return [r for r in self.results if r.level == WARNING]
+
+    def _timing(self, name, seconds=0.0, run=0, cached=0):
+        t = self.timings.setdefault(name, [0.0, 0, 0])
+        t[0] += seconds
+        t[1] += run
+        t[2] += cached
+
+
+def _call(chk, arg):
+    start = time.perf_counter()
+    try:
+        if chk.scope == 'app':
+            res = [(arg.name, chk.level, msg) for msg in chk.func(arg)]
+        else:
+            res = [(section, chk.level, msg) for section, msg in chk.func(arg)]
+    except Exception as e:  # A broken check must not hide the results of the others.
+        res = [(getattr(arg, 'name', None), ERROR, 'check %s failed: %r' % (chk.name, e))]
+    return res, time.perf_counter() - start
+
+
+def validate(config, checks=None, use_cache=True, max_workers=None):
+    """Run registered checks on `config`, returning a `Report`.
+
+    :param checks: Names of the checks to run (default: all registered checks).
+    :param use_cache: Reuse results of cacheable app checks for unchanged sections.
+    """
+    start = time.perf_counter()
+    checks = [CHECKS[n] for n in checks] if checks else list(CHECKS.values())
+    use_cache = use_cache and cache.enabled()
+    store = cache.Store('validation', salt=cache.file_hash(__file__))
+    memo = store.load(default={}) if use_cache else {}
+    report, new_memo = Report(), {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = collections.OrderedDict()
+        for chk in checks:
+            report._timing(chk.name)
+            if chk.scope == 'config':
+                futures[pool.submit(_call, chk, config)] = (chk, None)
+                continue
+            for section, app in config.items():
+                key = (chk.name, section, section_hash(app)) if chk.cached else None
+                if key in memo:
+                    new_memo[key] = memo[key]
+                    report.results.extend(Result(chk.name, *r) for r in memo[key])
+                    report._timing(chk.name, cached=1)
+                else:
+                    futures[pool.submit(_call, chk, app)] = (chk, key)
+
+        for future, (chk, key) in futures.items():
+            res, seconds = future.result()
+            report.results.extend(Result(chk.name, *r) for r in res)
+            report._timing(chk.name, seconds=seconds, run=1)
+            if key:
+                new_memo[key] = res
+
+    if use_cache and any(k not in memo for k in new_memo):
+        # Keep results for other configs (e.g. another checkout), unless the store grows large.
+        if len(memo) < MAX_MEMO:
+            memo.update(new_memo)
+            new_memo = memo
+        store.dump(new_memo)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+#
+# Config checks:
+#
+@check(scope='config')
+def name_mismatch(config):
+    for name, app in config.items():
+        if name != app.name:
+            yield name, 'section/name mismatch: %r' % ((name, app.name),)
+
+
+@check(scope='config')
+def duplicate_ports(config):
+    for port in helpers.duplicates([app.port for app in config.values()]):
+        yield None, 'duplicate port(s): %r' % [port]
+
+
+@check(scope='config')
+def blue_green_ports(config):
+    """The green instances of apps in blue/green mode need a port of their own."""
+    ports = {app.port: app.name for app in config.values()}
+    for app in config.values():
+        if app.blue_green:
+            port = app.blue_green_ports[1]
+            if port > 65535:
+                yield app.name, 'green port %s not in range 1024-65535' % port
+            elif port in ports:
+                yield app.name, 'green port %s used by %s' % (port, ports[port])
+            ports[port] = '%s (green)' % app.name
+
+
+@check(scope='config')
+def duplicate_domains(config):
+    for domain in helpers.duplicates([app.domain for app in config.values()]):
+        yield None, 'duplicate domain: %s' % domain
+
+
+@check(scope='config')
+def path_collisions(config):
+    """Apps must not share - or nest - their home or virtualenv directories."""
+    paths = collections.OrderedDict()
+    for app in config.values():
+        for attr in ('home_dir', 'venv_dir'):
+            paths.setdefault(pathlib.PurePosixPath(getattr(app, attr)), []).append(
+                '%s.%s' % (app.name, attr))
+    for path, owners in paths.items():
+        if len(owners) > 1:
+            yield None, 'path %s used by %s' % (path, ', '.join(owners))
+        for parent in path.parents:
+            if parent in paths:
+                yield None, 'path %s (%s) is nested in %s (%s)' % (
+                    path, ', '.join(owners), parent, ', '.join(paths[parent]))
+
+
+#
+# App checks:
+#
+@check()
+def port_range(app):
+    if not 1024 <= app.port <= 65535:
+        yield 'port %s not in range 1024-65535' % app.port
+
+
+DEB_PACKAGE_NAME = re.compile(r'[a-z0-9][a-z0-9+.\-]+$')
+
+
+@check()
+def deb_package_names(app):
+    for attr in sorted(a for a in app._fields if a.startswith('require_deb')):
+        for name in getattr(app, attr):
+            if not DEB_PACKAGE_NAME.match(name):
+                yield 'invalid package name in %s: %r' % (attr, name)
+
+
+@check()
+def pg_collkey_indexes(app):
+    from . import pgindex
+
+    for spec in app.pg_collkey_indexes:
+        if not pgindex.TARGET.match(spec):
+            yield 'invalid collkey index target (table.column[:locale]): %r' % spec
+    if app.pg_collkey_indexes and not app.pg_collkey:
+        yield 'collkey indexes require pg_collkey'
+
+
+@check()
+def pg_trgm_indexes(app):
+    from . import pgindex
+
+    for spec in app.pg_trgm_indexes:
+        if not pgindex.TRGM_TARGET.match(spec):
+            yield 'invalid trigram index target (table.column): %r' % spec
+    if app.pg_trgm_indexes and not app.pg_unaccent:
+        yield 'trigram indexes require pg_unaccent'
+
+
+@check(level=WARNING, cached=False)
+def fabfile_dir(app):
+    if not app.fabfile_dir.exists():
+        yield 'missing fabfile dir: %s' % app.name
+
+
+@check(level=WARNING, cached=False)
+def systemd_dir(app):
+    """Units in apps/<name>/systemd must be directories with a service or timer file."""
+    d = app.fabfile_dir / 'systemd'
+    if d.exists():
+        for unit in sorted(d.iterdir()):
+            if not unit.is_dir():
+                yield 'systemd unit is not a directory: %s' % unit.name
+                continue
+            names = set(p.name for p in unit.iterdir())
+            if not names & {'service', 'timer'}:
+                yield 'systemd unit %s has neither service nor timer' % unit.name
+            if 'timer' in names and 'service' not in names:
+                yield 'systemd unit %s has a timer but no service' % unit.name
+            if names - {'service', 'timer', 'script'}:
+                yield 'systemd unit %s has unknown files: %s' % (
+                    unit.name, ', '.join(sorted(names - {'service', 'timer', 'script'})))
@@ -0,0 +1,165 @@
+# venvsync.py - sync an app virtualenv with the app's requirements.txt
+
+"""Delta sync of a virtualenv with a lock file.
+
+`pip_freeze` writes ``apps/<name>/requirements.txt`` after each deploy. `sync` uses it as a lock
+file: The distributions installed in the remote virtualenv are listed - as JSON, in one round
+trip - and only the difference to the lock file is applied:
+
+- missing distributions and distributions with another version are installed from the
+  wheelhouse (see `appconfig.wheelhouse`), without dependency resolution,
+- editable distributions are reinstalled if their git commit differs from the locked one,
+- direct references (``name @ url``) are reinstalled if the recorded URL of the installed
+  distribution differs from the locked one,
+- distributions not in the lock file are removed.
+
+Finally, the virtualenv is listed again to verify it matches the lock file.
+"""
+import re
+import json
+import shlex
+import collections
+
+from fabric.api import sudo, abort
+
+from . import wheelhouse
+
+__all__ = ['sync', 'read', 'delta']
+
+#: Distributions of the virtualenv itself - never removed.
+TOOLS = {'pip', 'setuptools', 'wheel', 'pkg_resources', 'pkg-resources'}
+
+Requirement = collections.namedtuple('Requirement', 'name line version commit editable url')
+
+# Run with the virtualenv's python: Print the installed distributions as JSON.
+INSTALLED = r"""
+import json, subprocess
+import pkg_resources
+
+def source(dist):
+    if 'site-packages' not in dist.location:
+        return dist.location  # Installed with `setup.py develop`, i.e. an egg-link.
+    if dist.has_metadata('direct_url.json'):
+        url = json.loads(dist.get_metadata('direct_url.json'))
+        if url.get('dir_info', {}).get('editable'):
+            return url['url'].replace('file://', '')
+
+def direct_url(dist):
+    # The direct reference as written by `pip freeze`, e.g. git+https://...@<commit>.
+    if 'site-packages' in dist.location and dist.has_metadata('direct_url.json'):
+        url = json.loads(dist.get_metadata('direct_url.json'))
+        if url.get('dir_info', {}).get('editable'):
+            return None
+        res, fragments = url['url'], []
+        if 'vcs_info' in url:
+            res = '{0}+{1}@{2}'.format(
+                url['vcs_info']['vcs'], res, url['vcs_info']['commit_id'])
+        elif url.get('archive_info', {}).get('hash'):
+            fragments.append(url['archive_info']['hash'])
+        if url.get('subdirectory'):
+            fragments.append('subdirectory=' + url['subdirectory'])
+        return res + ('#' + '&'.join(fragments) if fragments else '')
+
+def commit(d):
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=d, stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        return None
+
+res = {}
+for dist in pkg_resources.working_set:
+    src = source(dist)
+    res[dist.project_name] = {
+        'version': dist.version,
+        'editable': bool(src),
+        'commit': commit(src) if src else None,
+        'url': None if src else direct_url(dist)}
+print(json.dumps(res))
+"""
+
+
+def key(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def read(path):
+    """Read a lock file as written by `pip freeze`, returning a dict mapping keys to `Requirement`.
+    """
+    res = collections.OrderedDict()
+    for line in path.read_text(encoding='utf8').splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('-e '):
+            url, _, egg = line.partition('#egg=')
+            commit = url.rpartition('@')[2] if re.search(r'@[0-9a-f]{7,40}$', url) else None
+            res[key(egg)] = Requirement(egg, line, None, commit, True, None)
+        elif ' @ ' in line:  # A direct reference, e.g. "name @ git+https://...@<commit>".
+            name, _, url = line.partition(' @ ')
+            res[key(name.strip())] = Requirement(name.strip(), line, None, None, False, url.strip())
+        else:
+            name, _, version = line.partition('==')
+            res[key(name)] = Requirement(name.strip(), line, version or None, None, False, None)
+    return res
+
+
+def quote(line):
+    """Quote a lock file line for the pip command line.
+
+    >>> print(quote('a @ git+https://example.org/a.git@1'), quote('-e git+https://x/b.git#egg=b'))
+    'a @ git+https://example.org/a.git@1' -e 'git+https://x/b.git#egg=b'
+    """
+    if line.startswith('-e '):
+        return '-e ' + shlex.quote(line[3:].strip())
+    return shlex.quote(line)
+
+
+def delta(lock, installed):
+    """Return the requirement lines to install and the names of distributions to remove."""
+    installed = {key(name): dist for name, dist in installed.items()}
+    install, remove = [], []
+    for k, req in lock.items():
+        dist = installed.get(k)
+        if k in TOOLS:
+            continue
+        if req.editable:
+            if not (dist and dist['editable'] and req.commit and dist['commit'] == req.commit):
+                install.append(req.line)
+        elif req.url:
+            if not (dist and dist.get('url') == req.url):
+                install.append(req.line)
+        elif not dist or dist['version'] != req.version:
+            install.append(req.line)
+    for name in sorted(installed):
+        if name not in lock and name not in TOOLS:
+            remove.append(name)
+    return install, remove
+
+
+def installed(venv_dir):
+    # sudo, because git refuses to work in the root-owned source dirs of other users.
+    out = sudo(
+        "{0}/bin/python - << 'EOF'{1}EOF".format(venv_dir, INSTALLED), pty=False, quiet=True)
+    return json.loads(out.splitlines()[-1])
+
+
+def sync(venv_dir, lockfile):
+    """Make the virtualenv `venv_dir` match `lockfile`.
+
+    :return: pair of lists of the installed requirements and of the removed distributions.
+    """
+    lock = read(lockfile)
+    install, remove = delta(lock, installed(venv_dir))
+    print('{0}: {1} to install, {2} to remove, {3} up-to-date'.format(
+        venv_dir, len(install), len(remove), len(lock) - len(install)))
+    if remove:
+        sudo('{0}/bin/pip uninstall -q -y {1}'.format(venv_dir, ' '.join(remove)), pty=False)
+    if install:
+        wheelhouse.install(venv_dir, [quote(line) for line in install], no_deps=True)
+    if install or remove:
+        left = delta(lock, installed(venv_dir))
+        if any(left):
+            abort('{0} does not match {1}: {2}'.format(
+                venv_dir, lockfile, ', '.join(left[0] + ['-' + n for n in left[1]])))
+    return install, remove
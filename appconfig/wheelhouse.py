@@ -0,0 +1,139 @@
+# wheelhouse.py - a per-host cache of wheels shared by all app virtualenvs
+
+"""Installation of Python packages from a wheelhouse on the remote host.
+
+All apps on a host share most of their dependencies, but each virtualenv would download - and
+build - them anew. `install` installs requirements from the wheels in `WHEELHOUSE`, building only
+the missing ones. Requirements which can't be cached as wheels of a fixed version - editable and
+VCS requirements like the app packages - are installed from the package index, but still find
+their dependencies in the wheelhouse.
+
+After installation, wheels of all packages in the virtualenv are added to the wheelhouse, so the
+next app deployed to the host finds them. Wheels which no deploy used in `MAX_UNUSED_DAYS` are
+removed. The number of installed packages found in the wheelhouse (hits) and missing from it
+(misses) is printed - and recorded as ``wheelhouse`` event if tracing is enabled.
+"""
+import re
+import time
+import collections
+
+from fabric.api import env, sudo, settings
+
+from . import trace
+
+__all__ = ['install', 'Stats', 'WHEELHOUSE']
+
+WHEELHOUSE = '/var/cache/appconfig/wheelhouse'
+
+MAX_UNUSED_DAYS = 60
+
+Stats = collections.namedtuple('Stats', 'hits misses missing')
+
+# Run with the virtualenv's python as `python - WHEELHOUSE START`: Report the installed
+# distributions found in the wheelhouse before START (hits) and mark their wheels as used.
+SYNC = r"""
+import os, re, sys, json
+import pkg_resources
+
+wheelhouse, start = sys.argv[1], float(sys.argv[2])
+
+def key(name):
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+wheels = {}
+for fname in os.listdir(wheelhouse):
+    if fname.endswith('.whl'):
+        name, version = fname.split('-')[:2]
+        wheels.setdefault((key(name), version), []).append(os.path.join(wheelhouse, fname))
+
+def editable(dist):
+    if 'site-packages' not in dist.location:
+        return True
+    if dist.has_metadata('direct_url.json'):
+        return json.loads(dist.get_metadata('direct_url.json')).get('dir_info', {}).get('editable')
+
+for dist in pkg_resources.working_set:
+    if editable(dist) or key(dist.project_name) in ('pip', 'setuptools', 'wheel', 'pkg_resources'):
+        continue  # Editable installs and the tools of the virtualenv.
+    paths = wheels.get((key(dist.project_name), dist.version))
+    if paths:
+        print('HIT' if min(os.stat(p).st_mtime for p in paths) < start else 'MISS', dist.key)
+        for p in paths:
+            os.utime(p, None)
+    else:
+        print('MISSING %s==%s' % (dist.project_name, dist.version))
+"""
+
+
+def cacheable(requirement):
+    """Editable and VCS requirements are not cached."""
+    return not (requirement.startswith('-e') or '://' in requirement)
+
+
+def script(venv_dir,
+           requirements,
+           wheelhouse=WHEELHOUSE,
+           max_unused_days=MAX_UNUSED_DAYS,
+           no_deps=False):
+    """Return a shell script installing `requirements` into the virtualenv `venv_dir`."""
+    pip, python = '{0}/bin/pip'.format(venv_dir), '{0}/bin/python'.format(venv_dir)
+    reqs = ' '.join(r for r in requirements if cacheable(r))
+    other = ' '.join(r for r in requirements if not cacheable(r))
+    find = '--find-links {0}'.format(wheelhouse)
+    opts = find + (' --no-deps' if no_deps else '')
+    lines = ['set -e', 'start=$(date +%s)', 'mkdir -p {0}'.format(wheelhouse)]
+    if reqs:
+        lines.extend([
+            'if ! {0} install -q --no-index {1} {2} 2> /dev/null; then'.format(pip, opts, reqs),
+            '  {0} wheel -q --wheel-dir {1} {2} {3} && '
+            '{0} install -q --no-index {2} {3} || {0} install -q {2} {3}'.format(
+                pip, wheelhouse, opts, reqs),
+            'fi'])
+    if other:
+        lines.append('{0} install -q {1} {2}'.format(pip, opts, other))
+    lines.extend([
+        "{0} - {1} $start > /tmp/wheelhouse.$$ << 'EOF' || true{2}EOF".format(
+            python, wheelhouse, SYNC),
+        'cat /tmp/wheelhouse.$$',
+        # Add wheels of the packages missing from the wheelhouse - for the next app:
+        'missing=$(sed -n "s/^MISSING //p" /tmp/wheelhouse.$$); rm /tmp/wheelhouse.$$',
+        'if [ -n "$missing" ]; then {0} wheel -q --no-deps --wheel-dir {1} {2} $missing '
+        '|| true; fi'.format(pip, wheelhouse, find),
+        'find {0} -name "*.whl" -mtime +{1} -delete'.format(wheelhouse, max_unused_days),
+    ])
+    return '\n'.join(lines)
+
+
+def parse(output):
+    hits, misses, missing = 0, 0, []
+    for line in output.splitlines():
+        if re.match(r'HIT \S+$', line):
+            hits += 1
+        elif re.match(r'MISS \S+$', line):
+            misses += 1
+        elif re.match(r'MISSING \S+$', line):
+            missing.append(line.split()[1])
+    return Stats(hits, misses + len(missing), missing)
+
+
+def install(venv_dir, requirements, wheelhouse=WHEELHOUSE, no_deps=False):
+    """Install `requirements` into the virtualenv at `venv_dir` - in one round trip.
+
+    :param no_deps: Install the requirements only, e.g. if they are a complete lock file.
+    :return: `Stats` of the wheelhouse usage.
+    """
+    start = time.time()
+    prefix = env.sudo_prefix if '-H' in env.sudo_prefix.split() else env.sudo_prefix + ' -H'
+    with settings(sudo_prefix=prefix):  # set HOME for pip log/cache
+        output = sudo(
+            script(venv_dir, list(requirements), wheelhouse, no_deps=no_deps), pty=False)
+    stats = parse(output)
+    total = stats.hits + stats.misses
+    if total:
+        print('wheelhouse: {0} of {1} packages cached ({2:.0%})'.format(
+            stats.hits, total, stats.hits / total))
+    if trace.enabled():
+        trace.record(
+            'wheelhouse', start, time.time(), venv=str(venv_dir), hits=stats.hits,
+            misses=stats.misses)
+    return stats
@@ -55,7 +55,7 @@ def deploy(app):
     assert system.distrib_id() == "Ubuntu"
     assert env.environment == "production"
 
-    require.deb.packages(app.require_deb + ["libcairo2", "python3-venv"])
+    require.deb.packages(list(app.require_deb) + ["libcairo2", "python3-venv"])
     require.users.user(app.name, create_home=True, shell="/bin/bash")
 
     with shell_env(SYSTEMD_PAGER=''):
@@ -0,0 +1,80 @@
+"""
+Benchmark building and replacing registries of App records.
+
+usage: python benchmarks/app_records.py [--apps 5000]
+
+Compares `appconfig.config.App` with the previous `argparse.Namespace` based implementation
+(reproduced below as `NamespaceApp`) in terms of time and memory (as traced by tracemalloc).
+"""
+import copy
+import time
+import argparse
+import tracemalloc
+
+from appconfig import CONFIG_FILE
+from appconfig.config import ConfigParser, App
+
+
+class NamespaceApp(argparse.Namespace):
+    _fields = App._fields
+
+    def __init__(self, **kwargs):
+        kw = self._fields.copy()
+        for k, f in list(kw.items()):
+            value = kwargs.pop(k)
+            kw[k] = f(value) if f is not None else value
+        super(NamespaceApp, self).__init__(**kw)
+
+    def replace(self, **kwargs):
+        old, new = self.__dict__, self._fields.copy()
+        for k, f in list(new.items()):
+            if k in kwargs:
+                value = f(kwargs.pop(k)) if f is not None else kwargs.pop(k)
+            else:
+                value = copy.copy(old[k])
+            new[k] = value
+        inst = object.__new__(self.__class__)
+        inst.__dict__ = new
+        return inst
+
+
+def raw_sections(n):
+    parser = ConfigParser.from_file(CONFIG_FILE)
+    proto = dict(parser['wals3'])
+    res = []
+    for i in range(n):
+        kw = dict(proto)
+        kw.update(name='app{0}'.format(i), port=str(10000 + i))
+        res.append(kw)
+    return res
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, elapsed, current
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--apps', type=int, default=5000)
+    args = parser.parse_args(args)
+
+    sections = raw_sections(args.apps)
+    print('{0} apps'.format(args.apps))
+    print('{0:<14}{1:>14}{2:>14}{3:>14}{4:>14}'.format(
+        '', 'build [s]', 'build [MB]', 'replace [s]', 'replace [MB]'))
+    for cls in [NamespaceApp, App]:
+        apps, t_build, m_build = measure(lambda: [cls(**kw) for kw in sections])
+        replaced, t_replace, m_replace = measure(lambda: [a.replace(port=6081) for a in apps])
+        print('{0:<14}{1:>14.3f}{2:>14.1f}{3:>14.3f}{4:>14.1f}'.format(
+            cls.__name__, t_build, m_build / 1024 ** 2, t_replace, m_replace / 1024 ** 2))
+        apps = None  # Free the records before measuring the next class.
+
+
+if __name__ == '__main__':
+    main()
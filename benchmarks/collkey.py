@@ -0,0 +1,98 @@
+"""
+Benchmark sorting and indexing by collkey() under several locales.
+
+usage: python benchmarks/collkey.py [--dsn collkey_bench] [--rows 1000000] [--locale de ...]
+                                    [--output before.json] [--baseline before.json]
+
+A table of ROWS synthetic names with diacritics is created in the database DSN, which must have
+the collkey functions installed (see appconfig/pg_collkey-v0.5/collkey_icu.sql). For each locale,
+the names are sorted by collkey(name, locale) and an index on collkey(name, locale) is built;
+a query sorting by the keys of two locales at once measures switching between collators.
+
+To compare two builds of collkey_icu.so, run the benchmark with --output before installing the
+new build and with --baseline after. Sort times are execution times reported by EXPLAIN ANALYZE,
+index build times include the round trip to the server.
+"""
+import json
+import time
+import argparse
+import subprocess
+
+LOCALES = ['root', 'de', 'fr', 'sv']
+
+SETUP = """\
+DROP TABLE IF EXISTS collkey_bench;
+CREATE TABLE collkey_bench AS
+SELECT initcap(translate(
+  substr(md5(i::text), 1, 4 + i % 9), '0123456789', 'äöüéèçñßåø')) AS name
+FROM generate_series(1, {rows}) AS i;
+ANALYZE collkey_bench;
+"""
+
+
+def psql(dsn, sql):
+    return subprocess.run(
+        ['psql', '-X', '-q', '-A', '-t', '-v', 'ON_ERROR_STOP=1', '-d', dsn, '-c', sql],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+
+def sort(dsn, *locales):
+    """Return the execution time of sorting all names and whether the plan is parallel."""
+    order = ', '.join("collkey(name, '{0}')".format(locale) for locale in locales)
+    plan, = json.loads(psql(
+        dsn, 'EXPLAIN (ANALYZE, FORMAT JSON) SELECT name FROM collkey_bench ORDER BY ' + order))
+    return plan['Execution Time'] / 1000, '"Workers Planned"' in json.dumps(plan)
+
+
+def index(dsn, locale):
+    start = time.perf_counter()
+    psql(dsn, "CREATE INDEX collkey_bench_idx ON collkey_bench (collkey(name, '{0}'))".format(
+        locale))
+    elapsed = time.perf_counter() - start
+    psql(dsn, 'DROP INDEX collkey_bench_idx')
+    return elapsed
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dsn', default='collkey_bench', help='database name or connection URI')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument(
+        '--locale', action='append', default=[], help='default: ' + ' '.join(LOCALES))
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file with results to compare with')
+    args = parser.parse_args(args)
+    locales = args.locale or LOCALES
+
+    psql(args.dsn, SETUP.format(rows=args.rows))
+    results, parallel = {}, {}
+    for locale in locales:
+        results['sort:' + locale], parallel['sort:' + locale] = sort(args.dsn, locale)
+        results['index:' + locale] = index(args.dsn, locale)
+    for a, b in zip(locales, locales[1:]):
+        key = 'sort:{0},{1}'.format(a, b)
+        results[key], parallel[key] = sort(args.dsn, a, b)
+    psql(args.dsn, 'DROP TABLE collkey_bench')
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as fp:
+            baseline = json.load(fp)
+    print('{0} rows'.format(args.rows))
+    print('{0:<20}{1:>12}{2:>12}{3:>12}{4:>10}'.format(
+        '', 'seconds', 'baseline', 'speedup', 'parallel'))
+    for key, seconds in results.items():
+        base = baseline.get(key)
+        print('{0:<20}{1:>12.3f}{2:>12}{3:>12}{4:>10}'.format(
+            key,
+            seconds,
+            '{0:.3f}'.format(base) if base else '-',
+            '{0:.2f}x'.format(base / seconds) if base else '-',
+            {True: 'yes', False: 'no'}.get(parallel.get(key), '-')))
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
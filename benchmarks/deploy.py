@@ -0,0 +1,131 @@
+"""
+Run deploy tasks against a simulated host, counting round trips and estimating their duration.
+
+usage: python benchmarks/deploy.py [--app wold2 --app cobl] [--latency 0.05] [--check|--update]
+
+The tasks deploy, stop, start, upgrade, cache and upload_sqldump are run for each app against
+`fakehost.FakeHost` - a provisioned host, answering all questions with their defaults. Deploy
+steps run sequentially (parallel=False), so the estimated time is the sum over all calls.
+deploy_prebuilt is a deploy with prebuilt=True to a host which has the virtualenv artifact.
+
+With --check, the round trip counts are compared with benchmarks/round_trips.json and the
+script exits with status 1 if any count increased; --update rewrites the baseline.
+"""
+import os
+import sys
+import json
+import pathlib
+import argparse
+import tempfile
+import contextlib
+import collections
+
+from fakehost import FakeHost
+
+from appconfig import APPS, fleet, facts, builds
+from appconfig.tasks import deployment, varnish
+
+BASELINE = pathlib.Path(__file__).parent / 'round_trips.json'
+
+TASKS = collections.OrderedDict([
+    ('deploy', lambda app: deployment.deploy.execute_inner(app, parallel=False)),
+    # A host of the app other than the one which built the virtualenv:
+    ('deploy_prebuilt', lambda app: deployment.deploy.execute_inner(
+        app, parallel=False, prebuilt=True)),
+    ('stop', lambda app: deployment.stop.execute_inner(app)),
+    ('start', lambda app: deployment.start.execute_inner(app)),
+    ('upgrade', lambda app: deployment.upgrade.execute_inner(app, waitress='1.4.3')),
+    ('cache', lambda app: varnish.cache.execute_inner(app)),
+    ('upload_sqldump', lambda app: deployment.upload_sqldump(
+        app.replace(dbdump='https://example.org/dump.sql.gz'))),
+])
+
+
+@contextlib.contextmanager
+def sandbox(app, environment):
+    """Keep local side effects - e.g. pip_freeze writing requirements.txt - out of the repos and
+    out of the local cache."""
+    import fabric.api
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        pathlib.Path(tmp).joinpath(app.name).mkdir()
+        os.chdir(tmp)
+        os.environ.setdefault('APPCONFIG_PWD_{0}'.format(app.name.upper()), 'pwd')
+        os.environ.setdefault('APPCONFIG_PWD_ADMIN', 'pwd')
+        cache_dir = os.environ.get('APPCONFIG_CACHE_DIR')
+        os.environ['APPCONFIG_CACHE_DIR'] = str(pathlib.Path(tmp) / 'cache')
+        try:
+            with fabric.api.settings(environment=environment), \
+                    fleet.noninteractive(fleet.Answers()), \
+                    contextlib.redirect_stdout(open(os.devnull, 'w')):
+                deployment.APPS_DIR, apps_dir = pathlib.Path(tmp), deployment.APPS_DIR
+                try:
+                    yield
+                finally:
+                    deployment.APPS_DIR = apps_dir
+        finally:
+            os.chdir(cwd)
+            if cache_dir is None:
+                del os.environ['APPCONFIG_CACHE_DIR']
+            else:
+                os.environ['APPCONFIG_CACHE_DIR'] = cache_dir
+
+
+def measure(app, task, environment='production', **kw):
+    host_facts = kw.setdefault('facts', {})
+    codename = host_facts.get('codename', 'focal')
+    host_facts['debs'] = getattr(app, 'require_deb_' + codename) + app.require_deb
+    host_facts['builds'] = [
+        builds.key('bibutils', [deployment.BIBUTILS_URL], codename=codename),
+        builds.key(
+            'collkey_icu',
+            deployment.PG_COLLKEY_SOURCES,
+            codename=codename,
+            pg_version=host_facts.get('postgres', '12')),
+    ]
+    host = FakeHost(**kw)
+    facts.refresh(all_hosts=True)  # Each measurement starts with a new session.
+    with sandbox(app, environment), host.installed(getattr(app, environment)):
+        TASKS[task](app)
+    return host
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--app', action='append', default=[], help='default: wold2 and cobl')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per round trip')
+    parser.add_argument('--bandwidth', type=float, default=10e6, help='bytes per second')
+    parser.add_argument('--check', action='store_true', default=False)
+    parser.add_argument('--update', action='store_true', default=False)
+    args = parser.parse_args(args)
+
+    baseline = json.loads(BASELINE.read_text(encoding='utf8')) if BASELINE.exists() else {}
+    results, regressions = collections.OrderedDict(), []
+    cols = ['round_trips', 'run', 'sudo', 'put', 'local', 'bytes', 'seconds']
+    print('{0:<24}'.format('app/task') + ''.join('{0:>12}'.format(c) for c in cols))
+    for name in args.app or ['wold2', 'cobl']:
+        app = APPS[name]
+        for task in TASKS:
+            stats = measure(app, task, latency=args.latency, bandwidth=args.bandwidth).stats()
+            key = '{0}/{1}'.format(name, task)
+            results[key] = stats['round_trips']
+            print('{0:<24}'.format(key) + ''.join(
+                '{0:>12.1f}'.format(v) if isinstance(v, float) else '{0:>12}'.format(v)
+                for v in stats.values()))
+            if key in baseline and stats['round_trips'] > baseline[key]:
+                regressions.append('{0}: {1} round trips (baseline {2})'.format(
+                    key, stats['round_trips'], baseline[key]))
+
+    if args.update:
+        BASELINE.write_text(json.dumps(results, indent=2) + '\n', encoding='utf8')
+        print('baseline written to {0}'.format(BASELINE))
+    if args.check:
+        for msg in regressions:
+            print('REGRESSION {0}'.format(msg))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
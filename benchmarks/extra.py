@@ -0,0 +1,43 @@
+"""
+Benchmark parsing the `extra` values of apps/apps.ini with eval and with config.getliteral.
+
+usage: python benchmarks/extra.py [--loads 200]
+
+Each load parses the raw `extra` value of every app section, as Config.from_file does.
+"""
+import time
+import argparse
+
+from appconfig import CONFIG_FILE
+from appconfig.config import ConfigParser, getliteral, _literal
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--loads', type=int, default=200)
+    args = parser.parse_args(args)
+
+    cfg = ConfigParser.from_file(CONFIG_FILE)
+    values = [cfg[s]['extra'] for s in cfg.sections() if not s.startswith('_')]
+
+    def timed(func):
+        start = time.perf_counter()
+        for _ in range(args.loads):
+            for v in values:
+                func(v)
+        return time.perf_counter() - start
+
+    _literal.cache_clear()
+    results = [
+        ('eval', timed(lambda s: eval(s or '{}'))),
+        ('getliteral', timed(getliteral)),
+    ]
+    print('{0} loads of {1} extra values from {2}'.format(args.loads, len(values), CONFIG_FILE))
+    for label, elapsed in results:
+        print('{0:<12}{1:8.3f}s{2:10.1f}µs/value'.format(
+            label, elapsed, elapsed / (args.loads * len(values)) * 1e6))
+    print('cache: {0}'.format(_literal.cache_info()))
+
+
+if __name__ == '__main__':
+    main()
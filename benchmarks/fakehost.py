@@ -0,0 +1,208 @@
+"""
+A simulated remote host for fabric, recording every remote call.
+
+`FakeHost` replaces fabric's command execution (`run`, `sudo` - and thus all of fabtools),
+`put`, `get` and `local` with fakes, which answer from canned responses and account for the
+time a real host would take: a fixed latency per round trip plus a transfer cost per byte.
+Nothing is sent over the network and no time is actually spent waiting.
+"""
+import re
+import sys
+import time
+import contextlib
+import collections
+from unittest import mock
+
+import fabric.api
+import fabric.operations
+from fabric.operations import _AttributeString
+
+__all__ = ['FakeHost', 'Call']
+
+Call = collections.namedtuple('Call', 'kind command bytes round_trips seconds')
+
+#: Remote facts of a provisioned Ubuntu host.
+FACTS = {
+    'codename': 'focal',
+    'release': '20.04',
+    'php': '7.4',
+    'postgres': '12',
+    # Deb packages installed by appconfig itself - the packages apps require are added by
+    # `FakeHost(facts={'debs': ...})`.
+    'debs': [
+        'nginx', 'npm', 'nodejs', 'libicu-dev', 'postgresql-server-dev-12',
+        'software-properties-common', 'python-certbot-nginx'],
+    # Keys of the builds installed on the host (see appconfig.builds).
+    'builds': [],
+}
+
+
+class FakeHost(object):
+
+    def __init__(self, latency=0.05, bandwidth=10e6, provisioned=True, facts=None):
+        """
+        :param latency: Seconds per round trip.
+        :param bandwidth: Bytes per second.
+        :param provisioned: Whether files, packages, users and databases exist on the host.
+        """
+        self.latency, self.bandwidth = latency, bandwidth
+        self.provisioned = provisioned
+        facts = facts or {}
+        self.facts = dict(FACTS, **facts)
+        self.facts['debs'] = FACTS['debs'] + list(facts.get('debs', []))
+        self.calls = []
+        self.slept = 0.0
+        self.rules = [
+            (r'^uname -s', 'Linux'),
+            (r'^lsb_release --id', 'Ubuntu'),
+            (r'^lsb_release --codename', self.facts['codename']),
+            (r'^lsb_release (-r|--release)', self.facts['release']),
+            (r'^ls /etc/php', self.facts['php']),
+            (r'^find /usr/lib/postgresql/', '/usr/lib/postgresql/' + self.facts['postgres']),
+            (r'^curl .*_ping', '{"status": "ok"}'),
+            (r'^probe\(\) \{', self.probe),  # See appconfig.probe
+            (r'^# appconfig facts|^if \[ -e|^printf .clld_dir', self.host_facts),
+            (r'^# appconfig stream_sqldump', self.stream_sqldump),
+            (r'import clld; print', '/usr/venvs/app/lib/python3.8/site-packages/clld/__init__.py'),
+            (r'^pip freeze', 'clld==7.0.0\nwaitress==1.4.3'),
+            (r'^cat .*\.appconfig-state\.json', None),  # No state of previous deploys.
+            (r'^(test -[edfL]|\[ -[edfL])', self.provisioned),
+            (r'^dpkg -s', 'Status: install ok installed' if self.provisioned else None),
+            (r'^getent passwd', self.provisioned),
+            (r'psql -t -A -c "SELECT COUNT', '1' if self.provisioned else '0'),
+            (r'^psql -d \S+ -c ""', self.provisioned),
+        ]
+
+    @staticmethod
+    def probe(command):
+        """All probed apps are ready with the first request."""
+        return '\n'.join(
+            'READY {0} 50 0.050 1 200'.format(name)
+            for name in re.findall(r'^probe (\S+) ', command, flags=re.MULTILINE))
+
+    def stream_sqldump(self, command):
+        """A 10 MB dump is streamed into the database - at the bandwidth of the host."""
+        return 'STREAM 0 10000000 {0} {1}'.format(int(10e6 / self.bandwidth * 1000), '0' * 32)
+
+    def host_facts(self, command):
+        """Answer the script of `appconfig.facts` - of a provisioned host, everything exists."""
+        res = []
+        if command.startswith('# appconfig facts'):
+            res.extend([
+                'distrib_id\tUbuntu',
+                'codename\t' + self.facts['codename'],
+                'release\t' + self.facts['release'],
+                'php\t' + self.facts['php'],
+                'postgres\t' + self.facts['postgres'],
+                'path\t/usr/lib/postgresql/{0}/lib/collkey_icu.so\t{1:d}'.format(
+                    self.facts['postgres'], self.provisioned),
+            ])
+            res.extend('deb\t' + p for p in self.facts['debs'] if self.provisioned)
+            res.extend('build\t' + k for k in self.facts['builds'] if self.provisioned)
+        res.extend('path\t{0}\t{1:d}'.format(p, self.provisioned) for p in re.findall(
+            r'^if \[ -e (\S+) \]', command, flags=re.MULTILINE))
+        res.extend('clld_dir\t{0}\t{1}'.format(
+            v, '/usr/venvs/app/lib/python3.8/site-packages/clld' if self.provisioned else '')
+            for v in re.findall(r"^printf 'clld_dir\S+ (\S+) ", command, flags=re.MULTILINE))
+        return '\n'.join(res)
+
+    def respond(self, command):
+        """Return `(output, return code)` for a remote command."""
+        markers = re.findall(r'echo "(\S+ \d+) \$rc"', command)
+        if markers:  # A script of coalesced commands.
+            return '\n'.join(m + ' 0' for m in markers), 0
+        for pattern, response in self.rules:
+            if re.search(pattern, command):
+                if callable(response):
+                    return response(command), 0
+                if response is True:
+                    return '', 0
+                if response in (False, None):
+                    return '', 1
+                return response, 0
+        return '', 0
+
+    def _account(self, kind, command, nbytes, round_trips=1):
+        seconds = round_trips * self.latency + nbytes / self.bandwidth
+        self.calls.append(Call(kind, command, nbytes, round_trips, seconds))
+
+    def _run_command(self, command, shell=True, pty=True, combine_stderr=True, sudo=False,
+                     user=None, quiet=False, warn_only=False, **kw):
+        out, rc = self.respond(command)
+        self._account('sudo' if sudo else 'run', command, len(command) + len(out))
+        res = _AttributeString(out)
+        res.return_code, res.stderr = rc, _AttributeString('')
+        res.failed = rc not in fabric.api.env.ok_ret_codes
+        res.succeeded = not res.failed
+        res.command = command
+        if res.failed and not (warn_only or quiet or fabric.api.env.warn_only):
+            fabric.api.abort('{0}() received nonzero return code {1} while executing: {2}'.format(
+                'sudo' if sudo else 'run', rc, command))
+        return res
+
+    def put(self, local_path=None, remote_path=None, use_sudo=False, mode=None, **kw):
+        if hasattr(local_path, 'read'):
+            nbytes = len(local_path.getvalue())
+        else:
+            with open(local_path, 'rb') as fp:
+                nbytes = len(fp.read())
+        # SFTP transfer, plus sudo mv and chmod - as fabric's put does.
+        self._account('put', str(remote_path), nbytes, 1 + bool(use_sudo) + bool(mode))
+        return [str(remote_path)]
+
+    def get(self, remote_path, local_path=None, **kw):
+        self._account('get', str(remote_path), 0)
+        if isinstance(local_path, str):  # An empty file, so it can be moved into place.
+            open(local_path, 'wb').close()
+            return [local_path]
+        return []
+
+    def local(self, command, capture=False, shell=None):
+        if 'git ls-remote' in command or 'git rev-parse' in command:
+            out = '0' * 40
+        else:
+            out = ''
+        self.calls.append(Call('local', command, 0, 0, 0.0))
+        res = _AttributeString(out)
+        res.failed, res.succeeded, res.return_code = False, True, 0
+        res.stderr = _AttributeString('')
+        return res
+
+    def sleep(self, seconds):
+        self.slept += seconds
+
+    @contextlib.contextmanager
+    def installed(self, host='fake.example.org'):
+        """Route fabric's remote calls within the context to this fake host."""
+        fakes = {
+            (fabric.operations, 'put'): self.put,
+            (fabric.operations, 'get'): self.get,
+            (fabric.operations, 'local'): self.local,
+        }
+        originals = {id(getattr(mod, name)): fake for (mod, name), fake in fakes.items()}
+        patches = [mock.patch.object(fabric.operations, '_run_command', self._run_command)]
+        for modname, mod in list(sys.modules.items()):
+            if mod is None or not modname.startswith(('appconfig', 'fabric', 'fabtools')):
+                continue
+            for name in ['put', 'get', 'local']:
+                obj = mod.__dict__.get(name)
+                if obj is not None and id(obj) in originals:
+                    patches.append(mock.patch.object(mod, name, originals[id(obj)]))
+        patches.append(mock.patch.object(time, 'sleep', self.sleep))
+        with contextlib.ExitStack() as stack:
+            for p in patches:
+                stack.enter_context(p)
+            stack.enter_context(fabric.api.settings(host_string=host, hosts=[host]))
+            yield self
+
+    def stats(self):
+        counts = collections.Counter(c.kind for c in self.calls)
+        return collections.OrderedDict([
+            ('round_trips', sum(c.round_trips for c in self.calls)),
+            ('run', counts['run']),
+            ('sudo', counts['sudo']),
+            ('put', counts['put']),
+            ('local', counts['local']),
+            ('bytes', sum(c.bytes for c in self.calls)),
+            ('seconds', sum(c.seconds for c in self.calls) + self.slept),
+        ])
@@ -0,0 +1,86 @@
+"""
+Benchmark `appconfig ls` startup with a cold and a warm config snapshot.
+
+usage: python benchmarks/startup.py [--sections 1000] [--repeat 5]
+
+A synthetic apps.ini with the [DEFAULT] section of apps/apps.ini and SECTIONS app sections is
+written to a temporary directory. Each run is a fresh interpreter, so the numbers include
+interpreter startup and imports, i.e. what a user experiences when calling the CLI or `fab`.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import pathlib
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+
+RUN_LS = """\
+import sys, pathlib, warnings
+warnings.simplefilter('ignore')
+import appconfig
+appconfig.CONFIG_FILE = pathlib.Path(sys.argv[1])
+from appconfig.__main__ import main
+main(['ls'])
+"""
+
+
+def synthetic_config(path, sections):
+    text = (REPO / 'apps' / 'apps.ini').read_text(encoding='utf8')
+    default, _, _ = text.partition('\n[_hosts]')
+    lines = [default, '', '[_hosts]']
+    hosts = ['host{0}.example.org'.format(i) for i in range(20)]
+    lines.extend('h{0} = {1}'.format(i, h) for i, h in enumerate(hosts))
+    for i in range(sections):
+        lines.extend([
+            '',
+            '[app{0}]'.format(i),
+            'name = app{0}'.format(i),
+            'port = {0}'.format(10000 + i),
+            'production = ${{_hosts:h{0}}}'.format(i % len(hosts)),
+            'test = ${{_hosts:h{0}}}'.format((i + 1) % len(hosts)),
+            "extra = {{'n': {0}}}".format(i),
+        ])
+    path.write_text('\n'.join(lines) + '\n', encoding='utf8')
+
+
+def timed_run(cfg, env):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-c', RUN_LS, str(cfg)],
+        env=env, check=True, stdout=subprocess.DEVNULL, cwd=str(REPO))
+    return time.perf_counter() - start
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sections', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        cfg = tmp / 'apps.ini'
+        synthetic_config(cfg, args.sections)
+        env = dict(os.environ, APPCONFIG_CACHE_DIR=str(tmp / 'cache'))
+        env.pop('APPCONFIG_NO_CACHE', None)
+
+        cold, warm = [], []
+        for i in range(args.repeat):
+            shutil.rmtree(str(tmp / 'cache'), ignore_errors=True)
+            cold.append(timed_run(cfg, env))
+            warm.append(timed_run(cfg, env))
+        nocache = [
+            timed_run(cfg, dict(env, APPCONFIG_NO_CACHE='1')) for _ in range(args.repeat)]
+
+    print('appconfig ls, {0} sections, median of {1} runs'.format(args.sections, args.repeat))
+    for label, times in [('no cache', nocache), ('cold', cold), ('warm', warm)]:
+        print('{0:<10}{1:8.3f}s'.format(label, statistics.median(times)))
+
+
+if __name__ == '__main__':
+    main()
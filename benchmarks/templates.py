@@ -0,0 +1,52 @@
+"""
+Benchmark rendering config.ini and nginx-app.conf for all apps, with a new Jinja environment
+per file (as fabtools' upload_template does) and with appconfig.templating.
+
+usage: python benchmarks/templates.py [--rounds 5]
+"""
+import time
+import argparse
+
+import jinja2
+
+from appconfig import APPS, templating
+
+TEMPLATES = ['config.ini', 'nginx-app.conf']
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args(args)
+
+    apps = list(APPS.values())
+
+    def context(app):
+        return dict(app=app, env={'environment': 'production'}, workers=app.workers, auth='')
+
+    def fresh(template, app):
+        tdir = templating.template_dir(template, app.name)
+        jinja2.Environment(loader=jinja2.FileSystemLoader(str(tdir)))\
+            .get_template(template).render(**context(app))
+
+    def cached(template, app):
+        templating.render(template, context(app), app_name=app.name)
+
+    def timed(func):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for app in apps:
+                for template in TEMPLATES:
+                    func(template, app)
+        return time.perf_counter() - start
+
+    n = args.rounds * len(apps) * len(TEMPLATES)
+    print('{0} rounds rendering {1} templates for {2} apps'.format(
+        args.rounds, len(TEMPLATES), len(apps)))
+    for label, func in [('fresh', fresh), ('templating', cached)]:
+        elapsed = timed(func)
+        print('{0:<12}{1:8.3f}s{2:10.1f}µs/file'.format(label, elapsed, elapsed / n * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -39,14 +39,14 @@ def renew_certs():
             certs = set(sudo('ls -1 /etc/letsencrypt/live').split())
         else:
             certs = set()
-        apps = set(a.domain for a in APPS.values() if a.production == env['host'])
-        all_apps = {a.domain: a.nginx_site for a in APPS.values()}
+        apps = set(a.domain for a in APPS.by_host(env['host']))
         apps.add(env['host'])
         for cert in certs - apps:
-            if cert in all_apps and exists(all_apps[cert]):
+            app = APPS.by_domain(cert)
+            if app and exists(str(app.nginx_site)):
                 raise ValueError(
                     'Cannot delete certificate {0} as long as nginx config {1} is present!'.format(
-                        cert, all_apps[cert]))
+                        cert, app.nginx_site))
             if confirm("Obsolete certificate {0} - delete?".format(cert), default=False):
                 # Obsolete certificate! The app is no longer deployed on this host.
                 letsencrypt.delete(cert)
@@ -61,8 +61,8 @@ def renew_certs():
 def last_deploy():
     global ACC
     with settings(warn_only=True):
-        for a in APPS.values():
-            if a.production == env.host and exists(str(a.config)):
+        for a in APPS.by_host(env.host):
+            if exists(str(a.config)):
                 res = parse(run('stat -c "%y" {0}'.format(a.config)))
                 ACC.append((a.name, res))
     if env.host == env.hosts[-1]:
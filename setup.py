@@ -12,7 +12,7 @@ setup(
     url='https://github.com/shh-dlce/appconfig',
     packages=find_packages(),
     platforms='any',
-    python_requires='!=3.0.*,!=3.1.*,!=3.2.*,!=3.3.*,!=3.4.*',
+    python_requires='>=3.8',
     include_package_data=True,
     zip_safe=False,
     install_requires=[
@@ -39,8 +39,8 @@ setup(
     classifiers=[
         'Private :: Do Not Upload',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
     ],
     entry_points={
         'console_scripts': [
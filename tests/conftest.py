@@ -7,9 +7,33 @@ try:
 except ImportError:
     import pathlib
 
+import os
+
 import pytest
 
 from appconfig.config import Config
+from appconfig import facts
+
+
+@pytest.fixture(scope='session', autouse=True)
+def cache_dir(tmp_path_factory):
+    # Keep config snapshots written during the tests out of the user's cache dir.
+    d = tmp_path_factory.mktemp('cache')
+    old = os.environ.get('APPCONFIG_CACHE_DIR')
+    os.environ['APPCONFIG_CACHE_DIR'] = str(d)
+    yield d
+    if old is None:
+        del os.environ['APPCONFIG_CACHE_DIR']
+    else:  # pragma: no cover
+        os.environ['APPCONFIG_CACHE_DIR'] = old
+
+
+@pytest.fixture(autouse=True)
+def no_facts():
+    # Facts are cached per host string - and all tests use the same one.
+    facts.refresh(all_hosts=True)
+    yield
+    facts.refresh(all_hosts=True)
 
 
 @pytest.fixture(scope='session')
@@ -32,3 +56,49 @@ def app(config, name='testapp'):
 @pytest.fixture
 def APP(mocker, app):
     yield mocker.patch('appconfig.tasks.APP', app)
+
+
+@pytest.fixture
+def coalesced(mocker):
+    """Mock the remote shell running coalesced commands - all commands succeed."""
+    import re
+
+    def execute(script, **kw):
+        return '\n'.join(m + ' 0' for m in re.findall(r'echo "(\S+ \d+) \$rc"', script))
+
+    return {
+        name: mocker.patch('appconfig.coalesce.' + name, side_effect=execute)
+        for name in ['sudo', 'run']}
+
+
+@pytest.fixture
+def probed(mocker):
+    """Mock the remote shell running readiness probes - all URLs are ready at once."""
+    import re
+
+    def execute(script, **kw):
+        return '\n'.join(
+            'READY {0} 10 0.005 1 200'.format(name)
+            for name in re.findall(r'^probe (\S+) ', script, flags=re.MULTILINE))
+
+    return mocker.patch('appconfig.probe.run', side_effect=execute)
+
+
+@pytest.fixture
+def host_facts(mocker):
+    """Mock the remote shell gathering host facts - an Ubuntu xenial host with Postgres 12."""
+    import re
+
+    def execute(script, **kw):
+        lines = []
+        if script.startswith('# appconfig facts'):
+            lines.extend([
+                'distrib_id\tUbuntu', 'codename\txenial', 'release\t16.04', 'php\t7.0',
+                'postgres\t12', 'deb\tnginx'])
+        lines.extend('path\t{0}\t0'.format(p) for p in re.findall(
+            r'^if \[ -e (\S+) \]', script, flags=re.MULTILINE))
+        lines.extend('clld_dir\t{0}\t'.format(v) for v in re.findall(
+            r"^printf 'clld_dir\S+ (\S+) ", script, flags=re.MULTILINE))
+        return '\n'.join(lines)
+
+    return mocker.patch('appconfig.facts.run', side_effect=execute)
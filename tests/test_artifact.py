@@ -0,0 +1,77 @@
+# test_artifact.py
+
+import tarfile
+import subprocess
+
+import pytest
+
+from appconfig import artifact
+
+
+@pytest.fixture
+def venv_app(app, tmp_path):
+    return app.replace(venv_dir=str(tmp_path / 'venvs' / app.name))
+
+
+def _artifact(tmp_path, content):
+    src = tmp_path / 'src-{0}'.format(content)
+    src.joinpath('bin').mkdir(parents=True)
+    src.joinpath('bin', 'python').write_text(content)
+    res = tmp_path / '{0}.tar.gz'.format(content)
+    with tarfile.open(str(res), 'w:gz') as tar:
+        tar.add(str(src), arcname='.')
+    return res
+
+
+def _install(app, key, tgz):
+    subprocess.check_call(['bash', '-c', artifact.install_script(app, key, artifact=tgz)])
+
+
+def test_install_script(venv_app, tmp_path):
+    venv = tmp_path / 'venvs' / venv_app.name
+    venv.mkdir(parents=True)
+    venv.joinpath('built-in-place').write_text('')
+
+    def listing():
+        return sorted(p.name for p in venv.parent.iterdir())
+
+    _install(venv_app, 'a' * 40, _artifact(tmp_path, 'one'))
+    assert venv.is_symlink() and venv.joinpath('bin', 'python').read_text() == 'one'
+    # The running app may still import from the virtualenv built in place:
+    assert (tmp_path / 'venvs' / (venv_app.name + '.old')).joinpath('built-in-place').exists()
+
+    _install(venv_app, 'b' * 40, _artifact(tmp_path, 'two'))
+    assert venv.joinpath('bin', 'python').read_text() == 'two'
+    assert listing() == ['.{0}-{1}'.format(venv_app.name, c * 16) for c in 'ab'] + [venv_app.name]
+
+    # Only the installed and the previous build are kept:
+    _install(venv_app, 'c' * 40, _artifact(tmp_path, 'three'))
+    assert listing() == ['.{0}-{1}'.format(venv_app.name, c * 16) for c in 'bc'] + [venv_app.name]
+
+    _install(venv_app, 'c' * 40, _artifact(tmp_path, 'four'))  # Already installed.
+    assert venv.joinpath('bin', 'python').read_text() == 'three'
+
+
+def test_fetch(mocker, app, tmp_path, monkeypatch):
+    monkeypatch.setenv('APPCONFIG_CACHE_DIR', str(tmp_path))
+    exists = mocker.patch('appconfig.artifact._exists', return_value=True)
+    put = mocker.patch('appconfig.artifact.put')
+    assert artifact.fetch(app, 'key', hosts=['other'])
+    assert not put.called
+
+    # Not on this host, copied from another one:
+    exists.side_effect = [False, True]
+    get = mocker.patch(
+        'appconfig.artifact.get', side_effect=lambda remote, local: open(local, 'w').close())
+    mocker.patch('appconfig.artifact.sudo')
+    assert artifact.fetch(app, 'key', hosts=['other'])
+    assert get.call_count == 1 and put.call_count == 1
+    assert artifact.local_path(app, 'key').exists()
+
+    # From the local cache:
+    exists.side_effect = None
+    exists.return_value = False
+    assert artifact.fetch(app, 'key', hosts=['other'])
+    assert get.call_count == 1 and put.call_count == 2
+
+    assert not artifact.fetch(app, 'other-key', hosts=['other'])
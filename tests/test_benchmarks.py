@@ -0,0 +1,29 @@
+# test_benchmarks.py - guard against regressions of the number of round trips of deploy tasks
+
+import sys
+import pathlib
+
+import pytest
+
+BENCHMARKS = pathlib.Path(__file__).parent.parent / 'benchmarks'
+
+
+@pytest.fixture
+def deploy_benchmark(mocker):
+    mocker.patch.object(sys, 'path', [str(BENCHMARKS)] + sys.path)
+    import deploy
+    yield deploy
+    for name in ['deploy', 'fakehost']:
+        sys.modules.pop(name, None)
+
+
+def test_round_trips(deploy_benchmark, capsys):
+    assert deploy_benchmark.main(['--check']) == 0, capsys.readouterr()[0]
+
+
+def test_fakehost(deploy_benchmark, config):
+    host = deploy_benchmark.measure(config['testapp'], 'stop', latency=1, bandwidth=1e3)
+    stats = host.stats()
+    assert stats['put'] == 2 and stats['seconds'] > stats['round_trips']
+    assert host.respond('lsb_release --codename --short') == ('focal', 0)
+    assert host.respond('dpkg -s nginx')[1] == 0
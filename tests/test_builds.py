@@ -0,0 +1,71 @@
+# test_builds.py
+
+import tarfile
+import subprocess
+
+import pytest
+
+from appconfig import builds
+
+
+def test_key(tmp_path):
+    src = tmp_path / 'src.c'
+    src.write_text('int i;')
+    key = builds.key('name', [src, 'url'], codename='focal', pg_version='12')
+    assert key.startswith('name-') and len(key) == 21
+    assert key == builds.key('name', [src, 'url'], pg_version='12', codename='focal')
+    assert key != builds.key('name', [src, 'url'], codename='bionic', pg_version='12')
+
+    src.write_text('int j;')
+    assert key != builds.key('name', [src, 'url'], codename='focal', pg_version='12')
+
+
+def test_pack_script(mocker, tmp_path):
+    mocker.patch('appconfig.builds.BUILD_DIR', tmp_path / 'builds')
+    mocker.patch('appconfig.builds.stage_dir', return_value=tmp_path / 'stage')
+    tmp_path.joinpath('stage', 'usr', 'lib').mkdir(parents=True)
+    tmp_path.joinpath('stage', 'usr', 'lib', 'x.so').write_text('')
+    subprocess.check_call(['bash', '-c', builds.pack_script('x-0123')])
+
+    with tarfile.open(str(tmp_path / 'builds' / 'x-0123.tar.gz')) as tar:
+        assert tar.getnames() == ['./usr/lib/x.so']
+    assert not tmp_path.joinpath('stage').exists()
+
+
+@pytest.fixture
+def remote(mocker, host_facts, tmp_path, monkeypatch):
+    monkeypatch.setenv('APPCONFIG_CACHE_DIR', str(tmp_path))
+    monkeypatch.delenv('APPCONFIG_BUILD_HOST', raising=False)
+    mocker.patch('appconfig.builds.util')
+    mocker.patch('appconfig.builds.is_file', return_value=False)
+    return mocker.Mock(
+        sudo=mocker.patch('appconfig.builds.sudo'),
+        put=mocker.patch('appconfig.builds.put'),
+        get=mocker.patch(
+            'appconfig.builds.get', side_effect=lambda remote, local: open(local, 'w').close()))
+
+
+def test_require(mocker, remote, monkeypatch):
+    build = mocker.Mock()
+
+    # Neither installed nor cached: Built with the toolchain, and kept in the local cache.
+    key = builds.require('b', build, toolchain=['gcc'], codename='focal')
+    build.assert_called_once_with(builds.stage_dir(key))
+    builds.util.require_debs.assert_called_once_with(['gcc'])
+    assert builds.local_path(key).exists() and not remote.put.called
+
+    # Installed:
+    assert builds.require('b', build, toolchain=['gcc'], codename='focal') == key
+    assert build.call_count == 1 and remote.sudo.call_count == 2
+
+    # Cached locally, but not installed on another host:
+    builds.facts.refresh(all_hosts=True)
+    builds.require('b', build, toolchain=['gcc'], codename='focal')
+    assert build.call_count == 1 and builds.util.require_debs.call_count == 1
+    assert remote.put.call_args[0][1] == '/tmp/{0}.tar.gz'.format(key)
+
+    # Built and shared with the build host:
+    monkeypatch.setenv('APPCONFIG_BUILD_HOST', 'build.example.org')
+    key = builds.require('b', build, codename='bionic')
+    assert build.call_count == 2 and builds.is_file.call_count == 1
+    assert remote.put.call_args[0][1] == str(builds.remote_path(key))
@@ -0,0 +1,59 @@
+import os
+import warnings
+
+import pytest
+
+from appconfig import cache
+from appconfig.config import Config
+
+
+def test_Snapshot(tmp_path):
+    src = tmp_path / 'src.txt'
+    src.write_text('a')
+    snapshot = cache.Snapshot(src, salt='1', directory=tmp_path / 'cache')
+    assert snapshot.load() is None
+    assert snapshot.dump({'a': 1})
+    assert snapshot.load() == {'a': 1}
+
+    # Touching the source does not invalidate the snapshot:
+    st = src.stat()
+    os.utime(str(src), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert snapshot.load() == {'a': 1}
+
+    # But changing its content does:
+    src.write_text('b')
+    assert snapshot.load() is None
+
+    snapshot.dump({'b': 1})
+    assert cache.Snapshot(src, salt='2', directory=tmp_path / 'cache').load() is None
+    snapshot.clear()
+    assert snapshot.load() is None
+
+
+def test_Config_from_file_cache(testdir, tmp_path, mocker):
+    cfg = tmp_path / 'apps.ini'
+    cfg.write_text(testdir.joinpath('apps.ini').read_text(encoding='utf8'), encoding='utf8')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        cold = Config.from_file(cfg, cache=True)
+    from_file = mocker.spy(Config, 'from_file')
+    # Checks of the filesystem run again:
+    with pytest.warns(UserWarning, match='missing fabfile dir: testapp'):
+        warm = Config.from_file(cfg, cache=True)
+    assert from_file.call_count == 1  # i.e. no recursive call to parse the file.
+    assert warm == cold and warm is not cold
+    assert warm.hostnames == cold.hostnames
+    assert warm.defaults['error_email'] == cold.defaults['error_email']
+
+    cfg.write_text(cfg.read_text(encoding='utf8').replace('9998', '9997'), encoding='utf8')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert Config.from_file(cfg, cache=True)['testapppublic'].port == 9997
+
+
+def test_lazy_APPS():
+    import appconfig
+
+    assert appconfig.APPS['wals3'].name == 'wals3'
+    assert 'APPS' in vars(appconfig)
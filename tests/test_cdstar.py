@@ -7,10 +7,14 @@ def test_NamedBitstream(mocker):
 
     class Bitstream(object):
         id = 'y'
+        _properties = {'checksum': 'ABC', 'checksum-algorithm': 'MD5'}
 
     nbs = cdstar.NamedBitstream('x', Bitstream())
     assert 'example.org' in nbs.url
     assert nbs.name == 'y'
+    assert nbs.checksum == ('md5', 'abc')
+    Bitstream._properties = {}
+    assert nbs.checksum is None
 
 
 def test_add_bitstream(mocker, testdir):
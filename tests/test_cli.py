@@ -25,3 +25,52 @@ def test_error(mocker):
         'appconfig.commands.test_error.urlopen',
         mocker.Mock(side_effect=HTTPError('', 500, '', {}, None)))
     main(['test_error', 'wals3'])
+
+
+def test_validate(capsys):
+    assert main(['validate', '--no-cache']) == 0
+    out, err = capsys.readouterr()
+    assert 'port_range' in out
+
+    assert main(['validate', 'port_range']) == 0
+    out, err = capsys.readouterr()
+    assert 'duplicate_ports' not in out
+
+
+def test_validate_invalid(capsys, testdir, tmp_path):
+    cfg = tmp_path / 'apps.ini'
+    cfg.write_text(
+        testdir.joinpath('apps.ini').read_text(encoding='utf8').replace('9998', '9999'),
+        encoding='utf8')
+    assert main(['validate', '--no-cache', '--config', str(cfg)]) == 1
+    out, err = capsys.readouterr()
+    assert 'ERROR: [-] duplicate_ports' in out
+
+
+def test_diff(capsys):
+    main(['diff', 'HEAD', 'HEAD'])
+    out, err = capsys.readouterr()
+    assert 'no changes' in out
+
+
+def test_deploy(mocker, capsys, tmp_path):
+    from appconfig import fleet
+
+    deploy = mocker.patch(
+        'appconfig.commands.deploy.fleet.deploy',
+        return_value=[fleet.Result('wals3', 'h', True, 1.0, '')])
+    assert main(['deploy', 'production', '--apps', 'wals3', '--answer', 'Recreate database=n']) == 0
+    assert [a.name for a in deploy.call_args[0][0]] == ['wals3']
+    assert deploy.call_args[1]['answers'].confirm('Recreate database?') is False
+    out, _ = capsys.readouterr()
+    assert 'wals3' in out
+
+    assert deploy.call_args[1]['force'] is False
+
+    main(['deploy', 'production', '--stack', 'django', '--force'])
+    assert [a.name for a in deploy.call_args[0][0]] == ['cobl']
+    assert deploy.call_args[1]['force'] is True
+    assert deploy.call_args[1]['sync'] is False and deploy.call_args[1]['prebuilt'] is False
+
+    main(['deploy', 'production', '--apps', 'wals3', '--trace', str(tmp_path / 'trace.json')])
+    assert tmp_path.joinpath('trace.json').exists()
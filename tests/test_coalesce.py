@@ -0,0 +1,58 @@
+# test_coalesce.py
+
+import subprocess
+
+import pytest
+from fabric.api import cd, settings
+
+from appconfig import coalesce
+
+
+@pytest.fixture
+def shell(mocker):
+    # Run the generated script in a local shell.
+    def execute(script, **kw):
+        return subprocess.run(
+            ['bash', '-c', script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True).stdout
+
+    return mocker.patch('appconfig.coalesce.run', side_effect=execute)
+
+
+def test_commands(shell, tmp_path):
+    with coalesce.commands() as batch:
+        a = batch.run('echo a; echo b >&2')
+        b = batch.run('false', warn_only=True)
+        with cd(str(tmp_path)):
+            c = batch.run('pwd')
+        with pytest.raises(RuntimeError):
+            assert a.failed
+    assert shell.call_count == 1
+    assert (a.stdout, a.return_code, a.succeeded) == ('a\nb', 0, True)
+    assert (b.stdout, b.return_code, b.failed) == ('', 1, True)
+    assert c.stdout == str(tmp_path)
+
+
+def test_commands_abort(shell):
+    with pytest.raises(SystemExit):
+        with coalesce.commands() as batch:
+            batch.run('exit 3')
+            ok = batch.run('echo ok')
+    assert ok.stdout == 'ok'
+
+    with settings(warn_only=True):
+        with coalesce.commands() as batch:
+            res = batch.run('exit 3')
+    assert res.return_code == 3
+
+
+def test_Batch_sudo(coalesced):
+    batch = coalesce.Batch()
+    batch.flush()
+    batch.sudo('psql -c "select 1"', user='postgres')
+    res = batch.sudo('systemctl daemon-reload')
+    assert "sudo -u postgres -H sh -c 'psql -c \"select 1\"'" in batch.script('m')
+    batch.flush()
+    assert res.succeeded
+    assert coalesced['sudo'].call_count == 1 and not coalesced['run'].called
+    assert batch.round_trips == 1 and len(batch) == 0
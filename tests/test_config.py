@@ -1,6 +1,7 @@
 # test_config.py
 
 import pytest
+import pickle
 import argparse
 
 from appconfig import config
@@ -10,6 +11,9 @@ def test_config_validate():
     with pytest.raises(ValueError, match='name mismatch'):
         config.Config({'spam': argparse.Namespace(name='eggs')}).validate()
 
+    with pytest.raises(ValueError, match=r'\[spam\] section/name mismatch'):
+        config.Config({'spam': argparse.Namespace(name='eggs', port=1)}).validate()
+
     with pytest.raises(ValueError, match='duplicate port'):
         config.Config({
             'spam': argparse.Namespace(name='spam', port=42),
@@ -31,7 +35,7 @@ def test_app():
     assert app.name == app.test == app.production == '1'
     assert app.port == app.workers == app.deploy_duration == 1
     assert app.with_blog == app.pg_collkey == app.pg_unaccent == True
-    assert app.require_deb == app.require_pip == ['1']
+    assert app.require_deb == app.require_pip == ('1',)
     assert app.home_dir / 'spam' == app.www_dir / 'spam' == app.venv_dir / 'spam'
 
     with pytest.raises(ValueError, match='missing'):
@@ -46,9 +50,75 @@ def test_app_fixture(app):
 
 
 def test_app_replace(app):
-    assert app.replace().__dict__ == app.__dict__
-    assert app.replace(require_deb='spam eggs').require_deb == ['spam', 'eggs']
-    assert app.replace().require_deb is not app.require_deb
+    assert app.replace() == app
+    assert app.replace(require_deb='spam eggs').require_deb == ('spam', 'eggs')
+    assert app.replace(port='1').port == 1
+    # Unchanged values are shared:
+    assert app.replace(port='1').require_deb is app.require_deb
+    assert app.replace(port='1') != app
 
     with pytest.raises(ValueError, match='unknown'):
         app.replace(nonfield='')
+
+
+def test_app_blue_green_ports(app):
+    assert app.blue_green is False
+    assert app.blue_green_ports == (app.port, app.port + config.BLUE_GREEN_PORT_OFFSET)
+
+
+def test_app_immutable(app):
+    with pytest.raises(AttributeError):
+        app.port = 1
+    with pytest.raises(AttributeError):
+        del app.port
+    with pytest.raises(AttributeError):
+        app.nonfield = 1
+    assert pickle.loads(pickle.dumps(app)) == app
+    assert app._asdict()['name'] == app.name
+    assert repr(app).startswith('App(name=')
+
+
+def test_config_index(config):
+    assert config.production_hosts == {'vbox'}
+    assert [a.name for a in config.by_host('vbox')] == ['testapp', 'testapppublic']
+    assert [a.name for a in config.by_host('vbox', environment='test')] == ['testapp']
+    assert config.by_host('spam.eggs') == ()
+    assert config.by_port('9999').name == 'testapp'
+    assert config.by_domain('testapppublic.test.clld.org').name == 'testapppublic'
+    assert len(config.by_stack('clld')) == 2
+
+
+def test_config_index_mutations(config):
+    cfg = type(config)(config)
+    assert cfg.by_port(9998)
+    cfg['other'] = cfg['testapppublic'].replace(name='other', port='1', production='spam.eggs')
+    assert cfg.by_port(1).name == 'other'
+    assert 'spam.eggs' in cfg.production_hosts
+    del cfg['other']
+    assert cfg.by_port(1) is None
+    cfg.pop('testapppublic')
+    assert cfg.by_port(9998) is None
+    cfg.update(testapppublic=config['testapppublic'])
+    assert cfg.by_port(9998)
+    cfg.clear()
+    assert not cfg.production_hosts
+
+
+@pytest.mark.parametrize('value', ['__import__("os")', '{1, 2}', 'None', '{', "{**{'a': 1}}"])
+def test_getliteral_invalid(value):
+    with pytest.raises(ValueError):
+        config.getliteral(value)
+
+
+def test_getliteral_copies():
+    assert config.getliteral("{'a': []}") is not config.getliteral("{'a': []}")
+
+
+def test_config_invalid_value(testdir, tmp_path):
+    cfg = tmp_path / 'apps.ini'
+    cfg.write_text(
+        testdir.joinpath('apps.ini').read_text(encoding='utf8').replace(
+            "extra = {'key': 5}", "extra = open('/etc/passwd')"),
+        encoding='utf8')
+    with pytest.raises(ValueError, match=r"\[testapp\] invalid value for 'extra'"):
+        config.Config.from_file(cfg)
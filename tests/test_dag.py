@@ -0,0 +1,79 @@
+import time
+import functools
+
+import pytest
+
+from appconfig import dag
+
+
+def _sleep(seconds, value=None):
+    time.sleep(seconds)
+    return value
+
+
+def _fail():
+    raise ValueError('spam')
+
+
+def test_Graph_validation():
+    with pytest.raises(ValueError, match='no producer'):
+        dag.Graph([dag.Step('a', None, inputs=['x'])])
+    with pytest.raises(ValueError, match='cycle'):
+        dag.Graph([dag.Step('a', None, inputs=['b']), dag.Step('b', None, inputs=['a'])])
+
+
+@pytest.mark.skipif(not dag.fork_available(), reason='requires fork')
+def test_Graph_run_concurrent(capsys):
+    p = functools.partial
+    graph = dag.Graph([
+        dag.Step('a', p(_sleep, 0.3, 'A')),
+        dag.Step('b', p(_sleep, 0.2, 'B')),
+        dag.Step('c', p(_sleep, 0.1), inputs=['a'], local=True),
+        dag.Step('d', p(_sleep, 0.1), inputs=['b', 'c']),
+    ])
+    start = time.time()
+    res = graph.run()
+    assert time.time() - start < 0.7  # a and b ran concurrently.
+    assert res['a'] == 'A' and res['b'] == 'B'
+    assert [s.name for s in graph.critical_path()][1:] == ['c', 'd']
+    graph.report()
+    assert 'critical path' in capsys.readouterr()[0]
+
+
+@pytest.mark.skipif(not dag.fork_available(), reason='requires fork')
+def test_Graph_run_resources():
+    p = functools.partial
+    graph = dag.Graph([
+        dag.Step('a', p(_sleep, 0.2), resources=['apt']),
+        dag.Step('b', p(_sleep, 0.2), resources=['apt']),
+    ])
+    graph.run()
+    a, b = sorted(graph.steps.values(), key=lambda s: s.start)
+    assert b.start >= a.end
+
+
+@pytest.mark.skipif(not dag.fork_available(), reason='requires fork')
+def test_Graph_run_failure():
+    graph = dag.Graph([
+        dag.Step('a', _fail),
+        dag.Step('b', functools.partial(_sleep, 0.1), inputs=['a']),
+    ])
+    with pytest.raises(dag.StepFailed, match='step a failed: ValueError: spam'):
+        graph.run()
+    assert graph.steps['b'].start is None
+
+    with pytest.raises(ValueError):
+        dag.Graph([dag.Step('a', _fail, local=True)]).run()
+
+
+def test_Graph_run_serial():
+    calls = []
+    graph = dag.Graph([
+        dag.Step('b', functools.partial(calls.append, 'b'), inputs=['a']),
+        dag.Step('a', functools.partial(calls.append, 'a')),
+    ])
+    graph.run(concurrent=False)
+    assert calls == ['a', 'b']
+
+    with pytest.raises(ValueError):
+        dag.Graph([dag.Step('a', _fail)]).run(concurrent=False)
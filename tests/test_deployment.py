@@ -1,33 +1,42 @@
 # test_deployment.py
 
+import os
+import gzip
+import hashlib
 import argparse
+import pathlib
+import subprocess
 
 import pytest
+from fabric.operations import _AttributeString
 
 from appconfig import tasks
+from appconfig import facts
 
 pytestmark = pytest.mark.usefixtures('APP')
 
 
 def test_deploy_distrib(mocker):
-    di = mocker.patch('appconfig.tasks.deployment.system.distrib_id')
-    di.return_value = 'nondistribution'
+    run = mocker.patch('appconfig.facts.run', return_value='distrib_id\tnondistribution')
     with pytest.raises(AssertionError):
         tasks.deploy('production')
 
-    di.return_value = 'Ubuntu'
-    mocker.patch('appconfig.tasks.deployment.system.distrib_codename',
-                 return_value='noncodename')
+    facts.refresh(all_hosts=True)
+    run.return_value = 'distrib_id\tUbuntu\ncodename\tnoncodename'
     with pytest.raises(ValueError, match='unsupported platform'):
         tasks.deploy('production')
 
 
 @pytest.fixture()
-def mocked_deployment(mocker):
+def mocked_deployment(mocker, coalesced, probed, host_facts):
     getpwd = mocker.Mock(return_value='password')
     mocker.patch('appconfig.tasks.helpers.getpwd', getpwd)
+    mocker.patch.multiple(
+        'appconfig.tasks.state', sudo=mocker.DEFAULT, require=mocker.DEFAULT, local=mocker.DEFAULT)
+    mocker.patch.multiple('appconfig.upload', sudo=mocker.DEFAULT, put=mocker.DEFAULT)
+    mocker.patch('appconfig.upload.put_file')  # Relative paths don't work with the mocked cd.
+    mocker.patch('appconfig.wheelhouse.sudo', return_value='HIT lxml\nMISSING clld==7.0')
     mocked = mocker.patch.multiple('appconfig.tasks.deployment',
-        time=mocker.Mock(),
         pathlib=mocker.DEFAULT,
         prompt=mocker.Mock(return_value='app'),
         sudo=mocker.Mock(return_value='/usr/venvs/__init__.py'),
@@ -45,8 +54,8 @@ def mocked_deployment(mocker):
         service=mocker.Mock(),
         supervisor=mocker.Mock(),
         letsencrypt=mocker.Mock(),
-        system=mocker.Mock(**{'distrib_id.return_value': 'Ubuntu',
-                              'distrib_codename.return_value': 'xenial'}),
+        util=mocker.Mock(),
+        builds=mocker.Mock(),
     )
     return argparse.Namespace(getpwd=getpwd, **mocked)
 
@@ -74,3 +83,142 @@ def test_deploy(mocker, config, mocked_deployment):
         tasks.deploy('production', with_alembic=True)
         tasks.deploy('test')
         tasks.deploy('test', with_alembic=True)
+
+
+def test_deploy_outdated_clone(mocker, config, mocked_deployment):
+    mocker.patch('appconfig.tasks.APP', config['testapp'])
+    tasks.deployment.local.side_effect = ['remote', 'local']
+    tasks.deployment.confirm.return_value = False
+
+    with pytest.raises(SystemExit):
+        tasks.deploy('production')
+
+
+def test_collkey_build_uploads_makefile(mocker, app, mocked_deployment, coalesced):
+    # Remote state claiming everything is unchanged must not skip temporary build inputs:
+    mocker.patch('appconfig.tasks.state.ACTIVE', mocker.Mock(unchanged=lambda *a: True))
+    with tasks.deployment.coalesce.commands() as batch:
+        tasks.deployment.require_extensions(app, batch)
+    build = tasks.deployment.builds.require.call_args[0][1]
+
+    put = mocker.patch('appconfig.upload.put')
+    build('/tmp/stage')
+    assert put.called
+    assert any('/tmp/Makefile' in c[0][0] for c in tasks.deployment.upload.sudo.call_args_list)
+
+
+def test_postgres_fingerprint(app):
+    fp = tasks.deployment.postgres_fingerprint
+    assert fp(app) == fp(app.replace())
+    assert fp(app) != fp(app.replace(pg_collkey_indexes='language.name'))
+    assert fp(app) != fp(app.replace(pg_trgm_indexes='language.name'))
+
+
+@pytest.mark.parametrize('task', ['cache', 'uncache'])
+def test_cache_blue_green(mocker, config, task):
+    from appconfig.tasks import varnish
+
+    upload = mocker.patch('appconfig.tasks.varnish.deployment.sudo_upload_template')
+    update_nginx = mocker.patch('appconfig.tasks.varnish._update_nginx')
+    with pytest.raises(SystemExit):
+        getattr(varnish, task).execute_inner(config['testapp'].replace(blue_green='true'))
+    assert not (upload.called or update_nginx.called)
+
+
+@pytest.mark.parametrize('live,new', [('', 'green'), ('green', 'blue')])
+def test_start_blue_green(mocker, config, mocked_deployment, probed, live, new):
+    app = config['testapp'].replace(blue_green='true')
+    if live:
+        live = 'server 127.0.0.1:%s;' % app.blue_green_ports[1]
+    mocker.patch('appconfig.tasks.APP', app)
+
+    def run(cmd, **kw):
+        assert cmd.startswith('cat')
+        res = _AttributeString(live)
+        res.succeeded = bool(res)
+        return res
+
+    mocker.patch('appconfig.tasks.deployment.run', run)
+    mocker.patch('appconfig.tasks.deployment.pathlib', pathlib)
+    supervisor = mocker.patch('appconfig.tasks.deployment.supervisor')
+    service = mocker.patch('appconfig.tasks.deployment.service')
+    put_file = mocker.patch('appconfig.upload.put_file')
+
+    tasks.start('production')
+
+    uploads = [(c[0][0], c[0][1]) for c in put_file.call_args_list]
+    supervisor_conf, upstream_conf, old_conf = [u[0] for u in uploads]
+    assert ('green' in supervisor_conf) == (new == 'green')
+    assert upstream_conf == '/etc/nginx/conf.d/testapp-upstream.conf'
+    assert 'server 127.0.0.1:%s;' % app.blue_green_ports[tasks.deployment.COLORS.index(new)] \
+        in uploads[1][1]
+    assert 'autostart = false' in uploads[2][1] and old_conf != supervisor_conf
+    # The new instance is started and checked before nginx is switched over:
+    supervisor.restart_process.assert_called_once_with(
+        'testapp-green' if new == 'green' else 'testapp')
+    assert service.reload.call_count == 1
+    assert 'localhost:%s/_ping' % app.blue_green_ports[tasks.deployment.COLORS.index(new)] \
+        in probed.call_args_list[0][0][0]
+
+
+def test_stream_sqldump_script(tmp_path):
+    sql = b'CREATE TABLE t (i int);\n' * 1000
+    dump = tmp_path / 'dump.sql.gz'
+    dump.write_bytes(gzip.compress(sql))
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for name, script in [('curl', 'cat {0}; exit $CURL_RC'.format(dump)), ('psql', 'cat > $OUT')]:
+        bin_dir.joinpath(name).write_text('#!/bin/bash\n' + script + '\n')
+        bin_dir.joinpath(name).chmod(0o755)
+    script = tasks.deployment.STREAM_SQLDUMP.format(
+        algorithm='sha1', auth='-u"u:p" ', url='https://example.org/dump', db='app')
+
+    def stream(curl_rc):
+        env = dict(os.environ, OUT=str(tmp_path / 'out'), CURL_RC=str(curl_rc))
+        env['PATH'] = '{0}{1}{2}'.format(bin_dir, os.pathsep, env['PATH'])
+        return subprocess.check_output(
+            ['bash', '-c', script], env=env, universal_newlines=True).split()
+
+    _, rc, size, _, digest = stream(0)
+    assert rc == '0' and int(size) == dump.stat().st_size
+    assert digest == hashlib.sha1(dump.read_bytes()).hexdigest()
+    assert tmp_path.joinpath('out').read_bytes() == sql
+
+    assert stream(22)[1] == '22'
+
+
+@pytest.mark.parametrize('stream,download,result', [
+    ('STREAM 0 2048 100 abc', None, 'streamed'),
+    ('STREAM 0 2048 100 bad', None, 'aborted'),  # Checksum mismatch.
+    ('STREAM 22 0 100 d41d8cd98f00b204e9800998ecf8427e', 'abc', 'downloaded'),
+    ('', 'abc', 'downloaded'),
+    ('', 'bad', 'aborted'),  # The downloaded file doesn't match the checksum either.
+])
+def test_upload_sqldump(mocker, config, mocked_deployment, capsys, stream, download, result):
+    latest = mocker.Mock(url='https://cdstar.example.org/dump', checksum=('md5', 'abc'))
+    latest.name = 'dump.sql.gz'
+    mocker.patch('appconfig.tasks.deployment.cdstar.get_latest_bitstream', return_value=latest)
+    mocker.patch.dict(os.environ, {'CDSTAR_USER_BACKUP': 'u', 'CDSTAR_PWD_BACKUP': 'p'})
+    mocker.patch('appconfig.tasks.deployment.pathlib', pathlib)
+    sudo, run = tasks.deployment.sudo, tasks.deployment.run
+    sudo.side_effect = lambda cmd, **kw: stream if 'stream_sqldump' in cmd else ''
+    run.side_effect = lambda cmd, **kw: '{0}  /tmp/dump.sql.gz'.format(download)
+
+    if result == 'aborted':
+        with pytest.raises(SystemExit):
+            tasks.deployment.upload_sqldump(config['testapp'].replace(dbdump='oid'))
+    else:
+        tasks.deployment.upload_sqldump(config['testapp'].replace(dbdump='oid'))
+
+    commands = [c[0][0] for c in sudo.call_args_list]
+    assert 'curl -sSf -u"u:p" https://cdstar.example.org/dump' in commands[1]
+    assert run.called == bool(download)
+    if download:
+        assert 'md5sum /tmp/dump.sql.gz' in [c[0][0] for c in run.call_args_list]
+    loaded = any(c.startswith('gunzip -c /tmp/dump.sql.gz') for c in commands)
+    assert loaded == (result == 'downloaded')
+    assert any(c.startswith('vacuumdb') for c in commands) == (result != 'aborted')
+    # Before the fallback - and after streaming a corrupt dump - the database is dropped again:
+    dropped_again = loaded or (result == 'aborted' and not download)
+    assert sum(c.startswith('dropdb') for c in commands) == (2 if dropped_again else 1)
+    assert ('streamed 2.0KB' in capsys.readouterr()[0]) == (result == 'streamed')
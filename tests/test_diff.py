@@ -0,0 +1,42 @@
+import pytest
+
+from appconfig import diff
+from appconfig.config import Config
+
+
+@pytest.fixture
+def changed(config):
+    res = Config(config)
+    res['testapp'] = res['testapp'].replace(workers='5', require_pip='psycopg2')
+    res['testapppublic'] = res['testapppublic'].replace(production='spam.eggs')
+    res['new'] = res['testapp'].replace(name='new', port='1234')
+    return res
+
+
+def test_template_fields():
+    res = diff.template_fields()
+    assert res['gunicorn_pid'] == {'supervisor.conf'}
+    assert res['port'] == {
+        'nginx-app.conf', 'supervisor.conf', 'nginx-upstream.conf', 'config.ini',
+        'varnish_site.vcl'}
+    assert res['blue_green'] == {'nginx-app.conf'}
+
+
+def test_diff(config, changed):
+    res = {d.name: d for d in diff.diff(config, changed)}
+    assert set(res['testapp'].changes) == {'workers', 'require_pip'}
+    assert res['testapp'].templates == {'config.ini'}
+    assert res['testapp'].steps == {'require_config', 'require_venv', 'pip_freeze'}
+    assert res['testapppublic'].steps == {'deploy'}
+    assert res['testapppublic'].hosts == ['spam.eggs', 'vbox']
+    assert res['new'].status == 'added' and res['new'].steps == {'deploy'}
+
+    res = {d.name: d for d in diff.diff(changed, config)}
+    assert res['new'].status == 'removed' and res['new'].steps == {'uninstall'}
+
+    assert diff.diff(config, Config(config)) == []
+
+
+def test_load_revision(testdir):
+    assert 'testapp' in diff.load_revision(config_file=testdir / 'apps.ini')
+    assert 'wals3' in diff.load_revision('HEAD')
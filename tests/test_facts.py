@@ -0,0 +1,40 @@
+# test_facts.py
+
+import subprocess
+
+from appconfig import facts
+
+
+def test_parse():
+    res = facts.Facts().parse(
+        'distrib_id\tUbuntu\r\ncodename\tfocal\nphp\t\npostgres\t12\ndeb\tnginx\n'
+        'build\tb-1\npath\t/a b\t1\npath\t/c\t0\nclld_dir\t/venv\t/venv/clld\nclld_dir\t/other\t\n')
+    assert res.distrib_id == 'Ubuntu' and res.codename == 'focal' and res.php is None
+    assert res.postgres == ['12'] and res.debs == {'nginx'} and res.builds == {'b-1'}
+    assert res.paths == {'/a b': True, '/c': False}
+    assert res.clld_dirs == {'/venv': '/venv/clld', '/other': None}
+
+
+def test_script(tmp_path):
+    tmp_path.joinpath('a file').write_text('')
+    out = subprocess.check_output(
+        ['bash', '-c', facts.script(paths=[tmp_path / 'a file', tmp_path / 'x'], venvs=['/x'])],
+        universal_newlines=True)
+    res = facts.Facts().parse(out)
+    assert res.paths == {str(tmp_path / 'a file'): True, str(tmp_path / 'x'): False}
+    assert res.clld_dirs == {'/x': None}
+    assert 'bash' in res.debs or not res.debs  # Not all hosts running the tests use dpkg.
+
+
+def test_get(host_facts):
+    res = facts.get(paths=['/a'])
+    assert res.codename == 'xenial' and res.paths == {'/a': False}
+    assert facts.get(paths=['/a']) is res and host_facts.call_count == 1
+
+    # Only the missing facts are gathered:
+    assert not facts.exists('/b')
+    assert host_facts.call_args[0][0].startswith('if [ -e /b ]')
+
+    res.add_debs(['npm'])
+    assert 'npm' not in facts.refresh().debs
+    assert set(facts.get().paths) == {'/a', '/b'} and host_facts.call_count == 3
@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+import collections
+import concurrent.futures
+
+import pytest
+
+from appconfig import fleet
+
+
+@pytest.fixture
+def apps(config):
+    res = [config['testapp'], config['testapppublic']]
+    for i in range(4):
+        res.append(config['testapp'].replace(
+            name='app{0}'.format(i), port=str(1000 + i), production='h{0}'.format(i % 2)))
+    return res
+
+
+def test_Answers(mocker):
+    answers = fleet.Answers([('Recreate database', False)])
+    assert answers.confirm('Recreate database?', default=True) is False
+    assert answers.confirm('Upgrade database?', default=False) is False
+    assert answers.prompt('Blog host:', default='x') == 'x'
+    assert answers.confirm('Recreate secret key?', default=True) is False
+    assert fleet.Answers({'Recreate secret key': True}).confirm('Recreate secret key?') is True
+
+    mocker.patch.dict(os.environ, {'APPCONFIG_PWD_ADMIN': 'pwd', 'APPCONFIG_PWD_APP': ''})
+    assert answers.getpwd('admin') == 'pwd'
+    assert answers.getpwd('app', accept_empty=True) is None
+    with pytest.raises(RuntimeError):
+        answers.getpwd('app')
+    with pytest.raises(RuntimeError):
+        answers.getpwd('other', accept_empty=True)
+
+
+def test_noninteractive():
+    from appconfig.tasks import deployment
+    from appconfig import helpers
+
+    confirm = deployment.confirm
+    with fleet.noninteractive(fleet.Answers({'Upgrade': False})):
+        assert deployment.confirm('Upgrade database?') is False
+        with pytest.raises(RuntimeError):
+            helpers.getpwd('nonuser')
+    assert deployment.confirm is confirm
+
+
+def test_deploy(apps):
+    lock = threading.Lock()
+    running, max_running = collections.Counter(), collections.Counter()
+
+    def worker(task, app, environment, answers):
+        host = getattr(app, environment)
+        with lock:
+            running[host] += 1
+            running['all'] += 1
+            for k in (host, 'all'):
+                max_running[k] = max(max_running[k], running[k])
+        time.sleep(0.02)
+        with lock:
+            running[host] -= 1
+            running['all'] -= 1
+        if app.name == 'app3':
+            raise ValueError()
+        return fleet.Result(app.name, host, True, 0.02, '')
+
+    res = fleet.deploy(
+        apps, 'production', parallel=3, per_host=1,
+        executor_cls=concurrent.futures.ThreadPoolExecutor, worker=worker)
+    assert len(res) == len(apps)
+    assert max_running['all'] <= 3
+    assert all(max_running[h] == 1 for h in ['vbox', 'h0', 'h1'])
+    assert [r.app for r in res if not r.ok] == ['app3']
+
+    res = fleet.deploy(
+        apps, 'test', executor_cls=concurrent.futures.ThreadPoolExecutor, worker=worker)
+    assert [r.error for r in res if r.app == 'testapppublic'] == ['no test host']
+
+
+def test_run_task(mocker, app):
+    execute = mocker.patch('fabric.api.execute')
+    mocker.patch('appconfig.fleet.os.chdir')
+    res = fleet.run_task('deploy', app, 'production', fleet.Answers())
+    assert res.ok and res.host == app.production
+    assert execute.call_args[1]['hosts'] == [app.production]
+
+    execute.side_effect = SystemExit('aborted')
+    res = fleet.run_task('deploy', app, 'production', fleet.Answers())
+    assert not res.ok and 'aborted' in res.error
+
+
+def test_remote_lock(mocker, app):
+    sudo = mocker.patch('fabric.api.sudo', return_value=mocker.Mock(failed=False))
+    with fleet.remote_lock(app):
+        pass
+    assert sudo.call_args[0][0].startswith('rmdir')
+
+    sudo.return_value = mocker.Mock(failed=True)
+    with pytest.raises(RuntimeError, match='locked'):
+        with fleet.remote_lock(app):
+            pass  # pragma: no cover
@@ -0,0 +1,93 @@
+# test_pgindex.py
+
+import os
+import subprocess
+
+import pytest
+
+from appconfig import pgindex
+
+PSQL = """#!/bin/bash
+# Answers the queries of pgindex.FUNCTION like a database in which the index is $STATE.
+sql="${@: -1}"
+echo "$sql" >> "$LOG"
+case "$sql" in
+  *"SELECT CASE"*) echo "$STATE" ;;
+  *"CREATE INDEX"*) exit $CREATE_RC ;;
+  *pg_relation_size*) echo 8192 ;;
+  *EXPLAIN*) echo "$PLAN" ;;
+esac
+"""
+
+
+@pytest.fixture
+def psql(tmp_path, monkeypatch):
+    exe = tmp_path / 'bin' / 'psql'
+    exe.parent.mkdir()
+    exe.write_text(PSQL)
+    exe.chmod(0o755)
+    monkeypatch.setenv('PATH', '{0}{1}{2}'.format(exe.parent, os.pathsep, os.environ['PATH']))
+    monkeypatch.setenv('LOG', str(tmp_path / 'log'))
+    monkeypatch.setenv('CREATE_RC', '0')
+
+    def run(state,
+            target=pgindex.Target('value', 'name', 'de@collation=phonebook;x'),
+            plan='Index Scan using collkey_value_name_de_collation_phonebook_x on value'):
+        monkeypatch.setenv('STATE', state)
+        monkeypatch.setenv('PLAN', plan)
+        out = subprocess.check_output(
+            ['bash', '-c', pgindex.script('db', [target])], universal_newlines=True)
+        return pgindex.parse(out, [target])[0], (tmp_path / 'log').read_text()
+
+    return run
+
+
+def test_index_name():
+    assert pgindex.index_name(pgindex.Target('value', 'name', 'de@co=x')) == \
+        'collkey_value_name_de_co_x'
+    long = pgindex.index_name(pgindex.Target('t' * 40, 'c' * 20, 'root'))
+    assert len(long) == 63 and long != pgindex.index_name(pgindex.Target('t' * 40, 'c' * 21, 'x'))
+
+
+def test_script(psql, monkeypatch):
+    res, log = psql('none')
+    assert res.status == 'CREATED' and res.size == 8192 and res.used
+    assert "(collkey(name, 'de@collation=phonebook;x'))" in log and 'DROP' not in log
+
+    res, log = psql('invalid')
+    assert res.status == 'CREATED' and 'DROP INDEX CONCURRENTLY' in log
+
+    assert psql('valid')[0].status == 'EXISTS'
+    assert psql('missing')[0].status == 'MISSING'
+    assert psql('missing')[0].used is None
+    assert psql('valid', plan='Sort\n  ->  Seq Scan on value')[0].used is False
+
+    monkeypatch.setenv('CREATE_RC', '1')
+    assert psql('none')[0].status == 'FAILED'
+
+
+def test_script_trgm(psql):
+    res, log = psql(
+        'none',
+        target=pgindex.TrgmTarget('value', 'name'),
+        plan='Bitmap Heap Scan on value\n  ->  Bitmap Index Scan on trgm_value_name')
+    assert res.status == 'CREATED' and res.used
+    assert 'USING gin (f_unaccent(name) gin_trgm_ops)' in log
+    assert "SET enable_seqscan = off; EXPLAIN SELECT 1 FROM value WHERE f_unaccent(name)" in log
+
+
+def test_require(mocker, app, capsys):
+    sudo = mocker.patch(
+        'appconfig.pgindex.sudo',
+        return_value='noise\nINDEX collkey_language_name_root CREATED 1500 16384 yes\n'
+                     'INDEX trgm_value_name EXISTS 0 8192 no')
+    assert pgindex.require(app) == []
+    assert not sudo.called
+
+    res = pgindex.require(app.replace(
+        pg_collkey_indexes='language.name value.name:de', pg_trgm_indexes='value.name'))
+    assert [r.status for r in res] == ['CREATED', 'FAILED', 'EXISTS']
+    assert [r.used for r in res] == [True, None, False]
+    assert res[0].seconds == 1.5 and sudo.call_args[1]['user'] == 'postgres'
+    out = capsys.readouterr()[0]
+    assert 'language.name:root' in out and 'value.name (trgm)' in out
@@ -0,0 +1,72 @@
+# test_probe.py
+
+import json
+import shutil
+import threading
+import subprocess
+import http.server
+
+import pytest
+
+from appconfig import probe, trace
+
+pytestmark = pytest.mark.skipif(not shutil.which('curl'), reason='requires curl')
+
+
+@pytest.fixture
+def shell(mocker):
+    # Run the generated script in a local shell.
+    def execute(script, **kw):
+        return subprocess.run(
+            ['bash', '-c', script], stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    return mocker.patch('appconfig.probe.run', side_effect=execute)
+
+
+@pytest.fixture
+def server():
+    # An app server which fails the first two requests while starting up.
+    class Handler(http.server.BaseHTTPRequestHandler):
+        requests = 0
+
+        def do_GET(self):
+            Handler.requests += 1
+            ready = Handler.requests > 2
+            self.send_response(200 if ready else 503)
+            self.end_headers()
+            if ready:
+                self.wfile.write(json.dumps({'status': 'ok'}).encode('utf8'))
+
+        def log_message(self, *args):
+            pass
+
+    srv = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{0}/_ping'.format(srv.server_port)
+    srv.shutdown()
+
+
+def test_probe(shell, server):
+    res = probe.probe({'local': server}, deadline=10, timeout=2, delay=0.01)
+    assert shell.call_count == 1
+    r = res['local']
+    assert r.ready and r.tries == 3 and r.status == '200'
+    assert 0.03 <= r.seconds < 10 and r.latency >= 0
+
+
+def test_probe_deadline(shell, server, tmp_path, monkeypatch):
+    monkeypatch.setenv(trace.ENV_VAR, str(tmp_path / 'trace.json'))
+    res = probe.probe(
+        {'local': server, 'down': 'http://127.0.0.1:1/_ping'}, deadline=2, timeout=1, delay=0.1)
+    assert res['local'].ready
+    assert not res['down'].ready and res['down'].status == '000' and res['down'].tries >= 2
+    assert res['down'].seconds <= 2
+    events = {e['name']: e['args'] for e in trace.load()}
+    assert events['ready:local']['ready'] and not events['ready:down']['ready']
+
+
+def test_parse():
+    targets = {'a': 'http://a', 'b': 'http://b'}
+    res = probe.parse('noise\nREADY a 1500 0,012 2 200\n', targets)
+    assert res['a'].seconds == 1.5 and res['a'].latency == 0.012
+    assert not res['b'].ready and res['b'].tries == 0
@@ -0,0 +1,94 @@
+# test_state.py
+
+import json
+
+import pytest
+
+from appconfig.tasks import state
+
+
+class Result(str):
+
+    def __new__(cls, s, failed=False):
+        res = str.__new__(cls, s)
+        res.failed, res.succeeded = failed, not failed
+        return res
+
+
+@pytest.fixture
+def remote(mocker):
+    sudo = mocker.patch('appconfig.tasks.state.sudo', return_value=Result('', failed=True))
+    req = mocker.patch('appconfig.tasks.state.require')
+    return sudo, req
+
+
+def test_git_head(mocker):
+    local = mocker.patch('appconfig.tasks.state.local', return_value=Result('abc\tHEAD\n'))
+    assert state.git_head('clld>=7') == ''
+    assert state.git_head('git+https://github.com/clld/wals3.git#egg=wals3') == 'abc'
+    assert 'HEAD' in local.call_args[0][0]
+    sha = 40 * 'a'
+    assert state.git_head('git+https://github.com/clld/wals3.git@{0}#egg=wals3'.format(sha)) == sha
+
+    local.return_value = Result('', failed=True)
+    assert state.git_head('git+https://github.com/clld/wals3.git@v1#egg=wals3') is None
+
+
+def test_RemoteState(app, remote):
+    sudo, req = remote
+    s = state.RemoteState(app).load()
+    assert s.fingerprints == {}
+
+    sudo.return_value = Result('not json')
+    assert state.RemoteState(app).load().fingerprints == {}
+
+    sudo.return_value = Result(json.dumps({'venv': 'x'}))
+    s = state.RemoteState(app).load()
+    assert s.unchanged('venv', 'x')
+    assert not s.unchanged('venv', 'y')
+    assert not s.unchanged('venv', None)
+    assert not state.RemoteState(app, force=True).load().unchanged('venv', 'x')
+
+    s.save()
+    assert json.loads(req.file.call_args[1]['contents']) == {'venv': 'x'}
+    assert req.file.call_args[0][0].endswith(state.STATE_FILE)
+
+
+def test_RemoteState_step(app, remote, mocker):
+    func = mocker.Mock()
+    s = state.RemoteState(app)
+    step = s.step('venv', func, lambda: 'x')
+    assert step() == {'venv': 'x'}
+    assert func.call_count == 1
+
+    s.update([step(), None])
+    assert s.fingerprints == {'venv': 'x'}
+    assert step() == {}
+    assert func.call_count == 2
+
+    # Steps without fingerprint are always run:
+    step = s.step('reload', func)
+    assert step() == {} and step() == {}
+    assert func.call_count == 4
+
+
+def test_sudo_upload_template(app, remote, mocker):
+    from appconfig.tasks import deployment
+
+    put = mocker.patch('appconfig.upload.put')
+    mocker.patch('appconfig.upload.sudo')
+    s = state.RemoteState(app)
+    mocker.patch('appconfig.tasks.state.ACTIVE', s)
+
+    upload = s.step('t', lambda: deployment.sudo_upload_template(
+        '503.html', '/tmp/503.html', app_name=app.name, timestamp='now'))
+    s.update([upload()])
+    assert put.call_count == 1
+    assert 'template:/tmp/503.html' in s.fingerprints
+
+    upload()
+    assert put.call_count == 1
+
+    deployment.sudo_upload_template(
+        '503.html', '/tmp/503.html', app_name=app.name, timestamp='later')
+    assert put.call_count == 2
@@ -1,9 +1,28 @@
+import io
+import tarfile
+
 from appconfig import systemd
 
 
-def test_enable(app, testdir, mocker):
-    files = mocker.Mock(upload_template=mocker.Mock())
-    mocker.patch('appconfig.systemd.files', files)
-    mocker.patch('appconfig.systemd.sudo')
+def test_enable(app, testdir, mocker, coalesced):
+    put = mocker.patch('appconfig.upload.put')
+    sudo = mocker.patch('appconfig.upload.sudo')
     systemd.enable(app, testdir / 'systemd')
-    assert files.upload_template.call_count == 3
+    assert put.call_count == sudo.call_count == 1
+    with tarfile.open(fileobj=io.BytesIO(put.call_args[0][0].getvalue())) as tar:
+        assert len(tar.getnames()) == 3
+    assert coalesced['sudo'].call_count == 1
+    assert 'systemctl enable testapp-unit.timer' in coalesced['sudo'].call_args[0][0]
+
+
+def test_uninstall(app, testdir, coalesced):
+    systemd.uninstall(app, testdir / 'systemd')
+    assert coalesced['sudo'].call_count == 1
+
+
+def test_upload_template(app, testdir, mocker):
+    put_file = mocker.patch('appconfig.systemd.upload.put_file')
+    systemd.upload_template(
+        testdir / 'systemd' / 'unit' / 'script', '/usr/bin/x', {'app': app}, mode='755')
+    assert put_file.call_args[0][0] == '/usr/bin/x'
+    assert put_file.call_args[1]['mode'] == '755'
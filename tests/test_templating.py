@@ -0,0 +1,45 @@
+# test_templating.py
+
+import os
+
+import pytest
+
+from appconfig import templating
+
+
+@pytest.fixture
+def tdir(tmp_path):
+    tmp_path.joinpath('t.conf').write_text('{{ x }}', encoding='utf8')
+    tmp_path.joinpath('app').mkdir()
+    tmp_path.joinpath('app', 't.conf').write_text('app {{ x }}', encoding='utf8')
+    templating.cache_clear()
+    yield tmp_path
+    templating.cache_clear()
+
+
+def test_render(tdir):
+    assert templating.render('t.conf', {'x': 1}, directory=tdir) == '1'
+    assert templating.render('t.conf', {'x': 1}, app_name='app', directory=tdir) == 'app 1'
+    assert templating.render('t.conf', {'x': 1}, app_name='other', directory=tdir) == '1'
+    assert templating.template_dir.cache_info().hits == 0
+    templating.render('t.conf', {'x': 2}, app_name='app', directory=tdir)
+    assert templating.template_dir.cache_info().hits == 1
+
+
+def test_render_cached(tdir):
+    env = templating.environment(tdir)
+    assert templating.environment(tdir) is env
+    t = env.get_template('t.conf')
+    assert env.get_template('t.conf') is t
+
+    p = tdir / 't.conf'
+    p.write_text('new {{ x }}', encoding='utf8')
+    mtime = p.stat().st_mtime + 10
+    os.utime(str(p), (mtime, mtime))
+    assert templating.render_path(p, {'x': 1}) == 'new 1'
+    assert env.get_template('t.conf') is not t
+
+
+def test_render_config(app):
+    res = templating.render('config.ini', {'app': app, 'workers': 3, 'env': {}})
+    assert app.name in res
@@ -0,0 +1,56 @@
+# test_trace.py
+
+import io
+import json
+
+import fabric.api
+import fabric.operations
+
+from appconfig import trace, dag
+
+
+def test_tracing(tmp_path, capsys):
+    original = fabric.api.local
+    p = tmp_path / 'trace.json'
+
+    def step():
+        assert fabric.api.local('echo hello', capture=True) == 'hello'
+
+    with trace.tracing(p):
+        assert fabric.api.local is not original
+        assert fabric.operations.local is fabric.api.local
+        trace.set_app('app')
+        with trace.step('outer'):
+            fabric.api.local('true')
+        dag.Graph([dag.Step('a', step), dag.Step('b', step, inputs=['a'])]).run()
+        trace.set_app(None)
+    assert fabric.api.local is original
+    assert not trace.enabled()
+
+    events = json.loads(p.read_text(encoding='utf8'))['traceEvents']
+    assert {e['name'] for e in events} == {'local', 'step:outer', 'step:a', 'step:b'}
+    hello = [e for e in events if e['name'] == 'local' and e['cat'] == 'a'][0]
+    assert hello['args']['bytes'] == 5 and hello['args']['app'] == 'app'
+    assert hello['args']['command'] == 'echo hello'
+
+    out, _ = capsys.readouterr()
+    assert 'app:a' in out and 'trace written' in out
+    rows = {r[0]: r for r in trace.summary(events)}
+    assert rows['app:b'][1] == 1
+
+
+def test_transferred(tmp_path):
+    p = tmp_path / 'f'
+    p.write_bytes(b'abc')
+    assert trace._transferred('put', (str(p), '/tmp/f'), {}, None) == 3
+    assert trace._transferred('put', (), {'local_path': io.BytesIO(b'ab')}, None) == 2
+    assert trace._transferred('put', (io.StringIO('ä'),), {}, None) == 2
+    assert trace._transferred('get', ('/tmp/f',), {}, [str(p)]) == 3
+    assert trace._transferred('confirm', ('ok?',), {}, True) == 0
+
+
+def test_disabled(tmp_path):
+    original = fabric.api.local
+    trace.install()
+    with trace.tracing():
+        assert fabric.api.local is original
@@ -0,0 +1,88 @@
+# test_upload.py
+
+import io
+import tarfile
+
+import pytest
+
+from appconfig import upload
+
+
+@pytest.fixture
+def remote(mocker):
+    return mocker.patch('appconfig.upload.put'), mocker.patch('appconfig.upload.sudo')
+
+
+def test_Batch(remote):
+    put, sudo = remote
+    b = upload.Batch()
+    assert b.upload() == {}
+    assert not put.called
+
+    b.add('/etc/x.conf', 'äx', mode='600', user='app', fingerprint=('template:/etc/x.conf', 'a'))
+    b.add('/etc/y conf', 'y')
+    with tarfile.open(fileobj=io.BytesIO(b.archive())) as tar:
+        x = tar.getmember('etc/x.conf' + upload.STAGING_SUFFIX)
+        assert x.mode == 0o600
+        assert tar.extractfile(x).read().decode('utf8') == 'äx'
+        assert tar.getmember('etc/y conf' + upload.STAGING_SUFFIX).mode == 0o644
+
+    script = b.script('/tmp/a.tgz', 'root')
+    assert script.startswith('set -e; tar')
+    assert "chown app: /etc/x.conf.appconfig-new" in script
+    assert "mv -f '/etc/y conf.appconfig-new' '/etc/y conf'" in script
+    # All files are staged before the first one is moved into place:
+    assert script.index('chown root') < script.index('mv -f')
+
+    assert b.upload() == {'template:/etc/x.conf': 'a'}
+    assert put.call_count == sudo.call_count == 1
+    assert b.round_trips == [2, 9]
+    assert len(b) == 0
+
+
+def test_batch(remote, mocker):
+    put, _ = remote
+    assert upload.pending() is None
+    with upload.batch() as b:
+        assert upload.pending() is b
+        b.add('/etc/x.conf', 'x')
+        mocker.patch('appconfig.upload.os.getpid', return_value=-1)
+        assert upload.pending() is None  # Not in a forked process.
+    assert upload.ACTIVE is None
+    assert put.call_count == 1
+
+    with pytest.raises(ValueError):
+        with upload.batch() as b:
+            b.add('/etc/x.conf', 'x')
+            raise ValueError()
+    assert put.call_count == 1
+
+
+def test_sudo_upload_template(app, remote, mocker):
+    from appconfig.tasks import deployment
+
+    put, _ = remote
+    with upload.batch() as b:
+        deployment.sudo_upload_template(
+            '503.html', '/tmp/503.html', app_name=app.name, timestamp='now')
+        assert 'now' in b.files['/tmp/503.html'].content
+        assert not put.called
+    assert put.call_count == 1
+
+
+def test_put_file(remote):
+    put, sudo = remote
+    upload.put_file('/etc/x.conf', 'x', mode='600')
+    assert put.call_count == sudo.call_count == 1
+    assert 'chown' in sudo.call_args[0][0]
+
+
+def test_relative_dest(remote):
+    from fabric.api import cd
+
+    b = upload.Batch()
+    with pytest.raises(ValueError):
+        b.add('Makefile', 'x')
+    with cd('/tmp'):
+        b.add('Makefile', 'x')
+    assert '/tmp/Makefile' in b.files
@@ -0,0 +1,113 @@
+import pytest
+
+from appconfig import validation
+from appconfig.config import Config
+
+
+@pytest.fixture
+def apps(config):
+    return Config(config)
+
+
+def _messages(report, check):
+    return [r.message for r in report.results if r.check == check]
+
+
+def test_validate(apps):
+    report = validation.validate(apps, use_cache=False)
+    assert not report.errors
+    assert _messages(report, 'fabfile_dir') == [
+        'missing fabfile dir: testapp', 'missing fabfile dir: testapppublic']
+    assert set(report.timings) == set(validation.CHECKS)
+
+
+def test_validate_errors(apps):
+    apps['testapppublic'] = apps['testapppublic'].replace(
+        port='80', domain=apps['testapp'].domain, venv_dir='/home/testapp/venv',
+        require_deb='ok Not_OK')
+    report = validation.validate(apps, use_cache=False)
+    assert _messages(report, 'port_range') == ['port 80 not in range 1024-65535']
+    assert _messages(report, 'duplicate_domains')
+    assert 'nested' in _messages(report, 'path_collisions')[0]
+    assert _messages(report, 'deb_package_names') == [
+        "invalid package name in require_deb: 'Not_OK'"]
+    with pytest.raises(ValueError, match='port 80'):
+        apps.validate(use_cache=False)
+
+
+def test_validate_blue_green_ports(apps):
+    apps['testapp'] = apps['testapp'].replace(blue_green='true')
+    assert not validation.validate(apps, use_cache=False).errors
+
+    green = apps['testapp'].blue_green_ports[1]
+    apps['testapppublic'] = apps['testapppublic'].replace(port=str(green))
+    report = validation.validate(apps, use_cache=False)
+    assert _messages(report, 'blue_green_ports') == [
+        'green port %s used by testapppublic' % green]
+
+    apps['testapp'] = apps['testapp'].replace(port='65000')
+    report = validation.validate(apps, use_cache=False)
+    assert _messages(report, 'blue_green_ports') == ['green port 66000 not in range 1024-65535']
+
+
+def test_validate_cache(apps, mocker):
+    validation.validate(apps)
+    spy = mocker.spy(validation, '_call')
+    report = validation.validate(apps)
+    # Only config checks and uncached app checks are run again:
+    assert spy.call_count == len(
+        [c for c in validation.CHECKS.values() if c.scope == 'config']) + 2 * len(
+        [c for c in validation.CHECKS.values() if c.scope == 'app' and not c.cached])
+    assert report.timings['port_range'][2] == 2
+
+    apps['testapp'] = apps['testapp'].replace(port='1')
+    report = validation.validate(apps)
+    assert report.timings['port_range'][1:] == [1, 1]
+    assert _messages(report, 'port_range')
+
+
+def test_broken_check(apps, mocker):
+    mocker.patch.dict(validation.CHECKS, {})
+    validation.check('broken')(lambda app: 1 / 0)
+    report = validation.validate(apps, use_cache=False)
+    assert report.errors[0].message.startswith('check broken failed')
+
+
+def test_systemd_dir(tmp_path, app, mocker):
+    d = tmp_path / 'testapp' / 'systemd'
+    d.joinpath('ok').mkdir(parents=True)
+    d.joinpath('ok', 'service').write_text('')
+    d.joinpath('empty').mkdir()
+    d.joinpath('timer').mkdir()
+    d.joinpath('timer', 'timer').write_text('')
+    d.joinpath('timer', 'README').write_text('')
+    d.joinpath('file').write_text('')
+    mocker.patch('appconfig.APPS_DIR', tmp_path)
+    assert list(validation.systemd_dir(app)) == [
+        'systemd unit empty has neither service nor timer',
+        'systemd unit is not a directory: file',
+        'systemd unit timer has a timer but no service',
+        'systemd unit timer has unknown files: README',
+    ]
+
+
+def test_validate_pg_collkey_indexes(apps):
+    apps['testapp'] = apps['testapp'].replace(pg_collkey_indexes='language.name value.name:de')
+    assert not validation.validate(apps, use_cache=False).errors
+
+    apps['testapp'] = apps['testapp'].replace(pg_collkey='false', pg_collkey_indexes='Language')
+    report = validation.validate(apps, use_cache=False)
+    assert _messages(report, 'pg_collkey_indexes') == [
+        "invalid collkey index target (table.column[:locale]): 'Language'",
+        'collkey indexes require pg_collkey']
+
+
+def test_validate_pg_trgm_indexes(apps):
+    apps['testapp'] = apps['testapp'].replace(pg_trgm_indexes='language.name')
+    assert not validation.validate(apps, use_cache=False).errors
+
+    apps['testapp'] = apps['testapp'].replace(pg_unaccent='false', pg_trgm_indexes='value.name:de')
+    report = validation.validate(apps, use_cache=False)
+    assert _messages(report, 'pg_trgm_indexes') == [
+        "invalid trigram index target (table.column): 'value.name:de'",
+        'trigram indexes require pg_unaccent']
@@ -0,0 +1,93 @@
+# test_venvsync.py
+
+import sys
+import json
+import subprocess
+
+import pytest
+
+from appconfig import venvsync
+
+SHA = '83b243b4a450465d185486c90b35157cb2572e2f'
+
+
+@pytest.fixture
+def lockfile(tmp_path):
+    p = tmp_path / 'requirements.txt'
+    p.write_text("""\
+-e git+https://github.com/clld/abvd.git@{0}#egg=abvd
+alembic==1.4.2
+Babel==2.8.0
+zope.sqlalchemy==1.3
+pkg-resources==0.0.0
+pyglottolog @ git+https://github.com/glottolog/pyglottolog@{0}
+""".format(SHA), encoding='utf8')
+    return p
+
+
+def test_read(lockfile):
+    lock = venvsync.read(lockfile)
+    assert list(lock) == [
+        'abvd', 'alembic', 'babel', 'zope-sqlalchemy', 'pkg-resources', 'pyglottolog']
+    assert lock['abvd'].editable and lock['abvd'].commit == SHA
+    assert lock['babel'].version == '2.8.0'
+    assert lock['pyglottolog'].url == 'git+https://github.com/glottolog/pyglottolog@' + SHA
+
+
+def test_delta(lockfile):
+    lock = venvsync.read(lockfile)
+    installed = {
+        'abvd': {'version': '1.0', 'editable': True, 'commit': SHA},
+        'alembic': {'version': '1.4.1', 'editable': False, 'commit': None},
+        'Babel': {'version': '2.8.0', 'editable': False, 'commit': None},
+        'zope.sqlalchemy': {'version': '1.3', 'editable': False, 'commit': None},
+        'pip': {'version': '20.0', 'editable': False, 'commit': None},
+        'requests': {'version': '2.0', 'editable': False, 'commit': None},
+        'pyglottolog': {
+            'version': '3.2', 'editable': False, 'commit': None, 'url': lock['pyglottolog'].url},
+    }
+    assert venvsync.delta(lock, installed) == (['alembic==1.4.2'], ['requests'])
+
+    installed['abvd']['commit'] = 'x'
+    assert lock['abvd'].line in venvsync.delta(lock, installed)[0]
+
+    # Direct references are reinstalled if installed from another URL or commit:
+    installed['pyglottolog']['url'] = 'git+https://github.com/glottolog/pyglottolog@x'
+    assert lock['pyglottolog'].line in venvsync.delta(lock, installed)[0]
+    del installed['pyglottolog']['url']
+    assert lock['pyglottolog'].line in venvsync.delta(lock, installed)[0]
+
+
+def test_installed_script():
+    # The listing of installed distributions runs with the local python, too.
+    out = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-'], input=venvsync.INSTALLED, stdout=subprocess.PIPE,
+        universal_newlines=True).stdout
+    res = json.loads(out)
+    assert res['pytest']['editable'] is False
+
+
+def test_sync(mocker, lockfile):
+    lock = venvsync.read(lockfile)
+    listings = [
+        {k: {'version': r.version, 'editable': r.editable, 'commit': r.commit, 'url': r.url}
+         for k, r in lock.items() if k not in ('alembic', 'pyglottolog')},
+        {k: {'version': r.version, 'editable': r.editable, 'commit': r.commit, 'url': r.url}
+         for k, r in lock.items()},
+    ]
+    listings[0]['requests'] = {'version': '2.0', 'editable': False, 'commit': None}
+    mocker.patch('appconfig.venvsync.installed', side_effect=listings)
+    sudo = mocker.patch('appconfig.venvsync.sudo')
+    install = mocker.patch('appconfig.venvsync.wheelhouse.install')
+
+    direct = 'pyglottolog @ git+https://github.com/glottolog/pyglottolog@' + SHA
+    assert venvsync.sync('/venv', lockfile) == (['alembic==1.4.2', direct], ['requests'])
+    assert 'uninstall -q -y requests' in sudo.call_args[0][0]
+    # The direct reference is one argument of pip:
+    install.assert_called_once_with(
+        '/venv', ['alembic==1.4.2', "'{0}'".format(direct)], no_deps=True)
+
+    # Verification fails, if the virtualenv still differs from the lock file:
+    mocker.patch('appconfig.venvsync.installed', return_value={})
+    with pytest.raises(SystemExit):
+        venvsync.sync('/venv', lockfile)
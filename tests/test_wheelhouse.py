@@ -0,0 +1,55 @@
+# test_wheelhouse.py
+
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+from appconfig import wheelhouse
+
+
+def test_script():
+    script = wheelhouse.script(
+        '/usr/venvs/app', ['-e git+https://github.com/clld/app.git#egg=app', '"gunicorn<20"'],
+        wheelhouse='/wh')
+    assert '/usr/venvs/app/bin/pip install -q --no-index --find-links /wh "gunicorn<20"' in script
+    assert '/usr/venvs/app/bin/pip install -q --find-links /wh -e git+' in script
+    assert 'find /wh -name "*.whl" -mtime +60 -delete' in script
+
+
+def test_sync(tmp_path):
+    # Run the script reporting the wheelhouse usage with the local python.
+    import pytest as pkg
+
+    version = pkg.__version__
+    old = tmp_path / 'pytest-{0}-py3-none-any.whl'.format(version)
+    old.write_text('')
+    os.utime(str(old), (time.time() - 3600, time.time() - 3600))
+    res = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-', str(tmp_path), str(time.time() - 60)],
+        input=wheelhouse.SYNC, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    stats = wheelhouse.parse(res)
+    assert 'HIT pytest' in res.splitlines()
+    assert stats.hits == 1 and stats.misses == len(stats.missing) > 0
+    assert old.stat().st_mtime > time.time() - 60  # Marked as used.
+
+
+def test_install(mocker, capsys):
+    sudo = mocker.patch(
+        'appconfig.wheelhouse.sudo', return_value='HIT lxml\nHIT clld\nMISS csvw\nMISSING a==1')
+    stats = wheelhouse.install('/usr/venvs/app', ['clld'])
+    assert stats == (2, 2, ['a==1'])
+    assert sudo.call_count == 1
+    assert '2 of 4 packages cached (50%)' in capsys.readouterr()[0]
+
+
+@pytest.mark.parametrize('req,cacheable', [
+    ('lxml', True),
+    ('"gunicorn<20"', True),
+    ('-e git+https://github.com/clld/wals3.git#egg=wals3', False),
+    ('git+https://github.com/clld/clld.git', False),
+])
+def test_cacheable(req, cacheable):
+    assert wheelhouse.cacheable(req) == cacheable